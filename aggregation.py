@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Aggregation - Vectorized aggregation of Google Trends series shared by the analyzers, plotter and verifier.
+Every function works on a wide matrix (a DatetimeIndex and one column per keyword) and aggregates all
+keyword columns in one pass, whether the matrix holds one 5-keyword batch or a whole stored corpus.
+"""
+
+import argparse
+from typing import List, Optional
+import pandas as pd
+
+from timeseries_store import TimeseriesStore
+from metrics import REGISTRY, timed
+
+NON_KEYWORD_COLUMNS = ('isPartial', 'date', 'month', 'year')
+
+def keyword_columns(data: pd.DataFrame) -> List[str]:
+    """Return the keyword columns of a frame, skipping 'isPartial' and helper columns."""
+    return [column for column in data.columns if column not in NON_KEYWORD_COLUMNS]
+
+@timed('aggregation_seconds', step='resample')
+def resample_matrix(data: pd.DataFrame, freq: str = 'M', how: str = 'median') -> pd.DataFrame:
+    """
+    Aggregate every keyword column into calendar periods.
+
+    Args:
+        data (pd.DataFrame): Frame indexed by date with a column per keyword
+        freq (str): Pandas period frequency, e.g. 'W', 'M', 'Q' or 'Y' (default: 'M')
+        how (str): Aggregation applied within each period, e.g. 'median', 'mean', 'max' (default: 'median')
+    """
+    columns = keyword_columns(data)
+    periods = pd.DatetimeIndex(data.index).to_period(freq)
+    aggregated = data[columns].groupby(periods).agg(how)
+    aggregated.index = aggregated.index.to_timestamp()
+    aggregated.index.name = 'date'
+    return aggregated
+
+def monthly_median(data: pd.DataFrame) -> pd.DataFrame:
+    """Median of every keyword column per calendar month, indexed by the first day of the month."""
+    return resample_matrix(data, 'M', 'median')
+
+def yearly_median(data: pd.DataFrame) -> pd.DataFrame:
+    """Median of the monthly medians of every keyword column per year, indexed by year."""
+    monthly = monthly_median(data)
+    with REGISTRY.timer('aggregation_seconds', step='yearly_median'):
+        yearly = monthly.groupby(monthly.index.year).median()
+    yearly.index.name = 'year'
+    return yearly
+
+@timed('aggregation_seconds', step='to_long')
+def to_long(table: pd.DataFrame, index_name: str = 'year') -> pd.DataFrame:
+    """Melt a wide aggregate table into rows of (period, value, Keyword), dropping periods without data."""
+    long = table.rename_axis(index=index_name, columns='Keyword').stack().rename('value').reset_index()
+    # stack() keeps missing values from pandas 3 on, so they are dropped explicitly
+    return long.dropna(subset=['value'])[[index_name, 'value', 'Keyword']].reset_index(drop=True)
+
+@timed('aggregation_seconds', step='trailing_mean')
+def trailing_mean(data: pd.DataFrame, months: Optional[int] = None) -> pd.Series:
+    """Mean of every keyword column over the last given months of the series (default: the whole series)."""
+    columns = keyword_columns(data)
+    if months is not None and not data.empty:
+        data = data[data.index > data.index.max() - pd.DateOffset(months=months)]
+    return data[columns].mean()
+
+def aggregate_store(store: TimeseriesStore, geo: str = 'US', keywords: Optional[List[str]] = None,
+                    start: Optional[str] = None, end: Optional[str] = None,
+                    freq: str = 'Y', how: str = 'median') -> pd.DataFrame:
+    """
+    Re-aggregate stored series for a whole corpus into one row per keyword and a column per period.
+
+    With freq 'Y' and how 'median' this reproduces the yearly median of monthly medians reported by
+    keyword_analyzer2.py; other combinations aggregate the raw observations directly.
+    """
+    data = store.read_matrix(keywords, geo, start, end)
+    if freq == 'Y' and how == 'median':
+        table = yearly_median(data)
+    else:
+        table = resample_matrix(data, freq, how)
+        table.index = pd.DatetimeIndex(table.index).to_period(freq).astype(str)
+    return table.T.rename_axis(index='Keyword', columns=None).reset_index()
+
+def main():
+    parser = argparse.ArgumentParser(description='Re-aggregate every series in the time series store')
+    parser.add_argument('--store', default='timeseries_store', help='Time series store directory (default: timeseries_store)')
+    parser.add_argument('--geo', '-g', default='US', help='Geographic region to aggregate (default: US)')
+    parser.add_argument('--output', '-o', default='aggregated_results.csv', help='Output CSV file (default: aggregated_results.csv)')
+    parser.add_argument('--freq', '-f', default='Y', help="Period frequency such as 'M', 'Q' or 'Y' (default: Y)")
+    parser.add_argument('--how', default='median', help="Aggregation such as 'median', 'mean' or 'max' (default: median)")
+    parser.add_argument('--start', help='First date to include (default: start of each series)')
+    parser.add_argument('--end', help='Last date to include (default: end of each series)')
+    args = parser.parse_args()
+
+    results_df = aggregate_store(TimeseriesStore(args.store), args.geo, start=args.start, end=args.end,
+                                 freq=args.freq, how=args.how)
+    print(results_df)
+    results_df.to_csv(args.output, index=False)
+    print(f"\nResults saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
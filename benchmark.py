@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Benchmark - Measure the throughput of the analysis pipelines offline against the fake Trends backend.
+Reports requests issued, wall time, time spent sleeping in the rate limiter, simulated network time,
+CPU time and peak memory for each pipeline and keyword count.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+from contextlib import redirect_stdout
+from typing import Callable, Dict, List
+import pandas as pd
+
+from trends_backend import FakeTrendsBackend
+from rate_limiter import AdaptiveRateLimiter
+from keyword_analyzer import KeywordTrendAnalyzer
+from keyword_analyzer2 import KeywordTrendAnalyzer2
+from orchestrator import orchestrate
+
+PIPELINES = ('analyzer', 'analyzer-batched', 'analyzer2', 'orchestrator')
+TIMEFRAME = '2022-01-01 2025-06-01'
+
+def make_keywords(count: int) -> pd.DataFrame:
+    """Build a synthetic keyword list in the format of keywords.csv."""
+    return pd.DataFrame({'Keyword': [f'keyword {i}' for i in range(count)]})
+
+def run_pipeline(pipeline: str, keywords_df: pd.DataFrame, backend: FakeTrendsBackend,
+                 limiter_factory: Callable[[], AdaptiveRateLimiter], workers: int = 2) -> List[AdaptiveRateLimiter]:
+    """Run one pipeline over the keywords and return the rate limiters it used."""
+    limiters = []
+
+    def new_limiter() -> AdaptiveRateLimiter:
+        limiter = limiter_factory()
+        limiters.append(limiter)
+        return limiter
+
+    if pipeline == 'analyzer':
+        KeywordTrendAnalyzer(limiter=new_limiter(), backend=backend).analyze_keywords(keywords_df)
+    elif pipeline == 'analyzer-batched':
+        KeywordTrendAnalyzer(limiter=new_limiter(), backend=backend).analyze_keywords_batched(keywords_df)
+    elif pipeline == 'analyzer2':
+        KeywordTrendAnalyzer2(limiter=new_limiter(), backend=backend).analyze_keywords(keywords_df, TIMEFRAME)
+    elif pipeline == 'orchestrator':
+        # All sessions share the backend, so its rate limit behaves like a single IP address
+        orchestrate(keywords_df, TIMEFRAME, workers=workers, limiter_factory=new_limiter,
+                    backend_factory=lambda session_id: backend)
+    else:
+        raise ValueError(f"Unknown pipeline: {pipeline}")
+    return limiters
+
+def benchmark(pipeline: str, size: int, backend_options: Dict, limiter_factory: Callable[[], AdaptiveRateLimiter],
+              workers: int = 2, trace_memory: bool = True, verbose: bool = False) -> Dict:
+    """
+    Benchmark one pipeline on a synthetic keyword list and return its measurements.
+
+    Args:
+        pipeline (str): One of PIPELINES
+        size (int): Number of keywords
+        backend_options (dict): Keyword arguments for FakeTrendsBackend (latency, throttle_rate, ...)
+        limiter_factory (callable): Creates the rate limiter of each session
+        workers (int): Number of sessions for the orchestrator
+        trace_memory (bool): Measure peak Python memory with tracemalloc (slows the run down)
+        verbose (bool): Show the pipeline's own output instead of discarding it
+    """
+    keywords_df = make_keywords(size)
+    backend = FakeTrendsBackend(**backend_options)
+    if trace_memory:
+        tracemalloc.start()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    try:
+        if verbose:
+            limiters = run_pipeline(pipeline, keywords_df, backend, limiter_factory, workers)
+        else:
+            with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                limiters = run_pipeline(pipeline, keywords_df, backend, limiter_factory, workers)
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+    return {
+        'pipeline': pipeline,
+        'keywords': size,
+        'requests': backend.requests,
+        'throttled': backend.throttled,
+        'failed': backend.failed,
+        'wall_s': round(wall, 3),
+        'sleep_s': round(sum(limiter.slept for limiter in limiters), 3),
+        'network_s': round(backend.latency_total, 3),
+        'cpu_s': round(cpu, 3),
+        'keywords_per_hour': round(size / wall * 3600) if wall > 0 else None,
+        'peak_mb': round(peak / 1024 / 1024, 1) if peak is not None else None,
+    }
+
+def save_report(report: pd.DataFrame, output_file: str):
+    """Save the report as JSON if the file name ends in .json, otherwise as CSV."""
+    if output_file.endswith('.json'):
+        with open(output_file, 'w') as f:
+            json.dump(report.to_dict('records'), f, indent=2)
+    else:
+        report.to_csv(output_file, index=False)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the analysis pipelines against a local fake Google Trends backend')
+    parser.add_argument('--pipelines', '-p', default=','.join(PIPELINES),
+                      help=f'Comma-separated pipelines to run (default: {",".join(PIPELINES)})')
+    parser.add_argument('--sizes', '-s', default='100,1000,10000',
+                      help='Comma-separated keyword counts (default: 100,1000,10000)')
+    parser.add_argument('--workers', '-n', type=int, default=2, help='Number of sessions for the orchestrator (default: 2)')
+    parser.add_argument('--latency', type=float, default=0.005, help='Simulated seconds per request (default: 0.005)')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Probability of an HTTP 429 response (default: 0)')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Probability of an HTTP 500 response (default: 0)')
+    parser.add_argument('--rate-limit', type=int, help='Requests per --rate-window before every request is throttled')
+    parser.add_argument('--rate-window', type=float, default=60.0, help='Length of the rate limit window in seconds (default: 60)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for throttling and failure injection (default: 0)')
+    parser.add_argument('--interval', type=float, default=0.02, help='Initial seconds between requests (default: 0.02)')
+    parser.add_argument('--min-interval', type=float, default=0.01,
+                      help='Fastest spacing between requests while they keep succeeding (default: 0.01)')
+    parser.add_argument('--max-interval', type=float, default=1.0,
+                      help='Slowest spacing between requests after throttling (default: 1)')
+    parser.add_argument('--no-memory', action='store_true', help='Skip tracemalloc, which slows the pipelines down')
+    parser.add_argument('--output', '-o', help='Save the report to a CSV file, or JSON if the name ends in .json')
+    parser.add_argument('--verbose', '-v', action='store_true', help="Show the pipelines' own output")
+    args = parser.parse_args()
+
+    try:
+        pipelines = [pipeline.strip() for pipeline in args.pipelines.split(',') if pipeline.strip()]
+        unknown = [pipeline for pipeline in pipelines if pipeline not in PIPELINES]
+        if unknown:
+            raise ValueError(f"Unknown pipelines: {', '.join(unknown)}")
+        sizes = [int(size) for size in args.sizes.split(',')]
+    except Exception as e:
+        print(f"Error parsing arguments: {str(e)}")
+        sys.exit(1)
+
+    backend_options = {'seed': args.seed, 'latency': args.latency, 'throttle_rate': args.throttle_rate,
+                       'failure_rate': args.failure_rate, 'rate_limit': args.rate_limit, 'rate_window': args.rate_window}
+
+    def limiter_factory() -> AdaptiveRateLimiter:
+        return AdaptiveRateLimiter(initial_interval=args.interval, min_interval=args.min_interval,
+                                   max_interval=args.max_interval, speedup_step=args.min_interval)
+
+    rows = []
+    for pipeline in pipelines:
+        for size in sizes:
+            print(f"Benchmarking {pipeline} with {size} keywords...")
+            row = benchmark(pipeline, size, backend_options, limiter_factory, workers=args.workers,
+                            trace_memory=not args.no_memory, verbose=args.verbose)
+            print(f"  {row['requests']} requests in {row['wall_s']:.1f}s "
+                  f"(sleeping {row['sleep_s']:.1f}s, network {row['network_s']:.1f}s, CPU {row['cpu_s']:.1f}s)")
+            rows.append(row)
+
+    report = pd.DataFrame(rows)
+    print("\nResults:")
+    print(report.to_string(index=False))
+    if args.output:
+        save_report(report, args.output)
+        print(f"\nReport saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -2,59 +2,132 @@
 """
 Combine results from multiple chunk files into a single CSV file.
 This script will look for result files in the specified directory and combine them.
+Files are merged with a bounded-memory external sort, so they never have to fit in memory together.
 """
 
 import argparse
 import pandas as pd
 import os
+import csv
 import glob
+import heapq
+import tempfile
+from typing import Callable, Iterator, List, Tuple
 
-def combine_results(input_dir: str, output_file: str, pattern: str = 'results_chunk_*.csv'):
+def combine_results(input_dir: str, output_file: str, pattern: str = 'results_chunk_*.csv',
+                    keep: str = 'first', chunk_rows: int = 100000, fan_in: int = 64):
     """
     Combine results from multiple chunk files into a single CSV file.
-    
+
     Args:
         input_dir (str): Directory containing the chunk result files
         output_file (str): Path to save the combined results
         pattern (str): Pattern to match result files (default: 'results_chunk_*.csv')
+        keep (str): Row to keep per keyword: 'first' (in file order) or 'newest' (from the most recently modified file)
+        chunk_rows (int): Rows sorted in memory at a time
+        fan_in (int): Maximum number of sorted runs merged at once
     """
     try:
         # Find all result files matching the pattern
-        result_files = glob.glob(os.path.join(input_dir, pattern))
-        
+        result_files = sorted(glob.glob(os.path.join(input_dir, pattern)))
+        result_files = [f for f in result_files if os.path.abspath(f) != os.path.abspath(output_file)]
+
         if not result_files:
             print(f"No result files found matching pattern '{pattern}' in {input_dir}")
             return
-        
-        # Read and combine all results
-        results = []
-        for file in sorted(result_files):
-            try:
-                df = pd.read_csv(file)
-                results.append(df)
-                print(f"Read results from {file} ({len(df)} keywords)")
-            except Exception as e:
-                print(f"Error reading {file}: {str(e)}")
-        
-        if results:
-            # Combine all results
-            combined_results = pd.concat(results, ignore_index=True)
-            
-            # Remove any duplicate keywords (in case of overlap)
-            combined_results = combined_results.drop_duplicates(subset=['Keyword'])
-            
-            # Sort by keyword
-            combined_results = combined_results.sort_values('Keyword')
-            
-            # Save combined results
-            combined_results.to_csv(output_file, index=False)
-            print(f"\nCombined {len(combined_results)} unique keywords into {output_file}")
+
+        if keep == 'newest':
+            # Rank files so that a lower rank means more recently written
+            by_age = sorted(result_files, key=os.path.getmtime, reverse=True)
+            file_ranks = {file: by_age.index(file) for file in result_files}
         else:
-            print("No results to combine")
-            
+            file_ranks = {file: i for i, file in enumerate(result_files)}
+        row_sign = -1 if keep == 'newest' else 1
+
+        fieldnames = _union_fieldnames(result_files)
+        if 'Keyword' not in fieldnames:
+            print("No 'Keyword' column found in the result files")
+            return
+
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output_file))) as tmp_dir:
+            # Sort each file in bounded chunks into runs ordered by (keyword, preference)
+            runs = []
+            for file in result_files:
+                try:
+                    rows = 0
+                    for chunk in pd.read_csv(file, dtype=str, keep_default_na=False, chunksize=chunk_rows):
+                        chunk = chunk.reindex(columns=fieldnames, fill_value='')
+                        chunk['_rank'] = file_ranks[file]
+                        chunk['_row'] = [row_sign * (rows + i) for i in range(len(chunk))]
+                        chunk = chunk.sort_values(['Keyword', '_rank', '_row'], kind='stable')
+                        run_file = os.path.join(tmp_dir, f'run_{len(runs)}.csv')
+                        chunk.to_csv(run_file, index=False)
+                        runs.append(run_file)
+                        rows += len(chunk)
+                    print(f"Read results from {file} ({rows} keywords)")
+                except Exception as e:
+                    print(f"Error reading {file}: {str(e)}")
+
+            if not runs:
+                print("No results to combine")
+                return
+
+            # Merge runs in groups until few enough remain to merge in one pass
+            while len(runs) > fan_in:
+                merged_runs = []
+                for i in range(0, len(runs), fan_in):
+                    run_file = os.path.join(tmp_dir, f'merged_{len(runs)}_{i}.csv')
+                    _write_rows(run_file, fieldnames + ['_rank', '_row'], _merge_runs(runs[i:i+fan_in]))
+                    merged_runs.append(run_file)
+                runs = merged_runs
+
+            # Remove any duplicate keywords (in case of overlap), keeping the preferred row of each
+            unique_keywords = _write_rows(output_file, fieldnames, _first_per_keyword(_merge_runs(runs)))
+            print(f"\nCombined {unique_keywords} unique keywords into {output_file}")
+
     except Exception as e:
         print(f"Error combining results: {str(e)}")
 
+def _union_fieldnames(files: List[str]) -> List[str]:
+    """Collect the columns of all files in order of first appearance, with 'Keyword' first."""
+    fieldnames = ['Keyword']
+    for file in files:
+        try:
+            with open(file, newline='', encoding='utf-8') as f:
+                header = next(csv.reader(f), [])
+        except OSError:
+            continue
+        fieldnames.extend(name for name in header if name not in fieldnames)
+    return fieldnames
+
+def _run_key(row: dict) -> Tuple:
+    return row['Keyword'], int(row['_rank']), int(row['_row'])
+
+def _read_run(run_file: str) -> Iterator[dict]:
+    with open(run_file, newline='', encoding='utf-8') as f:
+        yield from csv.DictReader(f)
+
+def _merge_runs(runs: List[str]) -> Iterator[dict]:
+    """Lazily k-way merge sorted runs, holding one row per run in memory."""
+    return heapq.merge(*(_read_run(run) for run in runs), key=_run_key)
+
+def _first_per_keyword(rows: Iterator[dict]) -> Iterator[dict]:
+    previous = None
+    for row in rows:
+        if row['Keyword'] != previous:
+            previous = row['Keyword']
+            yield row
+
+def _write_rows(path: str, fieldnames: List[str], rows: Iterator[dict]) -> int:
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
 def main():
     parser = argparse.ArgumentParser(description='Combine results from multiple chunk files')
     parser.add_argument('--input-dir', '-i', default='.',
@@ -63,10 +136,14 @@ def main():
                       help='Output file for combined results (default: combined_results.csv)')
     parser.add_argument('--pattern', '-p', default='results_chunk_*.csv',
                       help='Pattern to match result files (default: results_chunk_*.csv)')
-    
+    parser.add_argument('--keep', choices=['first', 'newest'], default='first',
+                      help='Row to keep for duplicate keywords: first in file order, or newest by file modification time (default: first)')
+    parser.add_argument('--chunk-rows', type=int, default=100000,
+                      help='Rows sorted in memory at a time (default: 100000)')
+
     args = parser.parse_args()
-    
-    combine_results(args.input_dir, args.output, args.pattern)
+
+    combine_results(args.input_dir, args.output, args.pattern, keep=args.keep, chunk_rows=args.chunk_rows)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
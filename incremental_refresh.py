@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Incremental Refresh - Bring stored time series up to date by fetching only their new tail.
+Each refresh requests a short window that overlaps the stored series, rescales the new values onto the
+stored series' normalization using the overlap, replaces rows that were flagged isPartial and appends the rest.
+"""
+
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+from trends_client import TrendsClient
+from timeseries_store import TimeseriesStore
+
+# Google Trends returns daily points for windows up to 269 days and weekly points for windows up to 5 years
+MAX_DAILY_WINDOW_DAYS = 269
+MAX_WEEKLY_WINDOW_DAYS = 5 * 365
+
+def series_step_days(dates: pd.DatetimeIndex) -> Optional[float]:
+    """Return the typical spacing of a series in days, or None if it has fewer than two points."""
+    if len(dates) < 2:
+        return None
+    return float(np.median(np.diff(dates.values).astype('timedelta64[s]').astype(np.int64))) / 86400
+
+def plan_window(stored: pd.DataFrame, end: pd.Timestamp, overlap_days: int) -> Optional[pd.Timestamp]:
+    """
+    Choose the start of the refresh window for a stored series, or None if it needs a full fetch.
+
+    The window starts early enough to overlap the last final rows and to cover every partial row, and is
+    long (or short) enough that Google returns the same granularity as the stored series.
+    """
+    step = series_step_days(stored.index)
+    if step is None:
+        return None
+    final = stored[~stored['isPartial']]
+    if final.empty:
+        return None
+    start = final.index[-1] - pd.Timedelta(days=overlap_days)
+    if stored['isPartial'].any():
+        start = min(start, stored.index[stored['isPartial']][0])
+
+    if step <= 1:
+        if (end - start).days > MAX_DAILY_WINDOW_DAYS:
+            return None
+    elif step <= 7:
+        start = min(start, end - pd.Timedelta(days=MAX_DAILY_WINDOW_DAYS + 1))
+        if (end - start).days > MAX_WEEKLY_WINDOW_DAYS:
+            return None
+    else:
+        return None
+    return max(start, stored.index[0])
+
+def overlap_ratio(stored: pd.Series, new: pd.Series) -> Optional[float]:
+    """Return the factor that maps new values onto the stored scale, from the dates both hold, or None."""
+    common = stored.index.intersection(new.index)
+    if len(common) == 0:
+        return None
+    stored_sum = float(stored.loc[common].sum())
+    new_sum = float(new.loc[common].sum())
+    if new_sum == 0:
+        return 1.0 if stored_sum == 0 else None
+    return stored_sum / new_sum
+
+def is_up_to_date(stored: pd.DataFrame, end: pd.Timestamp) -> bool:
+    """
+    Check whether a stored series has no final point left to fetch by the end date.
+
+    Points are labelled with the start of their period, so the period after the last final point only
+    becomes final one sampling period after it starts; until then a request could only return partial data.
+    """
+    step = series_step_days(stored.index)
+    if step is None:
+        return False
+    final = stored.index[~stored['isPartial'].astype(bool)]
+    if len(final) == 0:
+        return False
+    return final[-1] + 2 * pd.Timedelta(days=step) > end
+
+def refresh_series(client: TrendsClient, store: TimeseriesStore, keywords: List[str], geo: str = 'US',
+                   since: str = '2022-01-01', end: Optional[str] = None, overlap_days: int = 28,
+                   raise_errors: bool = False) -> Dict[str, str]:
+    """
+    Refresh stored series up to an end date, fetching only the new tail of each one.
+
+    Series with no period after their last final point that has ended by the end date are skipped without
+    a request; only the stale ones are grouped into 5-keyword batches. Keywords without a stored series, or
+    whose tail cannot be matched to the stored granularity, are fetched in full from the since date instead.
+
+    Args:
+        client (TrendsClient): Client used for the requests
+        store (TimeseriesStore): Store holding the series
+        keywords (list): Keywords to refresh
+        geo (str): Geographic region of the series
+        since (str): Start date for series that need a full fetch
+        end (str): Last date to fetch (default: today)
+        overlap_days (int): Days of already final data included in each window to calibrate the rescaling
+        raise_errors (bool): Raise request errors instead of recording them as outcomes
+
+    Returns:
+        dict: Outcome per keyword: 'up to date', 'appended', 'full' or an error message
+    """
+    end_date = pd.Timestamp(end or datetime.today().strftime('%Y-%m-%d'))
+    outcomes = {}
+    windows: Dict[Optional[pd.Timestamp], List[str]] = {}
+    for keyword in keywords:
+        stored = store.read(keyword, geo)
+        if is_up_to_date(stored, end_date):
+            outcomes[keyword] = 'up to date'
+            continue
+        start = plan_window(stored, end_date, overlap_days) if not stored.empty else None
+        windows.setdefault(start, []).append(keyword)
+
+    full_fetch = windows.pop(None, [])
+    for start, window_keywords in windows.items():
+        for i in range(0, len(window_keywords), 5):
+            batch = window_keywords[i:i+5]
+            timeframe = f"{start.strftime('%Y-%m-%d')} {end_date.strftime('%Y-%m-%d')}"
+            try:
+                data = client.interest_over_time(batch, timeframe, geo)
+            except Exception as e:
+                if raise_errors:
+                    raise
+                print(f"Error refreshing {batch}: {str(e)}")
+                outcomes.update({keyword: f'error: {str(e)}' for keyword in batch})
+                continue
+            for keyword in batch:
+                if keyword not in data.columns:
+                    outcomes[keyword] = 'error: no data returned'
+                    continue
+                if append_tail(store, keyword, geo, data[[keyword, 'isPartial']]):
+                    outcomes[keyword] = 'appended'
+                else:
+                    print(f"Fetching {keyword} in full.")
+                    full_fetch.append(keyword)
+
+    for i in range(0, len(full_fetch), 5):
+        batch = full_fetch[i:i+5]
+        timeframe = f"{since} {end_date.strftime('%Y-%m-%d')}"
+        try:
+            data = client.interest_over_time(batch, timeframe, geo)
+        except Exception as e:
+            if raise_errors:
+                raise
+            print(f"Error fetching {batch}: {str(e)}")
+            outcomes.update({keyword: f'error: {str(e)}' for keyword in batch})
+            continue
+        for keyword in batch:
+            if keyword in data.columns:
+                store.append(keyword, geo, data[[keyword, 'isPartial']])
+                outcomes[keyword] = 'full'
+            else:
+                outcomes[keyword] = 'error: no data returned'
+    return outcomes
+
+def append_tail(store: TimeseriesStore, keyword: str, geo: str, new: pd.DataFrame) -> bool:
+    """Rescale a fetched window onto the stored series and store its tail. Returns False (storing nothing) if that is not possible."""
+    stored = store.read(keyword, geo)
+    if series_step_days(new.index) != series_step_days(stored.index):
+        print(f"Granularity of the new window for {keyword} does not match the stored series.")
+        return False
+
+    final_stored = stored.loc[~stored['isPartial'], keyword]
+    final_new = new.loc[~new['isPartial'].astype(bool), keyword]
+    ratio = overlap_ratio(final_stored, final_new)
+    if ratio is None:
+        print(f"No usable overlap to rescale {keyword}.")
+        return False
+
+    # Keep final stored rows as they are; everything after them, including former partial rows, is replaced
+    tail = new[new.index > final_stored.index[-1]].copy()
+    tail[keyword] = (tail[keyword] * ratio).round()
+    if not tail.empty and tail[keyword].max() > 255:
+        print(f"Rescaled values for {keyword} exceed the storable range.")
+        return False
+    store.append(keyword, geo, tail)
+    return True
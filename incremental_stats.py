@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Incremental Stats - Running per-keyword aggregates over stored series, updated from new points only.
+Finished months are frozen as their medians, the open month and the last 12 months of final points are kept,
+and isPartial points are held as provisional values that the next update replaces. Yearly medians of monthly
+medians and the 1Y/3M averages are reported from that state, so a refresh costs O(new points) per keyword.
+"""
+
+import os
+import json
+import argparse
+import threading
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+
+from timeseries_store import TimeseriesStore
+from aggregation import yearly_median
+from metrics import REGISTRY
+
+DEFAULT_STATS_FILE = 'incremental_stats.json'
+# Final points kept per keyword; enough for the 1Y average and the whole open month
+WINDOW = pd.DateOffset(months=12)
+
+def _empty_state(since: str) -> Dict:
+    return {'since': since, 'months': {}, 'recent': [], 'provisional': []}
+
+class IncrementalStats:
+    def __init__(self, path: str = DEFAULT_STATS_FILE):
+        """Load the saved state of every keyword, or start empty."""
+        self.path = path
+        self._lock = threading.Lock()
+        self._states: Dict[str, Dict] = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self._states = json.load(f)['series']
+
+    @staticmethod
+    def _key(keyword: str, geo: str) -> str:
+        return f'{geo}\t{keyword}'
+
+    def _apply(self, state: Dict, data: pd.DataFrame, keyword: str):
+        """
+        Add the observations that come after the last final point already counted.
+
+        Final points are committed: a point in a new month freezes the median of the month before it.
+        isPartial points replace the provisional points of the previous sync.
+        """
+        recent = state['recent']
+        last_final = recent[-1][0] if recent else ''
+        partial = data['isPartial'].astype(bool).to_numpy() if 'isPartial' in data.columns else np.zeros(len(data), bool)
+        provisional = []
+        committed = 0
+        for date, value, is_partial in zip(pd.DatetimeIndex(data.index), data[keyword].to_numpy(), partial):
+            date = date.isoformat()
+            if pd.isna(value) or date <= last_final:
+                continue
+            if is_partial:
+                provisional.append([date, float(value)])
+                continue
+            if recent and date[:7] != recent[-1][0][:7]:
+                month = recent[-1][0][:7]
+                state['months'][month] = float(np.median([v for d, v in recent if d[:7] == month]))
+            recent.append([date, float(value)])
+            last_final = date
+            committed += 1
+        state['provisional'] = provisional
+        if recent:
+            cutoff = (pd.Timestamp(last_final) - WINDOW).isoformat()
+            state['recent'] = [point for point in recent if point[0] > cutoff]
+        REGISTRY.inc('stats_points_total', committed)
+
+    def sync(self, store: TimeseriesStore, keyword: str, geo: str, since: str = '2022-01-01') -> bool:
+        """
+        Bring the aggregates of a stored series up to date, reading only the kept window and what follows it.
+
+        If the stored values inside the kept window changed (the series was fetched again with a different
+        normalization) or the start date differs, the aggregates are rebuilt from the whole series.
+        Returns False if the series is not in the store.
+        """
+        if (keyword, geo) not in store:
+            return False
+        key = self._key(keyword, geo)
+        with self._lock:
+            state = self._states.get(key)
+            if state is not None and state['since'] == since and state['recent']:
+                data = store.read(keyword, geo, start=state['recent'][0][0])
+                seen = data[data.index <= pd.Timestamp(state['recent'][-1][0])]
+                kept = [[date.isoformat(), float(value)] for date, value in zip(seen.index, seen[keyword])]
+                if kept != state['recent'] or seen['isPartial'].any():
+                    state = None
+            else:
+                state = None
+            if state is None:
+                REGISTRY.inc('stats_rebuilds_total')
+                state = self._states[key] = _empty_state(since)
+                data = store.read(keyword, geo, start=since)
+            self._apply(state, data, keyword)
+        return True
+
+    def monthly_medians(self, keyword: str, geo: str) -> pd.Series:
+        """Median per calendar month: frozen months, then the open and provisional months from their points."""
+        state = self._states.get(self._key(keyword, geo))
+        if state is None:
+            return pd.Series(dtype=float)
+        months = dict(state['months'])
+        open_month = state['recent'][-1][0][:7] if state['recent'] else ''
+        points: Dict[str, List[float]] = {}
+        for date, value in [point for point in state['recent'] if point[0][:7] == open_month] + state['provisional']:
+            points.setdefault(date[:7], []).append(value)
+        months.update({month: float(np.median(values)) for month, values in points.items()})
+        return pd.Series(months, dtype=float).sort_index()
+
+    def yearly_medians(self, keyword: str, geo: str) -> Dict[int, float]:
+        """Median of the monthly medians per year, the same figures yearly_median reports."""
+        monthly = self.monthly_medians(keyword, geo)
+        return {int(year): float(values.median()) for year, values in monthly.groupby(monthly.index.str[:4])}
+
+    def averages(self, keyword: str, geo: str) -> Dict[str, Optional[float]]:
+        """Mean over the last 12 and 3 months of the series (provisional points included), like trailing_mean."""
+        state = self._states.get(self._key(keyword, geo))
+        points = (state['recent'] + state['provisional']) if state else []
+        if not points:
+            return {'1y': None, '3m': None}
+        last = pd.Timestamp(points[-1][0])
+        averages = {}
+        for label, months in (('1y', 12), ('3m', 3)):
+            cutoff = (last - pd.DateOffset(months=months)).isoformat()
+            averages[label] = round(float(np.mean([value for date, value in points if date > cutoff])), 2)
+        return averages
+
+    def yearly_table(self, store: TimeseriesStore, keywords: List[str], geo: str = 'US', since: str = '2022-01-01',
+                     end: Optional[str] = None) -> pd.DataFrame:
+        """
+        Yearly medians of stored keywords as a wide table (a row per year, a column per keyword), synced first.
+
+        Series that extend past the end date are aggregated from the store directly, since the running
+        aggregates always cover a series to its last point.
+        """
+        columns = {}
+        for keyword in keywords:
+            last_date = store.last_date(keyword, geo)
+            if last_date is None:
+                continue
+            if end is not None and last_date > pd.Timestamp(end):
+                table = yearly_median(store.read(keyword, geo, since, end))
+                columns[keyword] = table[keyword]
+            elif self.sync(store, keyword, geo, since):
+                columns[keyword] = pd.Series(self.yearly_medians(keyword, geo), dtype=float)
+        if not columns:
+            return pd.DataFrame()
+        table = pd.DataFrame(columns)
+        table.index.name = 'year'
+        return table
+
+    def save(self):
+        """Write the state of every keyword to the stats file."""
+        with self._lock:
+            tmp_file = f'{self.path}.tmp'
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({'series': self._states}, f, ensure_ascii=False)
+            os.replace(tmp_file, self.path)
+
+def stats_report(stats: IncrementalStats, store: TimeseriesStore, geo: str = 'US',
+                 keywords: Optional[List[str]] = None, since: str = '2022-01-01') -> pd.DataFrame:
+    """Sync every stored keyword and report its yearly medians, 1Y and 3M averages and the 1Y -> 3M change."""
+    if keywords is None:
+        keywords = [keyword for keyword, _ in store.series_keys(geo)]
+    rows = []
+    for keyword in keywords:
+        if not stats.sync(store, keyword, geo, since):
+            continue
+        averages = stats.averages(keyword, geo)
+        if averages['1y'] and averages['3m']:
+            trend = round(((averages['3m'] - averages['1y']) / averages['1y']) * 100, 1)
+        else:
+            trend = 'N/A'
+        row = {'Keyword': keyword}
+        row.update({str(year): value for year, value in stats.yearly_medians(keyword, geo).items()})
+        row.update({'1Y Avg': averages['1y'], '3M Avg': averages['3m'], '1Y → 3M % Change': f"{trend}%"})
+        rows.append(row)
+    report = pd.DataFrame(rows)
+    if report.empty:
+        return report
+    years = sorted(column for column in report.columns if column.isdigit())
+    return report[['Keyword'] + years + ['1Y Avg', '3M Avg', '1Y → 3M % Change']]
+
+def main():
+    parser = argparse.ArgumentParser(description='Update running statistics of stored series from their new points and report them')
+    parser.add_argument('--store', default='timeseries_store', help='Time series store directory (default: timeseries_store)')
+    parser.add_argument('--stats', default=DEFAULT_STATS_FILE, help=f'Statistics state file (default: {DEFAULT_STATS_FILE})')
+    parser.add_argument('--geo', '-g', default='US', help='Geographic region to report (default: US)')
+    parser.add_argument('--since', default='2022-01-01', help='Start date the statistics cover (default: 2022-01-01)')
+    parser.add_argument('--output', '-o', default='incremental_stats.csv', help='Output CSV file (default: incremental_stats.csv)')
+    args = parser.parse_args()
+
+    stats = IncrementalStats(args.stats)
+    report = stats_report(stats, TimeseriesStore(args.store), args.geo, since=args.since)
+    stats.save()
+    print(report)
+    report.to_csv(args.output, index=False)
+    print(f"\nResults saved to {args.output}; statistics state saved to {args.stats}")
+
+if __name__ == "__main__":
+    main()
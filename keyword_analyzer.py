@@ -1,38 +1,60 @@
 #!/usr/bin/env python3
 """
 Keyword Trend Analyzer - A tool to analyze keyword trends using Google Trends API
+Supports a batched mode that packs 4 keywords and a shared anchor keyword into each request.
 """
 
 import os
-import time
 import argparse
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional
 import pandas as pd
-from pytrends.request import TrendReq
 from dotenv import load_dotenv
 
+from trends_cache import TrendsCache, add_cache_arguments, cache_from_args
+from trends_client import TrendsClient
+from rate_limiter import AdaptiveRateLimiter, add_rate_limit_arguments, rate_limiter_from_args
+from run_journal import RunJournal, add_journal_arguments, journal_from_args
+from result_writer import StreamingCSVWriter
+from timeseries_store import TimeseriesStore, add_store_arguments
+from aggregation import trailing_mean
+from metrics import REGISTRY, add_metrics_arguments, instrumented_run
+from request_planner import interleave, parse_geos
+
 # Load environment variables
 load_dotenv()
 
+RESULT_COLUMNS = ["Keyword", "1Y Avg", "3M Avg", "1Y → 3M % Change"]
+
 class KeywordTrendAnalyzer:
-    def __init__(self, hl: str = 'en-US', tz: int = 360, geo: str = 'US'):
-        """Initialize the analyzer with language, timezone, and geographic settings."""
-        self.pytrends = TrendReq(hl=hl, tz=tz, timeout=(10,25), retries=2, backoff_factor=0.1)
+    def __init__(self, hl: str = 'en-US', tz: int = 360, geo: str = 'US',
+                 cache: Optional[TrendsCache] = None, refresh: bool = False,
+                 limiter: Optional[AdaptiveRateLimiter] = None, journal: Optional[RunJournal] = None,
+                 writer: Optional[StreamingCSVWriter] = None, backend: Optional[Any] = None):
+        """Initialize the analyzer with language, timezone, geographic, cache, pacing, journal, output and backend settings."""
+        self.client = TrendsClient(hl=hl, tz=tz, cache=cache, refresh=refresh, limiter=limiter, backend=backend)
+        self.pytrends = self.client.pytrends
         self.geo = geo
+        self.journal = journal
+        self.writer = writer
         self.timeframes = {
             '1y': 'today 12-m',
             '3m': 'today 3-m'
         }
+        self.batch_size = 5
 
-    def get_high_granularity_timeseries(self, keyword: str, timeframe: str = 'now 7-d', output_file: str = 'raw_timeseries.csv'):
-        """Pull and save the highest granularity time series data for a keyword."""
+    def get_high_granularity_timeseries(self, keyword: str, timeframe: str = 'now 7-d', output_file: Optional[str] = 'raw_timeseries.csv',
+                                        store: Optional[TimeseriesStore] = None):
+        """Pull and save the highest granularity time series data for a keyword to a CSV file and/or the store."""
         print(f"Pulling high granularity time series for: {keyword} (timeframe: {timeframe})")
         try:
-            self.pytrends.build_payload([keyword], timeframe=timeframe, geo=self.geo)
-            data = self.pytrends.interest_over_time()
+            data = self.client.interest_over_time([keyword], timeframe, self.geo)
             if not data.empty:
-                data.to_csv(output_file)
-                print(f"Raw time series data saved to {output_file}")
+                if store is not None:
+                    store.append(keyword, self.geo, data)
+                    print(f"Raw time series data saved to store {store.path}")
+                if output_file:
+                    data.to_csv(output_file)
+                    print(f"Raw time series data saved to {output_file}")
                 print(data)
             else:
                 print("No data returned for this keyword and timeframe.")
@@ -41,40 +63,114 @@ class KeywordTrendAnalyzer:
 
     def analyze_keywords(self, keywords_df: pd.DataFrame) -> pd.DataFrame:
         """Analyze trends for a list of keywords from a DataFrame."""
-        results = []
-        
-        for _, row in keywords_df.iterrows():
-            keyword = row['Keyword']
+        return pd.DataFrame([self.analyze_keyword(keyword) for keyword in keywords_df['Keyword']])
+
+    def analyze_keyword(self, keyword: str) -> Dict:
+        """Analyze one keyword (or take it from the journal) and stream its result row to the output writer, if any."""
+        key = RunJournal.make_key('average', self.geo, keyword)
+        if self.journal is not None and self.journal.is_done(key):
+            avg_data = self.journal.get(key)
+            REGISTRY.record_outcome(keyword, 'resumed')
+        else:
             print(f"Analyzing keyword: {keyword}")
             avg_data = self._get_average_data(keyword)
-            
-            # Calculate trends if we have enough data
-            if avg_data.get('1y') and avg_data.get('3m'):
-                trend = round(((avg_data['3m'] - avg_data['1y']) / avg_data['1y']) * 100, 1)
-            else:
-                trend = 'N/A'
+            if self.journal is not None and None not in avg_data.values():
+                self.journal.record(key, avg_data)
+        result = self._build_result(keyword, avg_data)
+        if self.writer is not None:
+            self.writer.write_rows([result])
+        return result
+
+    def analyze_keywords_batched(self, keywords_df: pd.DataFrame, anchor: Optional[str] = None) -> pd.DataFrame:
+        """
+        Analyze trends for a list of keywords, packing 4 keywords plus a shared anchor keyword into each request.
+
+        Both averages come from a single 'today 12-m' request per batch; the 3M average is taken over the
+        last 3 months of that series. Every batch is rescaled so that the anchor's 1Y average matches the
+        first batch, which puts the averages of all keywords on one comparable scale.
+
+        Args:
+            keywords_df (pd.DataFrame): DataFrame with a 'Keyword' column
+            anchor (str): Keyword included in every batch (default: the first keyword)
+        """
+        keywords = list(dict.fromkeys(keywords_df['Keyword'].tolist()))
+        if not keywords:
+            return pd.DataFrame(columns=RESULT_COLUMNS)
+        anchor = anchor or keywords[0]
+        state = self.new_batch_state(anchor)
+        for batch in self.plan_batches(keywords, anchor):
+            self.analyze_batch(batch, state)
+        return pd.DataFrame(self.finish_batches(keywords, state))
+
+    def plan_batches(self, keywords: List[str], anchor: str) -> List[List[str]]:
+        """Split the keywords other than the anchor into batches that fill a request together with the anchor."""
+        others = [keyword for keyword in keywords if keyword != anchor]
+        step = self.batch_size - 1
+        return [others[i:i+step] for i in range(0, max(len(others), 1), step)]
+
+    @staticmethod
+    def new_batch_state(anchor: str) -> Dict:
+        """Start the state of a batched run: the anchor, its reference average, batches waiting for it and result rows."""
+        return {'anchor': anchor, 'reference': None, 'pending': [], 'results': {}}
+
+    def analyze_batch(self, batch: List[str], state: Dict):
+        """Analyze one anchored batch (or take it from the journal) and emit its rows once the common scale is known."""
+        anchor = state['anchor']
+        key = RunJournal.make_key('batch_average', self.geo, anchor, batch)
+        if self.journal is not None and self.journal.is_done(key):
+            averages = self.journal.get(key)
+            for keyword in batch:
+                REGISTRY.record_outcome(keyword, 'resumed')
+        else:
+            print(f"\nAnalyzing batch of keywords: {batch} (anchor: {anchor})")
+            averages = self._get_batch_average_data(anchor, batch)
+            # Batches where a keyword or the anchor returned no data are not journaled, so --resume asks again
+            if self.journal is not None and all(None not in avg_data.values() for avg_data in averages.values()):
+                self.journal.record(key, averages)
+
+        # The first batch with data for the anchor fixes the common scale; earlier batches wait for it
+        if state['reference'] is None and averages[anchor]['1y']:
+            state['reference'] = averages[anchor]['1y']
+        state['pending'].append(averages)
+        if state['reference'] is not None:
+            self._flush_batches(state, state['reference'])
+
+    def finish_batches(self, keywords: List[str], state: Dict) -> List[Dict]:
+        """Emit batches still waiting for the anchor, unscaled, and return the result rows in keyword order."""
+        if state['pending']:
+            print(f"Anchor keyword '{state['anchor']}' returned no data; averages are not comparable across batches.")
+            self._flush_batches(state, None)
+        return [state['results'].get(keyword, self._build_result(keyword, {})) for keyword in keywords]
+
+    def _flush_batches(self, state: Dict, reference: Optional[float]):
+        results = state['results']
+        self._emit_results(results, [row for averages in state['pending']
+                                     for row in self._scale_batch(state['anchor'], reference, averages, results)])
+        state['pending'] = []
 
-            results.append({
-                "Keyword": keyword,
-                "1Y Avg": avg_data.get('1y'),
-                "3M Avg": avg_data.get('3m'),
-                "1Y → 3M % Change": f"{trend}%"
-            })
-            
-            # Respect API rate limits with increased delay
-            print("Waiting 65 seconds before next request...")
-            time.sleep(65)  # Increased delay between requests
+    def _build_result(self, keyword: str, avg_data: Dict[str, Optional[float]]) -> Dict:
+        """Build the result row for a keyword from its 1Y and 3M averages."""
+        # Calculate trends if we have enough data
+        if avg_data.get('1y') and avg_data.get('3m'):
+            trend = round(((avg_data['3m'] - avg_data['1y']) / avg_data['1y']) * 100, 1)
+        else:
+            trend = 'N/A'
 
-        return pd.DataFrame(results)
+        return {
+            "Keyword": keyword,
+            "1Y Avg": avg_data.get('1y'),
+            "3M Avg": avg_data.get('3m'),
+            "1Y → 3M % Change": f"{trend}%"
+        }
 
     def _get_average_data(self, keyword: str) -> Dict[str, Optional[float]]:
         """Get average data for a single keyword across different timeframes."""
         avg_data = {}
+        errors = []
         
         for label, tf in self.timeframes.items():
             try:
-                self.pytrends.build_payload([keyword], timeframe=tf, geo=self.geo)
-                data = self.pytrends.interest_over_time()
+                data = self.client.interest_over_time([keyword], tf, self.geo)
                 if not data.empty:
                     avg = data[keyword].mean()
                     avg_data[label] = round(avg, 2)
@@ -83,10 +179,92 @@ class KeywordTrendAnalyzer:
             except Exception as e:
                 print(f"Error analyzing {keyword} for {label}: {str(e)}")
                 avg_data[label] = None
-                time.sleep(10)  # Additional delay after an error
+                errors.append(str(e))
 
+        if errors:
+            REGISTRY.record_outcome(keyword, 'error', error='; '.join(errors))
+        else:
+            REGISTRY.record_outcome(keyword, 'ok' if None not in avg_data.values() else 'no data')
         return avg_data
 
+    def _get_batch_average_data(self, anchor: str, keywords: List[str]) -> Dict[str, Dict[str, Optional[float]]]:
+        """Get unscaled 1Y and 3M averages for the anchor and up to 4 keywords from a single request."""
+        payload = [anchor] + keywords
+        averages = {keyword: {'1y': None, '3m': None} for keyword in payload}
+        try:
+            data = self.client.interest_over_time(payload, self.timeframes['1y'], self.geo)
+        except Exception as e:
+            print(f"Error analyzing batch {keywords}: {str(e)}")
+            for keyword in keywords:
+                REGISTRY.record_outcome(keyword, 'error', error=str(e))
+            return averages
+        if data.empty:
+            print(f"No data returned for batch {keywords}.")
+            for keyword in keywords:
+                REGISTRY.record_outcome(keyword, 'no data')
+            return averages
+
+        avg_1y = trailing_mean(data)
+        avg_3m = trailing_mean(data, months=3)
+        for keyword in payload:
+            if keyword in data.columns:
+                averages[keyword] = {'1y': float(avg_1y[keyword]), '3m': float(avg_3m[keyword])}
+        for keyword in keywords:
+            REGISTRY.record_outcome(keyword, 'ok' if keyword in data.columns else 'no data')
+        return averages
+
+    def _scale_batch(self, anchor: str, reference: Optional[float], averages: Dict[str, Dict[str, Optional[float]]],
+                     done: Dict[str, Dict]) -> List[Dict]:
+        """Rescale a batch so its anchor average matches the reference and build result rows for keywords not yet done."""
+        anchor_avg = averages[anchor]['1y']
+        factor = reference / anchor_avg if reference and anchor_avg else None
+        if factor is None and reference is not None:
+            print(f"Anchor keyword has no data in batch {list(averages)[1:]}; leaving it unscaled.")
+
+        rows = []
+        for keyword, avg_data in averages.items():
+            # The anchor appears in every batch but is reported once, from the first batch with data for it
+            if keyword in done or (keyword == anchor and anchor_avg is None):
+                continue
+            scaled = {label: (None if value is None or pd.isna(value) else round(value * (factor or 1), 2))
+                      for label, value in avg_data.items()}
+            rows.append(self._build_result(keyword, scaled))
+        return rows
+
+    def _emit_results(self, results: Dict[str, Dict], rows: List[Dict]):
+        """Collect result rows and stream them to the output writer, if any."""
+        for row in rows:
+            results[row['Keyword']] = row
+        if self.writer is not None:
+            self.writer.write_rows(rows)
+
+def analyze_keywords_geos(analyzers: Dict[str, KeywordTrendAnalyzer], keywords_df: pd.DataFrame, batch: bool = False,
+                          anchor: Optional[str] = None) -> pd.DataFrame:
+    """
+    Analyze a keyword list for several geos, one analyzer per geo, interleaving their requests round-robin.
+
+    Args:
+        analyzers (dict): Analyzer of each geo; give them one shared session and rate limiter
+        keywords_df (pd.DataFrame): DataFrame with a 'Keyword' column
+        batch (bool): Pack 4 keywords and an anchor keyword into each request, as analyze_keywords_batched
+        anchor (str): Anchor keyword of the batched mode (default: the first keyword)
+    """
+    keywords = list(dict.fromkeys(keywords_df['Keyword'].tolist()))
+    if batch and keywords:
+        anchor = anchor or keywords[0]
+        states = {geo: analyzer.new_batch_state(anchor) for geo, analyzer in analyzers.items()}
+        batches = [[(geo, keyword_batch) for keyword_batch in analyzer.plan_batches(keywords, anchor)]
+                   for geo, analyzer in analyzers.items()]
+        for geo, keyword_batch in interleave(batches):
+            analyzers[geo].analyze_batch(keyword_batch, states[geo])
+        rows = {geo: analyzer.finish_batches(keywords, states[geo]) for geo, analyzer in analyzers.items()}
+    else:
+        rows = {geo: [] for geo in analyzers}
+        for geo, keyword in interleave([[(geo, keyword) for keyword in keywords] for geo in analyzers]):
+            rows[geo].append(analyzers[geo].analyze_keyword(keyword))
+    return pd.DataFrame([{'Geo': geo, **row} for geo, geo_rows in rows.items() for row in geo_rows],
+                        columns=['Geo'] + RESULT_COLUMNS)
+
 def main():
     # Set up argument parser
     parser = argparse.ArgumentParser(description='Analyze keyword trends using Google Trends API')
@@ -95,8 +273,17 @@ def main():
     parser.add_argument('--output', '-o', default='keyword_trends_comparison.csv',
                       help='Output CSV file for results (default: keyword_trends_comparison.csv)')
     parser.add_argument('--geo', '-g', default='US',
-                      help='Geographic region for analysis (default: US)')
+                      help='Geographic region, comma-separated regions or @file with one region per line; '
+                           'all regions share one session and one output with a Geo column (default: US)')
     parser.add_argument('--raw', action='store_true', help='If set, pull and save high granularity time series for the first keyword only')
+    parser.add_argument('--batch', action='store_true',
+                      help='Pack 4 keywords and an anchor keyword into each request (one request per batch instead of two per keyword)')
+    parser.add_argument('--anchor', help='Anchor keyword shared by every batch in --batch mode (default: the first keyword)')
+    add_cache_arguments(parser)
+    add_rate_limit_arguments(parser)
+    add_journal_arguments(parser)
+    add_store_arguments(parser)
+    add_metrics_arguments(parser)
     
     args = parser.parse_args()
 
@@ -105,29 +292,63 @@ def main():
         keywords_df = pd.read_csv(args.input)
         if 'Keyword' not in keywords_df.columns:
             raise ValueError("CSV file must contain a 'Keyword' column")
+        geos = parse_geos(args.geo)
     except Exception as e:
         print(f"Error reading input file: {str(e)}")
         return
 
-    # Initialize analyzer
-    analyzer = KeywordTrendAnalyzer(geo=args.geo)
+    with instrumented_run(args):
+        # Initialize one analyzer per geo; all of them share the first one's session, cache and rate limiter
+        cache = cache_from_args(args)
+        limiter = rate_limiter_from_args(args)
+        analyzer = KeywordTrendAnalyzer(geo=geos[0], cache=cache, refresh=args.refresh, limiter=limiter)
+        analyzers = {geos[0]: analyzer}
+        for geo in geos[1:]:
+            analyzers[geo] = KeywordTrendAnalyzer(geo=geo, cache=cache, refresh=args.refresh, limiter=limiter,
+                                                  backend=analyzer.pytrends)
     
-    if args.raw:
-        # Pull high granularity time series for the first keyword
-        first_keyword = keywords_df.iloc[0]['Keyword']
-        analyzer.get_high_granularity_timeseries(first_keyword)
-        return
+        if args.raw:
+            # Pull high granularity time series for the first keyword
+            first_keyword = keywords_df.iloc[0]['Keyword']
+            for geo, geo_analyzer in analyzers.items():
+                if args.store:
+                    # Hourly series are kept apart from the weekly and daily series of the main store
+                    hourly_store = TimeseriesStore(os.path.join(args.store, 'hourly'))
+                    geo_analyzer.get_high_granularity_timeseries(first_keyword, output_file=None, store=hourly_store)
+                else:
+                    geo_analyzer.get_high_granularity_timeseries(
+                        first_keyword, output_file='raw_timeseries.csv' if len(geos) == 1 else f'raw_timeseries_{geo}.csv')
+            return
 
-    # Analyze keywords
-    results_df = analyzer.analyze_keywords(keywords_df)
+        # Analyze keywords, recording completed work so an interrupted run can be resumed
+        # and streaming rows to the output as they complete
+        journal = journal_from_args(args)
+        writer = StreamingCSVWriter(args.output, RESULT_COLUMNS if len(geos) == 1 else ['Geo'] + RESULT_COLUMNS)
+        for geo, geo_analyzer in analyzers.items():
+            geo_analyzer.journal = journal
+            geo_analyzer.writer = writer if len(geos) == 1 else writer.tagged(Geo=geo)
+        try:
+            if len(geos) > 1:
+                # The geos' requests alternate, so every geo has results early and shares the rate budget evenly
+                results_df = analyze_keywords_geos(analyzers, keywords_df, args.batch, args.anchor)
+            elif args.batch:
+                results_df = analyzer.analyze_keywords_batched(keywords_df, args.anchor)
+            else:
+                results_df = analyzer.analyze_keywords(keywords_df)
+        except KeyboardInterrupt:
+            print(f"\nInterrupted. Completed work is recorded in {journal.path}; rerun with --resume to continue.")
+            return
+        finally:
+            journal.close()
+            writer.close()
     
-    # Display results
-    print("\nResults:")
-    print(results_df)
+        # Display results
+        print("\nResults:")
+        print(results_df)
     
-    # Save to CSV
-    results_df.to_csv(args.output, index=False)
-    print(f"\nResults saved to {args.output}")
+        # Save to CSV, replacing the streamed rows with the complete results in input order
+        results_df.to_csv(args.output, index=False)
+        print(f"\nResults saved to {args.output}")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
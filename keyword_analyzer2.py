@@ -5,99 +5,326 @@ Supports batch processing of keywords to reduce total processing time.
 """
 
 import os
-import time
 import argparse
-from typing import Dict, List, Optional
+import threading
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
 import pandas as pd
-from pytrends.request import TrendReq
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 
+from trends_cache import TrendsCache, add_cache_arguments, cache_from_args
+from trends_client import TrendsClient
+from rate_limiter import (AdaptiveRateLimiter, ThrottledError, add_rate_limit_arguments, is_keyword_error,
+                          is_throttle_error, rate_limiter_from_args)
+from run_journal import RunJournal, add_journal_arguments, journal_from_args
+from result_writer import StreamingCSVWriter
+from aggregation import to_long, yearly_median
+from timeseries_store import TimeseriesStore, add_store_arguments
+from incremental_refresh import append_tail, refresh_series
+from incremental_stats import DEFAULT_STATS_FILE, IncrementalStats
+from metrics import REGISTRY, add_metrics_arguments, instrumented_run
+from request_planner import interleave, parse_geos
+
 # Load environment variables
 load_dotenv()
 
+# Times a throttled or failed batch goes back to the queue before the run gives up on it
+MAX_REQUEUES = 3
+
 class KeywordTrendAnalyzer2:
-    def __init__(self, hl: str = 'en-US', tz: int = 360, geo: str = 'US'):
-        """Initialize the analyzer with language, timezone, and geographic settings."""
-        self.pytrends = TrendReq(hl=hl, tz=tz, timeout=(10,25), retries=2, backoff_factor=0.1)
+    def __init__(self, hl: str = 'en-US', tz: int = 360, geo: str = 'US',
+                 cache: Optional[TrendsCache] = None, refresh: bool = False,
+                 limiter: Optional[AdaptiveRateLimiter] = None, proxies: Optional[List[str]] = None,
+                 journal: Optional[RunJournal] = None, writer: Optional[StreamingCSVWriter] = None,
+                 store: Optional[TimeseriesStore] = None, incremental: bool = False, backend: Optional[Any] = None,
+                 stats: Optional[IncrementalStats] = None):
+        """Initialize the analyzer with language, timezone, geographic, cache, pacing, proxy, journal, output, store, backend and statistics settings."""
+        self.client = TrendsClient(hl=hl, tz=tz, cache=cache, refresh=refresh, limiter=limiter, proxies=proxies,
+                                   backend=backend)
+        self.pytrends = self.client.pytrends
         self.geo = geo
+        self.journal = journal
+        self.writer = writer
+        self.store = store
+        self.incremental = incremental
+        self.stats = stats
+        self.dead_letters: List[Tuple[str, str]] = []
+        self.retry_batches: List[List[str]] = []
+        self._dead_letters_lock = threading.Lock()
 
     def analyze_keyword_batch(self, keywords: List[str], timeframe: str) -> List[pd.DataFrame]:
-        """Analyze a batch of up to 5 keywords simultaneously."""
+        """
+        Analyze a batch of up to 5 keywords simultaneously.
+
+        A batch rejected with a client error (HTTP 4xx other than 429) is split and retried (5 -> 2+3 -> singles),
+        so one bad keyword does not cost the others their data. Keywords that still fail on their own are
+        added to dead_letters with their error. Batches that are throttled or hit a server or network error
+        are not split but added to retry_batches, to be fetched again later.
+        """
+        results, _ = self._analyze_batch(keywords, timeframe)
+        self._stream_results(results)
+        return results
+
+    def _analyze_batch(self, keywords: List[str], timeframe: str) -> Tuple[List[pd.DataFrame], bool]:
+        """
+        Analyze a batch, bisecting it on failure. Returns the results and whether the batch is complete.
+
+        Only complete batches, where every keyword returned data, are recorded in the journal.
+        """
+        key = RunJournal.make_key('yearly_median', self.geo, timeframe, keywords)
+        if self.journal is not None and self.journal.is_done(key):
+            records = pd.DataFrame(self.journal.get(key), columns=['year', 'value', 'Keyword'])
+            results = [group.reset_index(drop=True) for _, group in records.groupby('Keyword', sort=False)]
+            for keyword in keywords:
+                REGISTRY.record_outcome(keyword, 'resumed')
+            return results, True
+
         results = []
         try:
             # Build payload for the batch
-            self.pytrends.build_payload(keywords, timeframe=timeframe, geo=self.geo)
-            data = self.pytrends.interest_over_time()
+            table = self._yearly_batch(keywords, timeframe)
             
-            if not data.empty:
-                # Process each keyword in the batch
+            if not table.empty:
                 for keyword in keywords:
-                    if keyword in data.columns:
-                        # Group by month and calculate median
-                        data['month'] = data.index.to_period('M')
-                        monthly_median = data.groupby('month')[keyword].median().reset_index()
-                        monthly_median['month'] = monthly_median['month'].dt.to_timestamp()
-                        # Group by year and calculate median
-                        monthly_median['year'] = monthly_median['month'].dt.year
-                        yearly_median = monthly_median.groupby('year')[keyword].median().reset_index()
-                        yearly_median = yearly_median.rename(columns={keyword: 'value'})
-                        yearly_median['Keyword'] = keyword
-                        results.append(yearly_median)
-                    else:
+                    if keyword not in table.columns:
                         print(f"No data returned for {keyword}.")
+                yearly = to_long(table)
+                results.extend(group.reset_index(drop=True) for _, group in yearly.groupby('Keyword', sort=False))
+            for keyword in keywords:
+                REGISTRY.record_outcome(keyword, 'ok' if keyword in table.columns else 'no data')
+            if any(keyword not in table.columns for keyword in keywords):
+                # Not journaled, so a resumed run asks for the keywords without data again
+                return results, False
         except Exception as e:
-            print(f"Error analyzing batch: {str(e)}")
-        return results
+            throttled = isinstance(e, ThrottledError) or is_throttle_error(e)
+            if throttled or not is_keyword_error(e):
+                # No keyword caused a throttle, server error or timeout, so splitting would only spend more
+                # requests; the batch is retried later, and a resumed run fetches it if it is never retried
+                print(f"Error analyzing batch: {str(e)}")
+                for keyword in keywords:
+                    REGISTRY.record_outcome(keyword, 'throttled' if throttled else 'retry', error=str(e))
+                with self._dead_letters_lock:
+                    self.retry_batches.append(list(keywords))
+                return [], False
+            if len(keywords) == 1:
+                # Not journaled, so a resumed run tries the keyword again
+                print(f"Error analyzing {keywords[0]}: {str(e)}")
+                self._add_dead_letter(keywords[0], str(e))
+                return [], False
+            else:
+                # Splitting unevenly puts a 5-keyword batch into 2 + 3, then singles
+                middle = len(keywords) // 2
+                print(f"Error analyzing batch: {str(e)}; retrying as {keywords[:middle]} and {keywords[middle:]}")
+                REGISTRY.inc('batch_splits_total')
+                complete = True
+                for half in (keywords[:middle], keywords[middle:]):
+                    half_results, half_complete = self._analyze_batch(half, timeframe)
+                    results.extend(half_results)
+                    complete = complete and half_complete
+                if not complete:
+                    return results, False
+
+        if self.journal is not None:
+            records = [record for result in results for record in result.to_dict('records')]
+            self.journal.record(key, records)
+        return results, True
+
+    def _add_dead_letter(self, keyword: str, error: str):
+        """Record a keyword that failed on its own."""
+        with self._dead_letters_lock:
+            self.dead_letters.append((keyword, error))
+        REGISTRY.record_outcome(keyword, 'error', error=error)
+
+    def _yearly_batch(self, keywords: List[str], timeframe: str) -> pd.DataFrame:
+        """Return the yearly medians of a batch (a row per year, a column per keyword)."""
+        dates = timeframe.split()
+        if self.stats is not None and self.store is not None and self.incremental and len(dates) == 2:
+            # Running statistics only take in the points the refresh appended
+            refresh_series(self.client, self.store, keywords, self.geo, since=dates[0], end=dates[1], raise_errors=True)
+            return self.stats.yearly_table(self.store, keywords, self.geo, since=dates[0], end=dates[1])
+
+        data = self._fetch_batch(keywords, timeframe)
+        # Aggregate all keywords of the batch at once: monthly medians, then the median per year
+        return yearly_median(data) if not data.empty else pd.DataFrame()
+
+    def _fetch_batch(self, keywords: List[str], timeframe: str) -> pd.DataFrame:
+        """Fetch a batch in full, or only the new tail of its stored series when refreshing incrementally."""
+        dates = timeframe.split()
+        if self.store is not None and self.incremental and len(dates) == 2:
+            # Errors reach _analyze_batch, so stale stored data is never aggregated in place of a failed refresh
+            refresh_series(self.client, self.store, keywords, self.geo, since=dates[0], end=dates[1], raise_errors=True)
+            return self.store.read_matrix(keywords, self.geo, dates[0], dates[1])
+
+        data = self.client.interest_over_time(keywords, timeframe, self.geo)
+        if self.store is not None:
+            self._store_batch(data)
+        return data
+
+    def _store_batch(self, data: pd.DataFrame):
+        """Add a fetched batch to the store without mixing its normalization into series already stored."""
+        new_series = []
+        for keyword in data.columns:
+            if keyword == 'isPartial':
+                continue
+            if (keyword, self.geo) not in self.store:
+                new_series.append((keyword, data[[keyword, 'isPartial']]))
+            elif not append_tail(self.store, keyword, self.geo, data[[keyword, 'isPartial']]):
+                print(f"Stored series of {keyword} left unchanged.")
+        self.store.append_many(new_series, self.geo)
+
+    def _stream_results(self, results: List[pd.DataFrame]):
+        """Write the pivoted rows of a completed batch to the output writer, if any."""
+        if self.writer is not None and results:
+            self.writer.write_rows(pivot_yearly_results(results).to_dict('records'))
 
     def analyze_keywords(self, keywords_df: pd.DataFrame, timeframe: str) -> pd.DataFrame:
         """Analyze trends for a list of keywords from a DataFrame using batch processing."""
-        results = []
         keywords = keywords_df['Keyword'].tolist()
-        
         # Process keywords in batches of 5
-        for i in range(0, len(keywords), 5):
-            batch = keywords[i:i+5]
-            print(f"\nAnalyzing batch of keywords: {batch}")
-            batch_results = self.analyze_keyword_batch(batch, timeframe)
-            results.extend(batch_results)
-            
-            # Respect API rate limits between batches
-            if i + 5 < len(keywords):
-                print("Waiting 65 seconds before next batch...")
-                time.sleep(65)
-        
-        if results:
-            combined_results = pd.concat(results, ignore_index=True)
-            # Pivot the results to get columns: Keyword, 2021, 2022, 2023, 2024, 2025
-            pivoted_results = combined_results.pivot(index='Keyword', columns='year', values='value').reset_index()
-            return pivoted_results
-        else:
-            return pd.DataFrame(columns=['Keyword', '2021', '2022', '2023', '2024', '2025'])
+        batches = [(self.geo, keywords[i:i+5]) for i in range(0, len(keywords), 5)]
+        return pivot_yearly_results(self._run_batches(batches, timeframe))
+
+    def analyze_keywords_geos(self, keywords_df: pd.DataFrame, timeframe: str, geos: List[str]) -> pd.DataFrame:
+        """Analyze a keyword list for several geos in one session, interleaving the batches of the geos round-robin."""
+        keywords = keywords_df['Keyword'].tolist()
+        batches = [keywords[i:i+5] for i in range(0, len(keywords), 5)]
+        jobs = interleave([[(batch_geo, batch) for batch in batches] for batch_geo in geos])
+        return pivot_yearly_results(self._run_batches(jobs, timeframe, tag_geo=True))
+
+    def _run_batches(self, jobs: List[Tuple[str, List[str]]], timeframe: str, tag_geo: bool = False) -> List[pd.DataFrame]:
+        """
+        Analyze (geo, batch) jobs in order and return their results.
+
+        A batch that is throttled or hits a server or network error goes to the back of the queue (up to
+        MAX_REQUEUES times); its keywords are added to dead_letters if it still fails after that.
+        """
+        geo, writer = self.geo, self.writer
+        work = deque((batch_geo, batch, 0) for batch_geo, batch in jobs)
+        results = []
+        try:
+            while work:
+                batch_geo, batch, requeues = work.popleft()
+                self.geo = batch_geo
+                where = f" in {batch_geo}" if tag_geo else ""
+                if tag_geo and writer is not None:
+                    self.writer = writer.tagged(Geo=batch_geo)
+                print(f"\nAnalyzing batch of keywords{where}: {batch}")
+                batch_results = self.analyze_keyword_batch(batch, timeframe)
+                results.extend(result.assign(Geo=batch_geo) if tag_geo else result for result in batch_results)
+                failed, self.retry_batches = self.retry_batches, []
+                for failed_batch in failed:
+                    if requeues < MAX_REQUEUES:
+                        print(f"Requeueing batch{where}: {failed_batch}")
+                        work.append((batch_geo, failed_batch, requeues + 1))
+                    else:
+                        print(f"Warning: batch{where} {failed_batch} still failed after {MAX_REQUEUES} requeues.")
+                        for keyword in failed_batch:
+                            self._add_dead_letter(keyword, f"still throttled or failing after {MAX_REQUEUES} requeues")
+        finally:
+            self.geo, self.writer = geo, writer
+        return results
+
+def yearly_fieldnames(timeframe: str, geos: Optional[List[str]] = None) -> List[str]:
+    """
+    Output columns of the yearly results of a timeframe: Geo (with several geos), Keyword and every year it covers.
+
+    Relative timeframes ('today 5-y') are resolved against today. The first year starts a week early, since
+    weekly series begin on the Sunday before the start date (2021-12-26 for a range from 2022-01-01).
+    """
+    parts = timeframe.split()
+    if parts[0] in ('today', 'now'):
+        amount, unit = int(parts[1][:-2]), parts[1][-1]
+        end = pd.Timestamp.today()
+        offsets = {'y': pd.DateOffset(years=amount), 'm': pd.DateOffset(months=amount),
+                   'd': pd.Timedelta(days=amount), 'H': pd.Timedelta(hours=amount)}
+        start = end - offsets[unit]
+    else:
+        start, end = (pd.Timestamp(part.split('T')[0]) for part in parts)
+    start -= pd.Timedelta(days=7)
+    geo_columns = ['Geo'] if geos is not None and len(geos) > 1 else []
+    return geo_columns + ['Keyword'] + [str(year) for year in range(start.year, end.year + 1)]
+
+def pivot_yearly_results(results: List[pd.DataFrame]) -> pd.DataFrame:
+    """Pivot per-keyword yearly medians into one row per keyword (and geo, if the results have a Geo column) with a column per year."""
+    if results:
+        combined_results = pd.concat(results, ignore_index=True)
+        index = ['Geo', 'Keyword'] if 'Geo' in combined_results.columns else 'Keyword'
+        # Pivot the results to get columns: [Geo,] Keyword, 2021, 2022, 2023, 2024, 2025
+        pivoted_results = combined_results.pivot(index=index, columns='year', values='value').reset_index()
+        return pivoted_results
+    else:
+        return pd.DataFrame(columns=['Keyword', '2021', '2022', '2023', '2024', '2025'])
+
+def save_dead_letters(dead_letters: List[Tuple[str, str]], output_file: str):
+    """Save keywords that failed on their own, with their errors, to a CSV file."""
+    pd.DataFrame(dead_letters, columns=['Keyword', 'Error']).to_csv(output_file, index=False)
+    print(f"{len(dead_letters)} failed keywords saved to {output_file}")
 
 def main():
     parser = argparse.ArgumentParser(description='Analyze keyword trends using Google Trends API with batch processing')
     parser.add_argument('--input', '-i', default='keywords.csv', help='Input CSV file containing keywords (default: keywords.csv)')
     parser.add_argument('--output', '-o', default='keyword_trends_yearly_median.csv', help='Output CSV file for results (default: keyword_trends_yearly_median.csv)')
-    parser.add_argument('--geo', '-g', default='US', help='Geographic region for analysis (default: US)')
+    parser.add_argument('--geo', '-g', default='US',
+                      help='Geographic region, comma-separated regions or @file with one region per line (default: US)')
     parser.add_argument('--timeframe', '-t', default='2022-01-01 2025-06-01', 
                       help='Timeframe for analysis in format "YYYY-MM-DD YYYY-MM-DD" (default: 2022-01-01 2025-06-01)')
+    add_cache_arguments(parser)
+    add_rate_limit_arguments(parser)
+    add_journal_arguments(parser)
+    add_store_arguments(parser)
+    parser.add_argument('--incremental', action='store_true',
+                      help='Only fetch the new tail of series already in the store and aggregate from the store (requires --store)')
+    parser.add_argument('--stats', nargs='?', const=DEFAULT_STATS_FILE,
+                      help='Keep running per-keyword statistics in this file so --incremental only aggregates new points '
+                           f'(default when given without a path: {DEFAULT_STATS_FILE})')
+    parser.add_argument('--dead-letter', help='CSV file for keywords that failed on their own, with their errors')
+    add_metrics_arguments(parser)
     args = parser.parse_args()
+    if args.incremental and not args.store:
+        parser.error('--incremental requires --store')
+    if args.stats and not args.incremental:
+        parser.error('--stats requires --incremental')
 
     try:
         keywords_df = pd.read_csv(args.input)
         if 'Keyword' not in keywords_df.columns:
             raise ValueError("CSV file must contain a 'Keyword' column")
+        geos = parse_geos(args.geo)
     except Exception as e:
         print(f"Error reading input file: {str(e)}")
         return
 
-    analyzer = KeywordTrendAnalyzer2(geo=args.geo)
-    results_df = analyzer.analyze_keywords(keywords_df, args.timeframe)
-    print("\nResults:")
-    print(results_df)
-    results_df.to_csv(args.output, index=False)
-    print(f"\nResults saved to {args.output}")
+    with instrumented_run(args):
+        journal = journal_from_args(args)
+        writer = StreamingCSVWriter(args.output, yearly_fieldnames(args.timeframe, geos))
+        analyzer = KeywordTrendAnalyzer2(geo=geos[0], cache=cache_from_args(args), refresh=args.refresh,
+                                         limiter=rate_limiter_from_args(args), journal=journal, writer=writer,
+                                         store=TimeseriesStore(args.store) if args.store else None,
+                                         incremental=args.incremental,
+                                         stats=IncrementalStats(args.stats) if args.stats else None)
+        try:
+            if len(geos) > 1:
+                results_df = analyzer.analyze_keywords_geos(keywords_df, args.timeframe, geos)
+            else:
+                results_df = analyzer.analyze_keywords(keywords_df, args.timeframe)
+        except KeyboardInterrupt:
+            print(f"\nInterrupted. Completed work is recorded in {journal.path}; rerun with --resume to continue.")
+            return
+        finally:
+            journal.close()
+            writer.close()
+            if analyzer.stats is not None:
+                analyzer.stats.save()
+        print("\nResults:")
+        print(results_df)
+        # Replace the streamed rows with the complete results sorted by (geo and) keyword
+        results_df.to_csv(args.output, index=False)
+        print(f"\nResults saved to {args.output}")
+        if analyzer.dead_letters:
+            print(f"{len(analyzer.dead_letters)} keywords failed: {', '.join(keyword for keyword, _ in analyzer.dead_letters)}")
+            if args.dead_letter:
+                save_dead_letters(analyzer.dead_letters, args.dead_letter)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Metrics - Process-wide instrumentation of the fetch and aggregation hot paths.
+Counters and latency histograms are recorded into a shared registry by the Trends client, the rate limiter,
+the aggregation helpers and the analyzers, and exported as JSON lines or in the Prometheus text format.
+"""
+
+import json
+import time
+import bisect
+import cProfile
+import pstats
+import argparse
+import threading
+import tracemalloc
+import functools
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# Upper bounds in seconds, from in-memory aggregation steps to throttled network round trips
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def _format_labels(labels: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        """Initialize an empty histogram with cumulative upper bounds."""
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        """Record one observation."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """Return (upper bound, observations at or below it) pairs, ending with '+Inf'."""
+        total = 0
+        pairs = []
+        for bound, count in zip(list(self.buckets) + [float('inf')], self.counts):
+            total += count
+            pairs.append(('+Inf' if bound == float('inf') else f'{bound:g}', total))
+        return pairs
+
+class MetricsRegistry:
+    def __init__(self):
+        """Initialize an empty registry."""
+        self._lock = threading.Lock()
+        self.counters: Dict[str, Dict[LabelKey, float]] = {}
+        self.histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+        self.outcomes: Dict[str, Dict] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """Add a value to a counter."""
+        key = _label_key(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        """Record an observation, usually a duration in seconds, in a histogram."""
+        key = _label_key(labels)
+        with self._lock:
+            self.histograms.setdefault(name, {}).setdefault(key, Histogram()).observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        """Time the enclosed block into a histogram."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def record_outcome(self, keyword: str, outcome: str, **details):
+        """Record the final outcome of a keyword ('ok', 'no data', 'error', 'resumed', ...); later calls replace earlier ones."""
+        with self._lock:
+            self.outcomes[keyword] = dict(details, outcome=outcome, time=time.time())
+        self.inc('keyword_outcomes_total', outcome=outcome)
+
+    def reset(self):
+        """Drop everything recorded so far."""
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.outcomes.clear()
+
+    def write_jsonl(self, path: str):
+        """Write one JSON line per counter, histogram and keyword outcome."""
+        with self._lock, open(path, 'w', encoding='utf-8') as f:
+            for name, series in sorted(self.counters.items()):
+                for labels, value in series.items():
+                    f.write(json.dumps({'type': 'counter', 'name': name, 'labels': dict(labels), 'value': value}) + '\n')
+            for name, series in sorted(self.histograms.items()):
+                for labels, histogram in series.items():
+                    f.write(json.dumps({'type': 'histogram', 'name': name, 'labels': dict(labels),
+                                        'count': histogram.count, 'sum': histogram.sum,
+                                        'buckets': dict(histogram.cumulative())}) + '\n')
+            for keyword, outcome in self.outcomes.items():
+                f.write(json.dumps(dict(outcome, type='outcome', keyword=keyword)) + '\n')
+
+    def prometheus_text(self) -> str:
+        """Render every counter and histogram in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append(f'# TYPE {name} counter')
+                lines.extend(f'{name}{_format_labels(labels)} {value:g}' for labels, value in series.items())
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f'# TYPE {name} histogram')
+                for labels, histogram in series.items():
+                    lines.extend(f'{name}_bucket{_format_labels(labels, (("le", bound),))} {count}'
+                                 for bound, count in histogram.cumulative())
+                    lines.append(f'{name}_sum{_format_labels(labels)} {histogram.sum:g}')
+                    lines.append(f'{name}_count{_format_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str):
+        """Write every counter and histogram to a file in the Prometheus text exposition format."""
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus_text())
+
+    def summary(self) -> str:
+        """Return a short human-readable breakdown of where time went."""
+        def total(name: str) -> float:
+            return sum(histogram.sum for histogram in self.histograms.get(name, {}).values())
+
+        with self._lock:
+            counters = {name: sum(series.values()) for name, series in self.counters.items()}
+            network, aggregation = total('trends_call_seconds'), total('aggregation_seconds')
+            outcomes: Dict[str, int] = {}
+            for outcome in self.outcomes.values():
+                outcomes[outcome['outcome']] = outcomes.get(outcome['outcome'], 0) + 1
+        return (f"Requests: {counters.get('trends_requests_total', 0):g} "
+                f"(retries {counters.get('trends_retries_total', 0):g}, throttled {counters.get('trends_throttles_total', 0):g}, "
+                f"cache hits {counters.get('trends_cache_hits_total', 0):g}); "
+                f"time: network {network:.1f}s, sleeping {counters.get('rate_limiter_sleep_seconds_total', 0):.1f}s, "
+                f"aggregation {aggregation:.1f}s; keywords: "
+                + (', '.join(f'{count} {outcome}' for outcome, count in sorted(outcomes.items())) or 'none'))
+
+REGISTRY = MetricsRegistry()
+
+def timed(name: str, **labels) -> Callable:
+    """Decorator that times every call of a function into a histogram of the shared registry."""
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with REGISTRY.timer(name, **labels):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def add_metrics_arguments(parser: argparse.ArgumentParser):
+    """Add the metrics export and profiling options to a command line parser."""
+    parser.add_argument('--metrics-jsonl', help='Write counters, latency histograms and per-keyword outcomes to a JSON lines file')
+    parser.add_argument('--metrics-prom', help='Write counters and latency histograms to a Prometheus text-format file')
+    parser.add_argument('--profile', nargs='?', const='profile.out',
+                      help='Profile the run with cProfile and save the stats (default file: profile.out)')
+    parser.add_argument('--trace-memory', action='store_true',
+                      help='Trace memory allocations with tracemalloc and print the largest allocation sites')
+
+@contextmanager
+def instrumented_run(args: argparse.Namespace) -> Iterator[MetricsRegistry]:
+    """Run the enclosed block with the profilers requested on the command line, then export the metrics."""
+    profiler: Optional[cProfile.Profile] = None
+    if args.trace_memory:
+        tracemalloc.start()
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield REGISTRY
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            print(f"\nProfile saved to {args.profile}; top functions by cumulative time:")
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(15)
+        if args.trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"\nMemory: {current / 1024 / 1024:.1f} MB in use, {peak / 1024 / 1024:.1f} MB peak; largest allocation sites:")
+            for stat in snapshot.statistics('lineno')[:10]:
+                print(f"  {stat}")
+        print(f"\n{REGISTRY.summary()}")
+        if args.metrics_jsonl:
+            REGISTRY.write_jsonl(args.metrics_jsonl)
+            print(f"Metrics saved to {args.metrics_jsonl}")
+        if args.metrics_prom:
+            REGISTRY.write_prometheus(args.metrics_prom)
+            print(f"Metrics saved to {args.metrics_prom}")
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Orchestrator - Analyze a full keyword list with a pool of independent Google Trends sessions.
+Replaces the split_keywords.py / keyword_analyzer2.py / combine_results.py workflow: every session
+pulls 5-keyword batches from a shared queue, so sessions that finish early pick up the remaining work.
+"""
+
+import queue
+import argparse
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+from keyword_analyzer2 import MAX_REQUEUES, KeywordTrendAnalyzer2, pivot_yearly_results, save_dead_letters, yearly_fieldnames
+from trends_cache import TrendsCache, add_cache_arguments, cache_from_args
+from rate_limiter import AdaptiveRateLimiter, add_rate_limit_arguments, rate_limiter_from_args
+from run_journal import RunJournal, add_journal_arguments, journal_from_args
+from result_writer import StreamingCSVWriter
+from metrics import add_metrics_arguments, instrumented_run
+from timeseries_store import TimeseriesStore, add_store_arguments
+from aggregation import to_long, yearly_median
+from request_planner import interleave, load_keywords, parse_geos, plan_requests
+
+def load_proxies(proxy_file: Optional[str]) -> List[str]:
+    """Read one proxy URL per line, ignoring blank lines and comments."""
+    if not proxy_file:
+        return []
+    with open(proxy_file) as f:
+        return [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
+
+def orchestrate(keywords_df: pd.DataFrame, timeframe: str, geo: Union[str, List[str]] = 'US', workers: int = 2,
+                proxies: Optional[List[str]] = None, cache: Optional[TrendsCache] = None, refresh: bool = False,
+                limiter_factory: Callable[[], AdaptiveRateLimiter] = AdaptiveRateLimiter,
+                journal: Optional[RunJournal] = None, writer: Optional[StreamingCSVWriter] = None,
+                backend_factory: Optional[Callable[[int], Any]] = None,
+                dead_letters: Optional[List[Tuple[str, str]]] = None,
+                store: Optional[TimeseriesStore] = None) -> pd.DataFrame:
+    """
+    Analyze keywords in 5-keyword batches spread over a pool of sessions and return the merged results.
+
+    Keywords are deduplicated on their canonical form before any request is made; keywords whose series the store
+    already holds for the timeframe are aggregated from it instead of being fetched. With several geos the
+    work is one set of keyword x geo batches, interleaved round-robin across the geos; a batch that is
+    throttled or hits a server or network error goes to the back of the queue (up to MAX_REQUEUES times) so it
+    does not hold up the others.
+
+    Args:
+        keywords_df (pd.DataFrame): DataFrame with a 'Keyword' column
+        timeframe (str): Timeframe for analysis in format "YYYY-MM-DD YYYY-MM-DD"
+        geo (str or list): Geographic region, or a list of regions; with several regions the results have a Geo column
+        workers (int): Number of sessions, each with its own rate budget
+        proxies (list): Proxy URLs, assigned round-robin so each session has its own identity
+        cache (TrendsCache): Response cache shared by all sessions
+        refresh (bool): Ignore cached responses but store the fresh ones
+        limiter_factory (callable): Creates the rate limiter of each session
+        journal (RunJournal): Journal shared by all sessions; batches already recorded in it are not fetched again
+        writer (StreamingCSVWriter): Output that receives the rows of each batch as soon as it completes
+        backend_factory (callable): Creates the fetch backend of a session from its id (default: a live TrendReq session)
+        dead_letters (list): Receives (keyword, error) for every keyword that failed on its own
+        store (TimeseriesStore): Time series store that fetched series are added to and covered keywords are read from
+    """
+    geos = [geo] if isinstance(geo, str) else list(geo)
+    multi_geo = len(geos) > 1
+    keywords = keywords_df['Keyword'].dropna().tolist()
+    dates = timeframe.split()
+    results = []
+    results_lock = threading.Lock()
+
+    def collect(batch_geo: str, batch_results: List[pd.DataFrame]):
+        if multi_geo:
+            batch_results = [result.assign(Geo=batch_geo) for result in batch_results]
+        with results_lock:
+            results.extend(batch_results)
+        if writer is not None and batch_results:
+            writer.write_rows(pivot_yearly_results(batch_results).to_dict('records'))
+
+    geo_payloads = []
+    for batch_geo in geos:
+        # With refresh nothing already fetched counts, so every keyword is planned as a request
+        plan = plan_requests(keywords, timeframe, batch_geo, cache=None if refresh else cache,
+                             store=None if refresh else store)
+        print(plan.summary() if not multi_geo else f"{batch_geo}: {plan.summary()}")
+        geo_payloads.append([(batch_geo, payload, 0) for payload in plan.payloads])
+        if plan.from_store:
+            yearly = to_long(yearly_median(store.read_matrix(plan.from_store, batch_geo, dates[0], dates[1])))
+            collect(batch_geo, [group.reset_index(drop=True) for _, group in yearly.groupby('Keyword', sort=False)])
+
+    work = queue.Queue()
+    for job in interleave(geo_payloads):
+        work.put(job)
+    workers = max(1, min(workers, work.qsize()))
+    if workers > 1 and not proxies:
+        print("Warning: no proxies given, all sessions share one IP address and its rate limit.")
+    abandoned = []
+
+    def run_session(session_id: int):
+        session_proxies = [proxies[session_id % len(proxies)]] if proxies else None
+        analyzers: Dict[str, KeywordTrendAnalyzer2] = {}
+        limiter = limiter_factory()
+
+        def analyzer_for(batch_geo: str) -> KeywordTrendAnalyzer2:
+            # All geos of a session share one Trends session, rate limiter and proxy
+            if batch_geo not in analyzers:
+                if analyzers:
+                    backend = next(iter(analyzers.values())).pytrends
+                else:
+                    backend = backend_factory(session_id) if backend_factory else None
+                analyzers[batch_geo] = KeywordTrendAnalyzer2(
+                    geo=batch_geo, cache=cache, refresh=refresh, limiter=limiter, proxies=session_proxies,
+                    journal=journal, store=store, backend=backend)
+            return analyzers[batch_geo]
+
+        try:
+            analyzer_for(geos[0])
+        except Exception as e:
+            print(f"[session {session_id}] Could not start session: {str(e)}")
+            return
+        while True:
+            try:
+                batch_geo, batch, requeues = work.get_nowait()
+            except queue.Empty:
+                break
+            where = f" in {batch_geo}" if multi_geo else ""
+            print(f"[session {session_id}] Analyzing batch of keywords{where}: {batch} ({work.qsize()} batches left)")
+            analyzer = analyzer_for(batch_geo)
+            collect(batch_geo, analyzer.analyze_keyword_batch(batch, timeframe))
+            for failed in analyzer.retry_batches:
+                if requeues < MAX_REQUEUES:
+                    print(f"[session {session_id}] Requeueing batch{where}: {failed}")
+                    work.put((batch_geo, failed, requeues + 1))
+                else:
+                    with results_lock:
+                        abandoned.append((batch_geo, failed))
+            analyzer.retry_batches.clear()
+        if dead_letters is not None:
+            with results_lock:
+                for analyzer in analyzers.values():
+                    dead_letters.extend(analyzer.dead_letters)
+
+    if not work.empty():
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(run_session, range(workers)))
+
+    if not work.empty():
+        print(f"Warning: {work.qsize()} batches were not analyzed because no session could be started.")
+    if abandoned:
+        print(f"Warning: {len(abandoned)} batches still failed after {MAX_REQUEUES} requeues; "
+              f"rerun with --resume to fetch them.")
+
+    results_df = pivot_yearly_results(results)
+    return results_df.sort_values(['Geo', 'Keyword'] if multi_geo and results else 'Keyword').reset_index(drop=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Analyze a keyword list with a pool of concurrent Google Trends sessions')
+    parser.add_argument('--input', '-i', nargs='+', default=['keywords.csv'],
+                      help='Input CSV files containing keywords; duplicates across files are fetched once (default: keywords.csv)')
+    parser.add_argument('--output', '-o', default='combined_results.csv', help='Output CSV file for results (default: combined_results.csv)')
+    parser.add_argument('--geo', '-g', default='US',
+                      help='Geographic region, comma-separated regions or @file with one region per line; several '
+                           'regions are fetched as one interleaved job set into one output with a Geo column (default: US)')
+    parser.add_argument('--timeframe', '-t', default='2022-01-01 2025-06-01',
+                      help='Timeframe for analysis in format "YYYY-MM-DD YYYY-MM-DD" (default: 2022-01-01 2025-06-01)')
+    parser.add_argument('--workers', '-n', type=int, default=2, help='Number of concurrent sessions (default: 2)')
+    parser.add_argument('--proxies', help='File with one proxy URL per line, assigned round-robin to the sessions')
+    add_cache_arguments(parser)
+    add_rate_limit_arguments(parser)
+    add_journal_arguments(parser)
+    add_store_arguments(parser)
+    parser.add_argument('--dead-letter', help='CSV file for keywords that failed on their own, with their errors')
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        keywords_df = pd.DataFrame({'Keyword': load_keywords(args.input)})
+        proxies = load_proxies(args.proxies)
+        geos = parse_geos(args.geo)
+    except Exception as e:
+        print(f"Error reading input file: {str(e)}")
+        return
+
+    with instrumented_run(args):
+        journal = journal_from_args(args)
+        writer = StreamingCSVWriter(args.output, yearly_fieldnames(args.timeframe, geos))
+        dead_letters = []
+        try:
+            results_df = orchestrate(keywords_df, args.timeframe, geo=geos, workers=args.workers,
+                                     proxies=proxies, cache=cache_from_args(args), refresh=args.refresh,
+                                     limiter_factory=lambda: rate_limiter_from_args(args),
+                                     journal=journal, writer=writer, dead_letters=dead_letters,
+                                     store=TimeseriesStore(args.store) if args.store else None)
+        except KeyboardInterrupt:
+            print(f"\nInterrupted. Completed work is recorded in {journal.path}; rerun with --resume to continue.")
+            return
+        finally:
+            journal.close()
+            writer.close()
+        print("\nResults:")
+        print(results_df)
+        # Replace the streamed rows with the complete results sorted by (geo and) keyword
+        results_df.to_csv(args.output, index=False)
+        print(f"\nResults saved to {args.output}")
+        if dead_letters:
+            print(f"{len(dead_letters)} keywords failed: {', '.join(keyword for keyword, _ in dead_letters)}")
+            if args.dead_letter:
+                save_dead_letters(dead_letters, args.dead_letter)
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,40 @@
 #!/usr/bin/env python3
 """
-Plot Time Series - A script to plot time series data from raw_timeseries.csv using matplotlib
+Plot Time Series - A script to plot time series data from raw_timeseries.csv or the time series store using matplotlib
+Batch mode renders charts for many keywords headlessly across a process pool, skipping charts whose data has not changed.
 """
 
+import os
+import json
+import hashlib
+import argparse
+from typing import Dict, List, Optional, Tuple
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-import argparse
+import matplotlib.dates as mdates
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from timeseries_store import TimeseriesStore, add_store_arguments
+from aggregation import monthly_median
 
-def plot_timeseries(input_file: str = 'raw_timeseries.csv', keyword: str = None):
-    """Plot the time series data for a keyword from the CSV file, filtered since 2022 and grouped by month (median)."""
-    data = pd.read_csv(input_file)
-    data['date'] = pd.to_datetime(data['date'])
+MANIFEST_FILE = 'manifest.json'
+# Bump when the chart layout changes so every chart is rendered again
+RENDER_VERSION = 1
+
+def plot_timeseries(input_file: str = 'raw_timeseries.csv', keyword: str = None,
+                    store: Optional[TimeseriesStore] = None, geo: str = 'US', show: bool = True):
+    """Plot the time series data for a keyword from the CSV file or the store, filtered since 2022 and grouped by month (median)."""
+    if store is not None:
+        if keyword is None:
+            raise ValueError("A keyword is required when plotting from the store")
+        data = store.read(keyword, geo, start='2022-01-01').reset_index()
+    else:
+        data = pd.read_csv(input_file)
+        data['date'] = pd.to_datetime(data['date'])
     
     # Get the keyword column name (it's the first column that's not 'date' or 'isPartial')
     if keyword is None:
@@ -20,13 +44,11 @@ def plot_timeseries(input_file: str = 'raw_timeseries.csv', keyword: str = None)
     data = data[data['date'] >= '2022-01-01']
     
     # Group by month and calculate median
-    data['month'] = data['date'].dt.to_period('M')
-    monthly_median = data.groupby('month')[keyword].median().reset_index()
-    monthly_median['month'] = monthly_median['month'].dt.to_timestamp()
+    monthly = monthly_median(data.set_index('date')[[keyword]])
     
     # Create the plot
     plt.figure(figsize=(12, 6))
-    plt.plot(monthly_median['month'], monthly_median[keyword], marker='o', label=f'{keyword} (monthly median)')
+    plt.plot(monthly.index, monthly[keyword], marker='o', label=f'{keyword} (monthly median)')
     plt.title(f'Monthly Median Time Series for {keyword} (Since 2022)')
     plt.xlabel('Month')
     plt.ylabel('Interest (Median)')
@@ -34,19 +56,176 @@ def plot_timeseries(input_file: str = 'raw_timeseries.csv', keyword: str = None)
     plt.grid(True)
     
     # Save the plot
-    output_file = f'timeseries_{keyword.replace(" ", "_")}.png'
+    output_file = chart_filename(keyword)
     plt.savefig(output_file)
     print(f"Plot saved to {output_file}")
-    plt.show()
+    if show:
+        plt.show()
+
+def chart_filename(keyword: str) -> str:
+    """File name of the chart for a keyword."""
+    return chart_filenames([keyword])[keyword]
+
+def chart_filenames(keywords: List[str]) -> Dict[str, str]:
+    """File names of the charts of several keywords; keywords with the same slug get a short hash of the keyword appended."""
+    slugs = {keyword: keyword.replace(" ", "_").replace(os.sep, "_") for keyword in keywords}
+    counts = Counter(slugs.values())
+    return {keyword: f'timeseries_{slug}.png' if counts[slug] == 1 else
+            f'timeseries_{slug}_{hashlib.sha1(keyword.encode("utf-8")).hexdigest()[:8]}.png'
+            for keyword, slug in slugs.items()}
+
+def load_monthly(keywords: Optional[List[str]] = None, input_file: str = 'raw_timeseries.csv',
+                 store: Optional[TimeseriesStore] = None, geo: str = 'US', since: str = '2022-01-01') -> pd.DataFrame:
+    """Read the series of many keywords once and return their monthly medians since a date, one column per keyword."""
+    if store is not None:
+        data = store.read_matrix(keywords, geo, start=since)
+        if keywords is not None:
+            missing = [keyword for keyword in keywords if keyword not in data.columns]
+            if missing:
+                print(f"No data in the store for: {', '.join(missing)}")
+    else:
+        data = pd.read_csv(input_file, parse_dates=['date'], index_col='date')
+        data = data[data.index >= since]
+        if keywords is not None:
+            missing = [keyword for keyword in keywords if keyword not in data.columns]
+            if missing:
+                print(f"No data in {input_file} for: {', '.join(missing)}")
+            data = data[[keyword for keyword in keywords if keyword in data.columns]]
+    return monthly_median(data)
+
+def _data_hash(frames: List[Tuple[str, pd.Series]]) -> str:
+    """Hash the data drawn on one image, so unchanged charts can be skipped."""
+    digest = hashlib.sha1(str(RENDER_VERSION).encode())
+    for keyword, series in frames:
+        digest.update(keyword.encode('utf-8'))
+        digest.update(series.index.asi8.tobytes())
+        digest.update(series.to_numpy(dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+def _draw(ax, keyword: str, series: pd.Series, small: bool = False):
+    """Draw the monthly median line of a keyword on an axis."""
+    ax.plot(series.index, series.to_numpy(), marker='o', markersize=2 if small else 6, label=f'{keyword} (monthly median)')
+    ax.grid(True)
+    if small:
+        ax.set_title(keyword, fontsize=9)
+        ax.tick_params(labelsize=7)
+        # Yearly ticks are enough for a small panel and much cheaper to lay out than the automatic date ticks
+        ax.xaxis.set_major_locator(mdates.YearLocator())
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y'))
+    else:
+        ax.set_title(f'Monthly Median Time Series for {keyword} (Since 2022)')
+        ax.set_xlabel('Month')
+        ax.set_ylabel('Interest (Median)')
+        ax.legend()
+
+def _render(job: Tuple[str, List[Tuple[str, pd.Series]], Optional[Tuple[int, int]]]) -> str:
+    """Render one chart or grid page to a PNG with the Agg canvas; runs in a worker process."""
+    output_file, frames, grid = job
+    if grid is None:
+        figure = Figure(figsize=(12, 6))
+        _draw(figure.add_subplot(), *frames[0])
+    else:
+        rows, columns = grid
+        figure = Figure(figsize=(4 * columns, 2.5 * rows), layout='constrained')
+        for position, (keyword, series) in enumerate(frames):
+            _draw(figure.add_subplot(rows, columns, position + 1), keyword, series, small=True)
+    FigureCanvasAgg(figure)
+    figure.savefig(output_file)
+    return output_file
+
+def render_batch(monthly: pd.DataFrame, output_dir: str = 'charts', workers: Optional[int] = None,
+                 grid: Optional[Tuple[int, int]] = None, force: bool = False) -> Dict[str, int]:
+    """
+    Render a chart per keyword column, or pages of small multiples, across a process pool.
+
+    Charts whose data has not changed since they were last rendered are skipped, based on a manifest of
+    data hashes kept in the output directory.
+
+    Args:
+        monthly (pd.DataFrame): Monthly medians with a column per keyword (see load_monthly)
+        output_dir (str): Directory for the PNG files and the manifest
+        workers (int): Number of rendering processes (default: one per CPU)
+        grid (tuple): Rows and columns per page to render grid pages instead of one chart per keyword
+        force (bool): Render every chart even if its data has not changed
+
+    Returns:
+        dict: Number of images 'rendered' and 'skipped'
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_file = os.path.join(output_dir, MANIFEST_FILE)
+    manifest = {}
+    if os.path.exists(manifest_file) and not force:
+        with open(manifest_file, encoding='utf-8') as f:
+            manifest = json.load(f)
+
+    series = [(keyword, monthly[keyword].dropna()) for keyword in monthly.columns]
+    if grid is None:
+        names = chart_filenames([keyword for keyword, _ in series])
+        pages = [(names[keyword], [(keyword, frame)]) for keyword, frame in series]
+    else:
+        per_page = grid[0] * grid[1]
+        pages = [(f'timeseries_page_{i // per_page + 1:03d}.png', series[i:i+per_page])
+                 for i in range(0, len(series), per_page)]
+
+    jobs = []
+    hashes = {}
+    for name, frames in pages:
+        output_file = os.path.join(output_dir, name)
+        hashes[name] = _data_hash(frames)
+        if manifest.get(name) != hashes[name] or not os.path.exists(output_file):
+            jobs.append((output_file, frames, grid))
+
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for output_file in executor.map(_render, jobs, chunksize=max(1, len(jobs) // (4 * (workers or os.cpu_count() or 1)))):
+                print(f"Plot saved to {output_file}")
+
+    manifest.update(hashes)
+    with open(manifest_file, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return {'rendered': len(jobs), 'skipped': len(pages) - len(jobs)}
+
+def _parse_grid(value: str) -> Tuple[int, int]:
+    rows, columns = value.lower().split('x')
+    return int(rows), int(columns)
 
 def main():
     parser = argparse.ArgumentParser(description='Plot time series data from raw_timeseries.csv')
     parser.add_argument('--input', '-i', default='raw_timeseries.csv', 
                       help='Input CSV file containing time series data (default: raw_timeseries.csv)')
-    parser.add_argument('--keyword', '-k', help='Keyword to plot (default: first non-date column in the CSV)')
+    parser.add_argument('--keyword', '-k', help='Keyword to plot (default: first non-date column in the CSV; required with --store)')
+    parser.add_argument('--geo', '-g', default='US', help='Geographic region of the series to plot from the store (default: US)')
+    parser.add_argument('--no-show', action='store_true', help='Save the chart without opening a window')
+    add_store_arguments(parser)
+    batch = parser.add_argument_group('batch mode', 'Render charts for many keywords headlessly (Agg backend) across a process pool')
+    batch.add_argument('--keywords', nargs='+', help='Keywords to render')
+    batch.add_argument('--keywords-file', help="CSV file with a 'Keyword' column, such as keywords.csv or a results file")
+    batch.add_argument('--all', action='store_true', help='Render every keyword in the input CSV or the store')
+    batch.add_argument('--output-dir', default='charts', help='Directory for the rendered charts (default: charts)')
+    batch.add_argument('--workers', '-n', type=int, help='Number of rendering processes (default: one per CPU)')
+    batch.add_argument('--grid', type=_parse_grid, metavar='ROWSxCOLS',
+                       help='Render pages of small multiples, e.g. 4x3, instead of one chart per keyword')
+    batch.add_argument('--force', action='store_true', help='Render every chart, even if its data has not changed')
     args = parser.parse_args()
     
-    plot_timeseries(args.input, args.keyword)
+    store = TimeseriesStore(args.store) if args.store else None
+    if not (args.keywords or args.keywords_file or args.all):
+        plot_timeseries(args.input, args.keyword, store=store, geo=args.geo, show=not args.no_show)
+        return
+
+    try:
+        keywords = list(args.keywords or [])
+        if args.keywords_file:
+            keywords_df = pd.read_csv(args.keywords_file)
+            if 'Keyword' not in keywords_df.columns:
+                raise ValueError("CSV file must contain a 'Keyword' column")
+            keywords.extend(keywords_df['Keyword'].dropna().tolist())
+        monthly = load_monthly(None if args.all else list(dict.fromkeys(keywords)), args.input, store, args.geo)
+    except Exception as e:
+        print(f"Error reading time series data: {str(e)}")
+        return
+    counts = render_batch(monthly, args.output_dir, args.workers, args.grid, args.force)
+    print(f"\n{counts['rendered']} images rendered, {counts['skipped']} unchanged images skipped in {args.output_dir}")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Rate Limiter - Adaptive pacing for Google Trends requests.
+Requests are spaced by an interval that shrinks additively while requests succeed and
+grows multiplicatively (with an exponential, jittered cool-down) when Google throttles us.
+"""
+
+import time
+import random
+import argparse
+import threading
+from typing import Callable, Optional
+from requests.exceptions import RetryError
+from urllib3.exceptions import ResponseError
+
+from metrics import REGISTRY
+
+DEFAULT_INITIAL_INTERVAL = 65.0
+DEFAULT_MIN_INTERVAL = 20.0
+DEFAULT_MAX_INTERVAL = 300.0
+
+class ThrottledError(Exception):
+    """Raised when a request is still throttled after every retry."""
+
+def is_throttle_error(error: Exception) -> bool:
+    """Check whether an exception means Google is rate limiting us (HTTP 429)."""
+    response = getattr(error, 'response', None)
+    if getattr(response, 'status_code', None) == 429:
+        return True
+    if type(error).__name__ == 'TooManyRequestsError':
+        return True
+    # TrendReq retries 429s in urllib3 first; once those retries run out, requests raises a RetryError without
+    # a response, whose MaxRetryError reason is ResponseError('too many 429 error responses')
+    if isinstance(error, RetryError) and error.args:
+        reason = getattr(error.args[0], 'reason', None)
+        return isinstance(reason, ResponseError) and str(reason) == ResponseError.SPECIFIC_ERROR.format(status_code=429)
+    return False
+
+def is_keyword_error(error: Exception) -> bool:
+    """Check whether an exception is a client error (HTTP 4xx other than 429), the only kind a keyword of the payload can cause."""
+    status_code = getattr(getattr(error, 'response', None), 'status_code', None)
+    return isinstance(status_code, int) and 400 <= status_code < 500 and status_code != 429
+
+class AdaptiveRateLimiter:
+    def __init__(self, initial_interval: float = DEFAULT_INITIAL_INTERVAL, min_interval: float = DEFAULT_MIN_INTERVAL,
+                 max_interval: float = DEFAULT_MAX_INTERVAL, speedup_step: float = 2.0, backoff_factor: float = 2.0,
+                 jitter: float = 0.25, burst: int = 1,
+                 sleep: Callable[[float], None] = time.sleep, clock: Callable[[], float] = time.monotonic):
+        """
+        Initialize the limiter.
+
+        Args:
+            initial_interval (float): Seconds between requests at start
+            min_interval (float): Fastest allowed spacing between requests
+            max_interval (float): Slowest spacing, also the cap for a single throttle cool-down
+            speedup_step (float): Seconds taken off the interval after each successful request
+            backoff_factor (float): Factor the interval is multiplied by after a throttled request
+            jitter (float): Relative random spread applied to throttle cool-downs
+            burst (int): Number of requests that may be sent back to back after an idle period
+        """
+        self.interval = initial_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.speedup_step = speedup_step
+        self.backoff_factor = backoff_factor
+        self.jitter = jitter
+        self.burst = max(1, burst)
+        self._sleep = sleep
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._next_slot: Optional[float] = None
+        self._consecutive_throttles = 0
+        self.requests = 0
+        self.throttles = 0
+        self.errors = 0
+        self.slept = 0.0
+
+    def acquire(self):
+        """Block until the next request may be sent. The first request never waits."""
+        with self._lock:
+            now = self._clock()
+            # Unused slots accumulate up to the burst size while we are idle
+            earliest = now - (self.burst - 1) * self.interval
+            slot = earliest if self._next_slot is None else max(self._next_slot, earliest)
+            self._next_slot = slot + self.interval
+            self.requests += 1
+        wait = slot - now
+        if wait > 0:
+            print(f"Waiting {wait:.0f} seconds before next request...")
+            self._sleep(wait)
+            with self._lock:
+                self.slept += wait
+            REGISTRY.inc('rate_limiter_sleep_seconds_total', wait)
+            REGISTRY.observe('rate_limiter_wait_seconds', wait)
+
+    def on_success(self):
+        """Speed up after a successful request."""
+        with self._lock:
+            self._consecutive_throttles = 0
+            self.interval = max(self.min_interval, self.interval - self.speedup_step)
+
+    def on_throttle(self):
+        """Back off after a throttled request, delaying the next slot by an exponential, jittered cool-down."""
+        with self._lock:
+            self.throttles += 1
+            self._consecutive_throttles += 1
+            self.interval = min(self.max_interval, self.interval * self.backoff_factor)
+            cooldown = min(self.max_interval, self.interval * 2 ** (self._consecutive_throttles - 1))
+            cooldown *= random.uniform(1 - self.jitter, 1 + self.jitter)
+            now = self._clock()
+            self._next_slot = max(self._next_slot or now, now + cooldown)
+
+    def on_error(self):
+        """Record a failed request that was not caused by throttling. The pace is left unchanged."""
+        with self._lock:
+            self.errors += 1
+
+def add_rate_limit_arguments(parser: argparse.ArgumentParser):
+    """Add the request pacing options to a command line parser."""
+    parser.add_argument('--interval', type=float, default=DEFAULT_INITIAL_INTERVAL,
+                      help=f'Initial seconds between requests (default: {DEFAULT_INITIAL_INTERVAL:g})')
+    parser.add_argument('--min-interval', type=float, default=DEFAULT_MIN_INTERVAL,
+                      help=f'Fastest spacing between requests while they keep succeeding (default: {DEFAULT_MIN_INTERVAL:g})')
+    parser.add_argument('--max-interval', type=float, default=DEFAULT_MAX_INTERVAL,
+                      help=f'Slowest spacing between requests after throttling (default: {DEFAULT_MAX_INTERVAL:g})')
+
+def rate_limiter_from_args(args: argparse.Namespace) -> AdaptiveRateLimiter:
+    """Create the rate limiter described by the command line options."""
+    return AdaptiveRateLimiter(initial_interval=args.interval, min_interval=args.min_interval,
+                               max_interval=args.max_interval)
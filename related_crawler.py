@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Related Crawler - Discover keywords by expanding seed keywords through Google Trends related and rising queries.
+The crawl is breadth-first up to a depth and a request budget: the frontier is deduplicated on canonical
+keywords and ordered by (depth, rising score), a bounded pool of sessions shares one rate limiter, and the
+state is checkpointed after every batch so an interrupted crawl can be resumed. The output is a Keyword CSV.
+"""
+
+import os
+import json
+import heapq
+import queue
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Tuple
+import pandas as pd
+
+from trends_cache import add_cache_arguments, cache_from_args
+from trends_client import TrendsClient
+from rate_limiter import ThrottledError, add_rate_limit_arguments, is_throttle_error, rate_limiter_from_args
+from request_planner import PAYLOAD_SIZE, canonicalize, load_keywords
+from metrics import REGISTRY, add_metrics_arguments, instrumented_run
+
+# Attempts per keyword before a failing expansion is given up
+MAX_ATTEMPTS = 3
+
+class RelatedCrawler:
+    def __init__(self, client_factory: Callable[[], TrendsClient] = TrendsClient, geo: str = 'US',
+                 timeframe: str = 'today 12-m', max_depth: int = 2, budget: int = 100, workers: int = 2,
+                 include_top: bool = True, checkpoint: Optional[str] = None):
+        """
+        Initialize the crawler.
+
+        Args:
+            client_factory (callable): Creates the client of each worker; give them one shared rate limiter
+            geo (str): Geographic region of the related queries
+            timeframe (str): Timeframe of the related queries
+            max_depth (int): Keywords found at this depth are kept but not expanded (seeds are depth 0)
+            budget (int): Maximum keyword expansions (related queries requests), including failed ones
+            workers (int): Number of batches expanded concurrently
+            include_top (bool): Also follow top queries, after the rising ones of the same depth
+            checkpoint (str): JSON file the crawl state is saved to after every batch
+        """
+        self.client_factory = client_factory
+        self.geo = geo
+        self.timeframe = timeframe
+        self.max_depth = max_depth
+        self.budget = budget
+        self.workers = max(1, workers)
+        self.include_top = include_top
+        self.checkpoint = checkpoint
+        # Frontier entries are (depth, -score, sequence, keyword); rows describe every keyword found, in order
+        self.frontier: List[Tuple[int, float, int, str]] = []
+        self.seen: Dict[str, int] = {}
+        self.rows: List[Dict] = []
+        self.attempts: Dict[str, int] = {}
+        self.spent = 0
+        self.duplicates = 0
+        self._sequence = 0
+        self._running: Dict = {}
+
+    def add(self, keyword: str, depth: int, score: float = 0.0, source: str = '', kind: str = 'seed') -> bool:
+        """
+        Add a keyword to the results and, below the maximum depth, to the frontier. Returns False for duplicates.
+
+        Duplicates are found on the canonical form; the first spelling is kept (only trimmed) for the output
+        and the requests.
+        """
+        key = canonicalize(keyword)
+        if not key:
+            return False
+        if key in self.seen:
+            self.duplicates += 1
+            REGISTRY.inc('crawler_duplicates_total')
+            return False
+        self.seen[key] = depth
+        keyword = str(keyword).strip()
+        self.rows.append({'Keyword': keyword, 'Depth': depth, 'Kind': kind, 'Score': score, 'Source': source})
+        if depth < self.max_depth:
+            self._push(depth, score, keyword)
+        return True
+
+    def _push(self, depth: int, score: float, keyword: str):
+        heapq.heappush(self.frontier, (depth, -score, self._sequence, keyword))
+        self._sequence += 1
+
+    def _next_batch(self) -> List[Tuple[int, float, int, str]]:
+        """Take up to 5 keywords of the shallowest depth with the highest scores, within the remaining budget."""
+        batch = []
+        while self.frontier and len(batch) < PAYLOAD_SIZE and self.spent < self.budget:
+            if batch and self.frontier[0][0] != batch[0][0]:
+                break
+            batch.append(heapq.heappop(self.frontier))
+            self.spent += 1
+        return batch
+
+    def _expand(self, client: TrendsClient, keywords: List[str]) -> Tuple[Dict[str, Dict[str, Optional[pd.DataFrame]]],
+                                                                          Dict[str, Exception]]:
+        """Expand keywords one at a time, so a failure only costs the keyword it hit. Returns the queries and the errors."""
+        related, errors = {}, {}
+        for keyword in keywords:
+            try:
+                related.update(client.related_queries([keyword], self.timeframe, self.geo))
+            except Exception as e:
+                errors[keyword] = e
+        return related, errors
+
+    def _merge(self, batch: List[Tuple[int, float, int, str]], related: Dict[str, Dict[str, Optional[pd.DataFrame]]]):
+        """Add the related queries of an expanded batch, rising queries first."""
+        for depth, _, _, keyword in batch:
+            # Google reports queries under the keyword as sent; match them on the canonical form
+            queries = next((value for key, value in related.items() if canonicalize(key) == canonicalize(keyword)), {})
+            kinds = ('rising', 'top') if self.include_top else ('rising',)
+            for kind in kinds:
+                frame = queries.get(kind)
+                if frame is None or frame.empty:
+                    continue
+                for query, value in zip(frame['query'], frame['value']):
+                    # Top queries rank after every rising query of the same depth
+                    score = float(value) if kind == 'rising' else float(value) / 1000
+                    self.add(query, depth + 1, score, keyword, kind)
+            REGISTRY.inc('crawler_expanded_total')
+
+    def _retry(self, batch: List[Tuple[int, float, int, str]], error: Exception):
+        """Put the keywords of a failed batch back on the frontier, unless they ran out of attempts."""
+        for depth, negative_score, _, keyword in batch:
+            self.attempts[keyword] = self.attempts.get(keyword, 0) + 1
+            if self.attempts[keyword] < MAX_ATTEMPTS:
+                self._push(depth, -negative_score, keyword)
+            else:
+                print(f"Giving up expanding {keyword}: {str(error)}")
+
+    def crawl(self, seeds: List[str]) -> pd.DataFrame:
+        """Expand the seeds (and the frontier of a resumed crawl) until the frontier or the budget runs out."""
+        for seed in seeds:
+            if canonicalize(seed) not in self.seen:
+                self.add(seed, 0)
+        clients = queue.Queue()
+        for _ in range(self.workers):
+            clients.put(self.client_factory())
+
+        def expand(batch: List[Tuple[int, float, int, str]]):
+            client = clients.get()
+            try:
+                return self._expand(client, [keyword for _, _, _, keyword in batch])
+            finally:
+                clients.put(client)
+
+        running = self._running
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                # Only the main thread touches the frontier; workers just issue requests
+                while len(running) < self.workers:
+                    batch = self._next_batch()
+                    if not batch:
+                        break
+                    print(f"Expanding depth {batch[0][0]}: {[keyword for _, _, _, keyword in batch]} "
+                          f"({self.spent}/{self.budget} requests, {len(self.frontier)} queued)")
+                    running[executor.submit(expand, batch)] = batch
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = running.pop(future)
+                    related, errors = future.result()
+                    failed = [entry for entry in batch if entry[3] in errors]
+                    self._merge([entry for entry in batch if entry[3] not in errors], related)
+                    for entry in failed:
+                        error = errors[entry[3]]
+                        if isinstance(error, ThrottledError) or is_throttle_error(error):
+                            print(f"Throttled expanding {entry[3]}: {str(error)}")
+                        else:
+                            print(f"Error expanding {entry[3]}: {str(error)}")
+                        self._retry([entry], error)
+                self.save_checkpoint()
+
+        print(f"Crawl finished: {len(self.rows)} keywords, {self.duplicates} duplicates skipped, "
+              f"{self.spent} requests spent, {len(self.frontier)} keywords left unexpanded")
+        return self.results()
+
+    def results(self) -> pd.DataFrame:
+        """Return every keyword found, in the order it was found."""
+        return pd.DataFrame(self.rows, columns=['Keyword', 'Depth', 'Kind', 'Score', 'Source'])
+
+    def save_checkpoint(self):
+        """Save the frontier, results and spent budget, if a checkpoint file is set."""
+        if not self.checkpoint:
+            return
+        # Batches still being expanded go back on the frontier, and their budget is refunded
+        in_flight = [entry for batch in self._running.values() for entry in batch]
+        state = {'geo': self.geo, 'timeframe': self.timeframe, 'spent': self.spent - len(in_flight),
+                 'sequence': self._sequence, 'duplicates': self.duplicates, 'frontier': self.frontier + in_flight,
+                 'rows': self.rows, 'attempts': self.attempts}
+        tmp_file = f'{self.checkpoint}.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_file, self.checkpoint)
+
+    def load_checkpoint(self) -> bool:
+        """Restore a saved crawl; returns False if there is no checkpoint or it is for another geo or timeframe."""
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return False
+        with open(self.checkpoint, encoding='utf-8') as f:
+            state = json.load(f)
+        if state['geo'] != self.geo or state['timeframe'] != self.timeframe:
+            print(f"Checkpoint {self.checkpoint} is for {state['geo']} / {state['timeframe']}; starting a new crawl.")
+            return False
+        self.spent = state['spent']
+        self._sequence = state['sequence']
+        self.duplicates = state['duplicates']
+        self.frontier = [tuple(entry) for entry in state['frontier']]
+        heapq.heapify(self.frontier)
+        self.rows = state['rows']
+        self.seen = {canonicalize(row['Keyword']): row['Depth'] for row in self.rows}
+        self.attempts = state['attempts']
+        print(f"Resuming crawl from {self.checkpoint}: {len(self.rows)} keywords, {len(self.frontier)} queued, "
+              f"{self.spent} requests spent")
+        return True
+
+def main():
+    parser = argparse.ArgumentParser(description='Discover keywords through Google Trends related and rising queries')
+    parser.add_argument('seeds', nargs='*', help='Seed keywords')
+    parser.add_argument('--input', '-i', nargs='+', help='CSV files with a Keyword column to use as seeds')
+    parser.add_argument('--output', '-o', default='discovered_keywords.csv',
+                      help='Output CSV file with a Keyword column for the analyzers (default: discovered_keywords.csv)')
+    parser.add_argument('--geo', '-g', default='US', help='Geographic region for the related queries (default: US)')
+    parser.add_argument('--timeframe', '-t', default='today 12-m', help='Timeframe for the related queries (default: today 12-m)')
+    parser.add_argument('--depth', '-d', type=int, default=2, help='Maximum expansion depth; seeds are depth 0 (default: 2)')
+    parser.add_argument('--budget', '-b', type=int, default=100,
+                      help='Maximum related queries requests, counted per keyword expanded (default: 100)')
+    parser.add_argument('--workers', '-n', type=int, default=2, help='Number of batches expanded concurrently (default: 2)')
+    parser.add_argument('--rising-only', action='store_true', help='Only follow rising queries, not top queries')
+    parser.add_argument('--checkpoint', help='Crawl state file (default: <output>.crawl.json)')
+    parser.add_argument('--resume', action='store_true', help='Continue the crawl saved in the checkpoint file')
+    add_cache_arguments(parser)
+    add_rate_limit_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        seeds = list(args.seeds) + (load_keywords(args.input) if args.input else [])
+    except Exception as e:
+        print(f"Error reading input file: {str(e)}")
+        return
+
+    with instrumented_run(args):
+        cache = cache_from_args(args)
+        limiter = rate_limiter_from_args(args)
+        crawler = RelatedCrawler(client_factory=lambda: TrendsClient(cache=cache, refresh=args.refresh, limiter=limiter),
+                                 geo=args.geo, timeframe=args.timeframe, max_depth=args.depth, budget=args.budget,
+                                 workers=args.workers, include_top=not args.rising_only,
+                                 checkpoint=args.checkpoint or f'{args.output}.crawl.json')
+        if not (args.resume and crawler.load_checkpoint()) and not seeds:
+            parser.error('give seed keywords, --input or --resume')
+        try:
+            results_df = crawler.crawl(seeds)
+        except KeyboardInterrupt:
+            crawler.save_checkpoint()
+            print(f"\nInterrupted. The crawl is saved in {crawler.checkpoint}; rerun with --resume to continue.")
+            return
+        results_df.to_csv(args.output, index=False)
+        print(f"\n{len(results_df)} keywords saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Request Planner - Decide which Google Trends requests a keyword list needs before anything is fetched.
+Keywords from all input files are deduplicated on their canonical form, keywords whose series are already in the
+store are served from it, and the rest are packed into 5-keyword payloads. Payloads already in the response
+cache cost no request, so chunks for parallel runs are balanced by the requests they will actually issue.
+"""
+
+import re
+import heapq
+import argparse
+import unicodedata
+from typing import Dict, List, Optional, Sequence
+import pandas as pd
+
+from trends_cache import TrendsCache, add_cache_arguments, cache_from_args
+from timeseries_store import TimeseriesStore, add_store_arguments
+
+PAYLOAD_SIZE = 5
+
+def canonicalize(keyword: str) -> str:
+    """Normalize a keyword the way Google Trends matches it: Unicode NFKC, trimmed, single spaces, case-folded."""
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFKC', str(keyword))).strip().casefold()
+
+def load_keyword_rows(input_files: Sequence[str]) -> pd.DataFrame:
+    """Read the rows of every input file that have a keyword, in order, including duplicates, with the columns of all files."""
+    frames = []
+    for input_file in input_files:
+        df = pd.read_csv(input_file)
+        if 'Keyword' not in df.columns:
+            raise ValueError(f"CSV file {input_file} must contain a 'Keyword' column")
+        frames.append(df.dropna(subset=['Keyword']))
+    return pd.concat(frames, ignore_index=True)
+
+def load_keywords(input_files: Sequence[str]) -> List[str]:
+    """Read the 'Keyword' column of every input file, in order, including duplicates."""
+    return load_keyword_rows(input_files)['Keyword'].tolist()
+
+def first_rows(rows: pd.DataFrame) -> pd.DataFrame:
+    """Index the first input row of every keyword by its canonical form, with the keyword trimmed as dedupe_keywords keeps it."""
+    keys = rows['Keyword'].map(canonicalize)
+    first = ~keys.duplicated() & (keys != '')
+    return rows[first].assign(Keyword=rows.loc[first, 'Keyword'].astype(str).str.strip()).set_index(keys[first])
+
+def parse_geos(value: str) -> List[str]:
+    """
+    Parse a --geo value: one geo, a comma-separated list ('US,GB,DE') or '@file' with one geo per line.
+
+    Geos are upper-cased and deduplicated in order; blank entries and '#' comments in files are ignored.
+    """
+    if value.startswith('@'):
+        with open(value[1:]) as f:
+            entries = [line.split('#', 1)[0] for line in f]
+    else:
+        entries = value.split(',')
+    geos = list(dict.fromkeys(entry.strip().upper() for entry in entries if entry.strip()))
+    if not geos:
+        raise ValueError(f"No geos given in {value!r}")
+    return geos
+
+def interleave(groups: Sequence[Sequence]) -> List:
+    """Merge several lists round-robin (first items of every list, then the second ones, ...)."""
+    merged = []
+    for position in range(max((len(group) for group in groups), default=0)):
+        merged.extend(group[position] for group in groups if position < len(group))
+    return merged
+
+def dedupe_keywords(keywords: Sequence[str]) -> List[str]:
+    """
+    Drop empty keywords and duplicates, comparing keywords by their canonical form.
+
+    The first spelling of each keyword is kept (only trimmed), so payloads, output rows and store keys
+    match the input.
+    """
+    unique: Dict[str, str] = {}
+    for keyword in keywords:
+        key = canonicalize(keyword)
+        if key and key not in unique:
+            unique[key] = str(keyword).strip()
+    return list(unique.values())
+
+class RequestPlan:
+    def __init__(self, payloads: List[List[str]], costs: List[int], from_store: List[str], duplicates: int):
+        """Hold the planned payloads with their request costs and the keywords that need no request."""
+        self.payloads = payloads
+        self.costs = costs
+        self.from_store = from_store
+        self.duplicates = duplicates
+
+    @property
+    def requests(self) -> int:
+        """Number of requests the plan will issue."""
+        return sum(self.costs)
+
+    def summary(self) -> str:
+        """Describe the plan in one line."""
+        keywords = sum(len(payload) for payload in self.payloads)
+        cached = sum(1 for cost in self.costs if cost == 0)
+        return (f"{keywords + len(self.from_store)} unique keywords ({self.duplicates} duplicate or blank entries dropped): "
+                f"{len(self.from_store)} served from the store, {len(self.payloads)} payloads "
+                f"of which {cached} are cached, {self.requests} requests to issue")
+
+    def chunks(self, num_chunks: int) -> List[List[List[str]]]:
+        """
+        Balance the payloads over chunks by request cost with the greedy longest-processing-time rule.
+
+        Payloads are taken from the most to the least expensive and each goes to the chunk with the fewest
+        requests so far (then the fewest payloads). Every chunk keeps its payloads in plan order.
+        """
+        num_chunks = max(1, num_chunks)
+        loads = [(0, 0, i) for i in range(num_chunks)]
+        assigned: Dict[int, List[int]] = {i: [] for i in range(num_chunks)}
+        for position in sorted(range(len(self.payloads)), key=lambda position: -self.costs[position]):
+            requests, payloads, chunk = heapq.heappop(loads)
+            assigned[chunk].append(position)
+            heapq.heappush(loads, (requests + self.costs[position], payloads + 1, chunk))
+        return [[self.payloads[position] for position in sorted(assigned[chunk])] for chunk in range(num_chunks)]
+
+def plan_requests(keywords: Sequence[str], timeframe: str, geo: str = 'US', cache: Optional[TrendsCache] = None,
+                  store: Optional[TimeseriesStore] = None, hl: str = 'en-US', tz: int = 360) -> RequestPlan:
+    """
+    Plan the payloads needed to analyze a keyword list.
+
+    Args:
+        keywords (list): Keywords in input order; they are deduplicated on their canonical form
+        timeframe (str): Timeframe of the requests
+        geo (str): Geographic region of the requests
+        cache (TrendsCache): Response cache; cached payloads cost no request
+        store (TimeseriesStore): Time series store; keywords whose series cover the timeframe are not fetched
+        hl (str): Language of the requests, part of the cache key
+        tz (int): Timezone offset of the requests, part of the cache key
+    """
+    unique = dedupe_keywords(keywords)
+    dates = timeframe.split()
+    from_store = []
+    if store is not None and len(dates) == 2:
+        from_store = [keyword for keyword in unique if store.covers(keyword, geo, dates[0], dates[1])]
+    stored = set(from_store)
+    remaining = [keyword for keyword in unique if keyword not in stored]
+
+    payloads = [remaining[i:i+PAYLOAD_SIZE] for i in range(0, len(remaining), PAYLOAD_SIZE)]
+    costs = []
+    for payload in payloads:
+        key = TrendsCache.make_key('interest_over_time', payload, timeframe, geo, hl, tz)
+        costs.append(0 if cache is not None and cache.contains(key) else 1)
+    return RequestPlan(payloads, costs, from_store, len(keywords) - len(unique))
+
+def main():
+    parser = argparse.ArgumentParser(description='Show the Google Trends requests needed for one or more keyword lists')
+    parser.add_argument('--input', '-i', nargs='+', default=['keywords.csv'],
+                      help='Input CSV files containing keywords (default: keywords.csv)')
+    parser.add_argument('--geo', '-g', default='US',
+                      help='Geographic region, comma-separated regions or @file with one region per line (default: US)')
+    parser.add_argument('--timeframe', '-t', default='2022-01-01 2025-06-01',
+                      help='Timeframe for analysis in format "YYYY-MM-DD YYYY-MM-DD" (default: 2022-01-01 2025-06-01)')
+    parser.add_argument('--output', '-o', help='Save the planned payloads to a CSV file (columns: Payload, Keyword, Cost, plus Geo for several regions)')
+    add_cache_arguments(parser)
+    add_store_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        keywords = load_keywords(args.input)
+        geos = parse_geos(args.geo)
+    except Exception as e:
+        print(f"Error reading input file: {str(e)}")
+        return
+
+    cache = cache_from_args(args)
+    store = TimeseriesStore(args.store) if args.store else None
+    rows = []
+    for geo in geos:
+        plan = plan_requests(keywords, args.timeframe, geo, cache=cache, store=store)
+        print(f"{geo}: {plan.summary()}")
+        rows.extend({'Geo': geo, 'Payload': i + 1, 'Keyword': keyword, 'Cost': cost}
+                    for i, (payload, cost) in enumerate(zip(plan.payloads, plan.costs)) for keyword in payload)
+    if args.output:
+        columns = ['Payload', 'Keyword', 'Cost'] if len(geos) == 1 else ['Geo', 'Payload', 'Keyword', 'Cost']
+        pd.DataFrame(rows, columns=['Geo', 'Payload', 'Keyword', 'Cost'])[columns].to_csv(args.output, index=False)
+        print(f"Plan saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
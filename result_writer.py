@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Result Writer - Stream result rows to a CSV file as each keyword or batch completes.
+Rows are flushed after every write, so the output can be read while a run is still going.
+"""
+
+import csv
+import math
+import threading
+from typing import Dict, Iterable, List, Optional
+
+class StreamingCSVWriter:
+    def __init__(self, path: str, fieldnames: Optional[List[str]] = None):
+        """
+        Open the output file, replacing any previous contents.
+
+        Args:
+            path (str): Output CSV file
+            fieldnames (list): Column order; taken from the first row written if not given. Columns of later
+                rows that are not in it are left out of the file with a warning, since the header is already written.
+        """
+        self.path = path
+        self.fieldnames = fieldnames
+        self.rows_written = 0
+        self._lock = threading.Lock()
+        self._file = open(path, 'w', newline='', encoding='utf-8')
+        self._writer = None
+
+    def write_rows(self, rows: Iterable[Dict]):
+        """Append rows to the output and flush them to disk."""
+        rows = list(rows)
+        if not rows:
+            return
+        with self._lock:
+            if self._writer is None:
+                fieldnames = self.fieldnames or list(rows[0].keys())
+                self.fieldnames = [str(name) for name in fieldnames]
+                self._writer = csv.DictWriter(self._file, fieldnames=self.fieldnames, restval='')
+                self._fields = set(self.fieldnames)
+                self._known = set(self.fieldnames)
+                self._writer.writeheader()
+            for row in rows:
+                row = {str(name): self._format(value) for name, value in row.items()}
+                unknown = [name for name in row if name not in self._known]
+                if unknown:
+                    # Dropped explicitly, so a late column cannot abort a long run
+                    print(f"Warning: columns {', '.join(unknown)} are not in the header of {self.path}; "
+                          f"leaving them out of the streamed rows.")
+                    self._known.update(unknown)
+                self._writer.writerow({name: value for name, value in row.items() if name in self._fields})
+            self._file.flush()
+            self.rows_written += len(rows)
+
+    @staticmethod
+    def _format(value):
+        # Match pandas' to_csv, which writes missing values as empty fields
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            return ''
+        return value
+
+    def tagged(self, **columns) -> 'TaggedCSVWriter':
+        """Return a view of this writer that adds fixed leading columns (such as the geo) to every row."""
+        return TaggedCSVWriter(self, columns)
+
+    def close(self):
+        """Close the output file."""
+        with self._lock:
+            self._file.close()
+
+class TaggedCSVWriter:
+    def __init__(self, writer: StreamingCSVWriter, columns: Dict):
+        """Wrap a writer so that every row starts with the given columns."""
+        self.writer = writer
+        self.columns = columns
+
+    @property
+    def path(self) -> str:
+        return self.writer.path
+
+    def write_rows(self, rows: Iterable[Dict]):
+        """Append rows, with the fixed columns first, to the underlying output."""
+        self.writer.write_rows({**self.columns, **row} for row in rows)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Run Journal - A durable, append-only record of completed work for resumable analysis runs.
+Each completed keyword or batch is written as one JSON line and synced to disk immediately,
+so an interrupted run can skip finished work with --resume and rebuild its results from the journal.
+"""
+
+import os
+import json
+import time
+import argparse
+import threading
+from typing import Any, Dict, Optional, Sequence
+
+class RunJournal:
+    def __init__(self, path: str, resume: bool = False):
+        """Open the journal, loading completed entries when resuming or starting a fresh journal otherwise."""
+        self.path = path
+        self._lock = threading.Lock()
+        self._completed: Dict[str, Any] = {}
+
+        if os.path.exists(path):
+            if resume:
+                self._load()
+                print(f"Resuming from {path}: {len(self._completed)} completed entries")
+            else:
+                os.replace(path, f'{path}.bak')
+                print(f"Previous journal moved to {path}.bak (use --resume to continue a run)")
+        self._file = open(path, 'a', encoding='utf-8')
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """Build a journal key from the parts that identify a unit of work."""
+        flat = []
+        for part in parts:
+            if isinstance(part, (list, tuple)):
+                flat.extend(part)
+            else:
+                flat.append(part)
+        return json.dumps(flat, ensure_ascii=False)
+
+    def _load(self):
+        with open(self.path, encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                try:
+                    entry = json.loads(line)
+                    self._completed[entry['key']] = entry['result']
+                except (ValueError, KeyError):
+                    # A crash can leave a truncated last line; that work is simply redone
+                    print(f"Skipping unreadable journal line {line_number} in {self.path}")
+
+    def is_done(self, key: str) -> bool:
+        """Check whether a unit of work has already been completed."""
+        return key in self._completed
+
+    def get(self, key: str) -> Any:
+        """Return the recorded result of a completed unit of work."""
+        return self._completed[key]
+
+    def record(self, key: str, result: Any):
+        """Append a completed unit of work and sync it to disk before returning."""
+        line = json.dumps({'key': key, 'result': result, 'time': time.time()}, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._completed[key] = result
+
+    def close(self):
+        """Close the journal file."""
+        with self._lock:
+            self._file.close()
+
+def add_journal_arguments(parser: argparse.ArgumentParser):
+    """Add the run journal options to a command line parser."""
+    parser.add_argument('--journal', help='Journal file recording completed work (default: <output>.journal.jsonl)')
+    parser.add_argument('--resume', action='store_true',
+                      help='Skip work already recorded in the journal and rebuild the results from it')
+
+def journal_from_args(args: argparse.Namespace) -> RunJournal:
+    """Open the journal described by the command line options."""
+    return RunJournal(args.journal or f'{args.output}.journal.jsonl', resume=args.resume)
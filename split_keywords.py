@@ -5,61 +5,84 @@ Each chunk will be saved as a separate CSV file.
 """
 
 import argparse
-import pandas as pd
-import math
 import os
+from typing import Optional, Sequence, Union
 
-def split_keywords(input_file: str, num_chunks: int, output_dir: str = 'keyword_chunks'):
+from trends_cache import TrendsCache, add_cache_arguments, cache_from_args
+from timeseries_store import TimeseriesStore, add_store_arguments
+from request_planner import canonicalize, first_rows, load_keyword_rows, plan_requests
+
+def split_keywords(input_files: Union[str, Sequence[str]], num_chunks: int, output_dir: str = 'keyword_chunks',
+                   timeframe: str = '2022-01-01 2025-06-01', geo: str = 'US',
+                   cache: Optional[TrendsCache] = None, store: Optional[TimeseriesStore] = None):
     """
     Split keywords into multiple chunks and save as separate CSV files.
+
+    Keywords from all input files are deduplicated on their canonical form, then packed into 5-keyword payloads
+    that are spread over the chunks by the number of requests they need, so cached payloads do not count.
+    Keywords whose series the store already holds for the timeframe are written to keywords_from_store.csv instead.
+    Every keyword is written with the other columns of its first input row.
     
     Args:
-        input_file (str): Path to input CSV file containing keywords
+        input_files (str or list): Path(s) to input CSV files containing keywords
         num_chunks (int): Number of chunks to split the keywords into
         output_dir (str): Directory to save the chunk files
+        timeframe (str): Timeframe the chunks will be analyzed for, used to look up the cache and store
+        geo (str): Geographic region the chunks will be analyzed for
+        cache (TrendsCache): Response cache used to estimate the requests of each payload
+        store (TimeseriesStore): Time series store whose covered keywords need no request
     """
+    if isinstance(input_files, str):
+        input_files = [input_files]
+
     # Create output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
     
     # Read keywords
     try:
-        df = pd.read_csv(input_file)
-        if 'Keyword' not in df.columns:
-            raise ValueError("CSV file must contain a 'Keyword' column")
+        rows = load_keyword_rows(input_files)
     except Exception as e:
         print(f"Error reading input file: {str(e)}")
         return
     
-    # Calculate chunk size
-    total_keywords = len(df)
-    chunk_size = math.ceil(total_keywords / num_chunks)
+    rows_by_key = first_rows(rows)
+    plan = plan_requests(rows['Keyword'].tolist(), timeframe, geo, cache=cache, store=store)
+    print(plan.summary())
+    if plan.from_store:
+        store_file = os.path.join(output_dir, 'keywords_from_store.csv')
+        rows_by_key.loc[[canonicalize(keyword) for keyword in plan.from_store]].to_csv(store_file, index=False)
+        print(f"Keywords already in the store saved to {store_file}")
     
-    # Split and save chunks
-    for i in range(num_chunks):
-        start_idx = i * chunk_size
-        end_idx = min((i + 1) * chunk_size, total_keywords)
-        
-        # Get chunk of keywords
-        chunk_df = df.iloc[start_idx:end_idx]
+    # Split and save chunks, keeping whole payloads together so each chunk reproduces them in order
+    costs = {tuple(payload): cost for payload, cost in zip(plan.payloads, plan.costs)}
+    for i, payloads in enumerate(plan.chunks(num_chunks)):
+        chunk_df = rows_by_key.loc[[canonicalize(keyword) for payload in payloads for keyword in payload]]
         
         # Save chunk to CSV
         output_file = os.path.join(output_dir, f'keywords_chunk_{i+1}.csv')
         chunk_df.to_csv(output_file, index=False)
         
-        print(f"Created chunk {i+1}/{num_chunks}: {output_file} ({len(chunk_df)} keywords)")
+        requests = sum(costs[tuple(payload)] for payload in payloads)
+        print(f"Created chunk {i+1}/{num_chunks}: {output_file} ({len(chunk_df)} keywords, {requests} requests)")
 
 def main():
     parser = argparse.ArgumentParser(description='Split keywords into chunks for parallel processing')
-    parser.add_argument('--input', '-i', default='keywords.csv', 
-                      help='Input CSV file containing keywords (default: keywords.csv)')
+    parser.add_argument('--input', '-i', nargs='+', default=['keywords.csv'],
+                      help='Input CSV files containing keywords (default: keywords.csv)')
     parser.add_argument('--chunks', '-n', type=int, default=2,
                       help='Number of chunks to split into (default: 2)')
     parser.add_argument('--output-dir', '-o', default='keyword_chunks',
                       help='Directory to save chunk files (default: keyword_chunks)')
+    parser.add_argument('--geo', '-g', default='US', help='Geographic region the chunks will be analyzed for (default: US)')
+    parser.add_argument('--timeframe', '-t', default='2022-01-01 2025-06-01',
+                      help='Timeframe the chunks will be analyzed for (default: 2022-01-01 2025-06-01)')
+    add_cache_arguments(parser)
+    add_store_arguments(parser)
     
     args = parser.parse_args()
     
-    split_keywords(args.input, args.chunks, args.output_dir)
+    split_keywords(args.input, args.chunks, args.output_dir, timeframe=args.timeframe, geo=args.geo,
+                   cache=cache_from_args(args), store=TimeseriesStore(args.store) if args.store else None)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Tests for throttle detection against a real urllib3 Retry adapter, configured the way TrendReq configures it.
+Run with: python -m pytest test_rate_limiter.py
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from pytrends.request import TrendReq
+
+from rate_limiter import is_keyword_error, is_throttle_error
+
+def _serve(status: int):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def _exhaust_retries(status: int) -> Exception:
+    """Request a server that always answers with a status through TrendReq's retry settings and return the error."""
+    server = _serve(status)
+    session = requests.Session()
+    retry = Retry(total=2, read=2, connect=2, backoff_factor=0.01, status_forcelist=TrendReq.ERROR_CODES)
+    session.mount('http://', HTTPAdapter(max_retries=retry))
+    try:
+        with pytest.raises(requests.exceptions.RetryError) as error:
+            session.get(f'http://127.0.0.1:{server.server_port}/')
+        return error.value
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_retried_429_is_throttling():
+    error = _exhaust_retries(429)
+    assert error.response is None
+    assert is_throttle_error(error)
+    assert not is_keyword_error(error)
+
+def test_retried_server_error_is_not_throttling():
+    error = _exhaust_retries(500)
+    assert not is_throttle_error(error)
+    assert not is_keyword_error(error)
+
+def test_429_in_message_is_not_throttling():
+    assert not is_throttle_error(ValueError('no data for keyword 429'))
@@ -3,38 +3,119 @@
 Time Series Puller - A script to pull historical time series data for a single keyword using Google Trends API
 """
 
+import os
 import argparse
+from typing import Optional
 import pandas as pd
-from pytrends.request import TrendReq
 from datetime import datetime
 
-def pull_timeseries(keyword: str, geo: str = 'US', output_file: str = 'raw_timeseries.csv', since: str = '2022-01-01'):
-    """Pull historical time series data for a single keyword with weekly granularity since a given date."""
+from trends_cache import TrendsCache, add_cache_arguments, cache_from_args
+from trends_client import TrendsClient
+from rate_limiter import AdaptiveRateLimiter, add_rate_limit_arguments, rate_limiter_from_args
+from timeseries_store import TimeseriesStore, add_store_arguments
+from incremental_refresh import refresh_series
+from window_planner import fetch_stitched
+from metrics import add_metrics_arguments, instrumented_run
+
+def pull_timeseries(keyword: str, geo: str = 'US', output_file: Optional[str] = 'raw_timeseries.csv', since: str = '2022-01-01',
+                    cache: Optional[TrendsCache] = None, refresh: bool = False,
+                    limiter: Optional[AdaptiveRateLimiter] = None, store: Optional[TimeseriesStore] = None):
+    """Pull historical time series data for a single keyword with weekly granularity since a given date into a CSV file and/or the store."""
     print(f"Pulling historical time series for: {keyword} since {since}")
-    pytrends = TrendReq(hl='en-US', tz=360, timeout=(10,25), retries=2, backoff_factor=0.1)
+    client = TrendsClient(hl='en-US', tz=360, cache=cache, refresh=refresh, limiter=limiter)
     try:
         today = datetime.today().strftime('%Y-%m-%d')
         timeframe = f"{since} {today}"
-        pytrends.build_payload([keyword], timeframe=timeframe, geo=geo)
-        data = pytrends.interest_over_time()
+        data = client.interest_over_time([keyword], timeframe, geo)
+        if not data.empty:
+            if store is not None:
+                store.append(keyword, geo, data)
+                print(f"Raw time series data saved to store {store.path}")
+            if output_file:
+                data.to_csv(output_file)
+                print(f"Raw time series data saved to {output_file}")
+            print(data)
+        else:
+            print("No data returned for this keyword.")
+    except Exception as e:
+        print(f"Error pulling time series for {keyword}: {str(e)}")
+
+def pull_stitched_timeseries(keyword: str, geo: str = 'US', output_file: Optional[str] = 'raw_timeseries.csv',
+                             since: str = '2022-01-01', resolution: str = 'daily', workers: int = 2,
+                             cache: Optional[TrendsCache] = None, refresh: bool = False,
+                             limiter: Optional[AdaptiveRateLimiter] = None, store: Optional[TimeseriesStore] = None):
+    """Pull a daily or hourly time series since a given date by stitching overlapping windows fetched concurrently."""
+    print(f"Pulling {resolution} time series for: {keyword} since {since}")
+    # One client per worker, all paced by the same limiter
+    limiter = limiter or AdaptiveRateLimiter()
+    try:
+        end = datetime.today().strftime('%Y-%m-%d' if resolution == 'daily' else '%Y-%m-%dT%H')
+        data = fetch_stitched([keyword], since, end, geo, resolution, workers=workers,
+                              client_factory=lambda: TrendsClient(hl='en-US', tz=360, cache=cache, refresh=refresh,
+                                                                  limiter=limiter))
         if not data.empty:
-            data.to_csv(output_file)
-            print(f"Raw time series data saved to {output_file}")
+            if store is not None:
+                store.append(keyword, geo, data)
+                print(f"Stitched time series data saved to store {store.path}")
+            if output_file:
+                data.to_csv(output_file)
+                print(f"Stitched time series data saved to {output_file}")
             print(data)
         else:
             print("No data returned for this keyword.")
     except Exception as e:
         print(f"Error pulling time series for {keyword}: {str(e)}")
 
+def refresh_timeseries(keyword: str, store: TimeseriesStore, geo: str = 'US', since: str = '2022-01-01',
+                       cache: Optional[TrendsCache] = None, refresh: bool = False,
+                       limiter: Optional[AdaptiveRateLimiter] = None):
+    """Bring a stored series up to date by fetching only its new tail, or all of it since a given date if it is not stored yet."""
+    print(f"Refreshing stored time series for: {keyword}")
+    client = TrendsClient(hl='en-US', tz=360, cache=cache, refresh=refresh, limiter=limiter)
+    outcome = refresh_series(client, store, [keyword], geo, since=since)[keyword]
+    print(f"{keyword}: {outcome}")
+    print(store.read(keyword, geo).tail())
+
 def main():
     parser = argparse.ArgumentParser(description='Pull historical time series data for a single keyword')
     parser.add_argument('keyword', help='The keyword to pull time series data for')
     parser.add_argument('--geo', '-g', default='US', help='Geographic region for analysis (default: US)')
-    parser.add_argument('--output', '-o', default='raw_timeseries.csv', help='Output CSV file for results (default: raw_timeseries.csv)')
+    parser.add_argument('--output', '-o', help='Output CSV file for results (default: raw_timeseries.csv unless --store is given)')
     parser.add_argument('--since', default='2022-01-01', help='Start date for data collection (default: 2022-01-01)')
+    add_cache_arguments(parser)
+    add_rate_limit_arguments(parser)
+    add_store_arguments(parser)
+    parser.add_argument('--incremental', action='store_true',
+                      help='Only fetch the new tail of the series already in the store (requires --store)')
+    parser.add_argument('--resolution', choices=['auto', 'daily', 'hourly'], default='auto',
+                      help='auto fetches the range in one request (weekly or monthly for long ranges); daily and hourly '
+                           'stitch overlapping windows into one series (default: auto)')
+    parser.add_argument('--workers', '-w', type=int, default=2,
+                      help='Number of windows fetched concurrently with --resolution daily or hourly (default: 2)')
+    add_metrics_arguments(parser)
     args = parser.parse_args()
 
-    pull_timeseries(args.keyword, args.geo, args.output, args.since)
+    store = TimeseriesStore(args.store) if args.store else None
+    if args.incremental and store is None:
+        parser.error('--incremental requires --store')
+    if args.incremental and args.resolution != 'auto':
+        parser.error('--incremental cannot be combined with --resolution daily or hourly')
+    with instrumented_run(args):
+        if args.incremental:
+            refresh_timeseries(args.keyword, store, args.geo, args.since, cache=cache_from_args(args), refresh=args.refresh,
+                               limiter=rate_limiter_from_args(args))
+            return
+        output_file = args.output if args.output or store is not None else 'raw_timeseries.csv'
+        if args.resolution != 'auto':
+            # Finer series are kept apart from the weekly ones, like the hourly series of the analyzer
+            if store is not None:
+                store = TimeseriesStore(os.path.join(store.path, args.resolution))
+            pull_stitched_timeseries(args.keyword, args.geo, output_file, args.since, args.resolution, args.workers,
+                                     cache=cache_from_args(args), refresh=args.refresh,
+                                     limiter=rate_limiter_from_args(args), store=store)
+            return
+        pull_timeseries(args.keyword, args.geo, output_file, args.since, cache=cache_from_args(args), refresh=args.refresh,
+                        limiter=rate_limiter_from_args(args), store=store)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Time Series Store - A keyed, memory-mapped store for Google Trends time series of many keywords and geos.
+Each series is kept as NumPy arrays: dates as int64 seconds, interest values as uint8 and isPartial as a
+bitmask. Reads memory-map the arrays and slice them by date with a binary search, so no CSV is parsed.
+Appends write only the tail of the arrays that changed, and record the changed index entries in a journal
+that is folded into index.json every INDEX_COMPACT_EVERY entries.
+"""
+
+import io
+import os
+import json
+import argparse
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows: writes are only serialized between the threads of one process
+    fcntl = None
+
+DEFAULT_STORE_DIR = 'timeseries_store'
+INDEX_COMPACT_EVERY = 1000
+
+class TimeseriesStore:
+    def __init__(self, path: str = DEFAULT_STORE_DIR):
+        """Open the store directory, creating it if needed."""
+        self.path = path
+        self._series_dir = os.path.join(path, 'series')
+        self._index_file = os.path.join(path, 'index.json')
+        self._journal_file = os.path.join(path, 'index.log')
+        self._lock_file = os.path.join(path, 'index.lock')
+        self._lock = threading.RLock()
+        os.makedirs(self._series_dir, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        """Read index.json and replay the journal of entries changed since it was written."""
+        # The journal is opened first: if another writer compacts in between, replaying the old journal
+        # over the new index.json only repeats entries it already holds
+        try:
+            journal = open(self._journal_file, 'rb')
+        except FileNotFoundError:
+            journal = None
+        try:
+            self._index = {'next_id': 0, 'series': {}}
+            self._index_stamp = None
+            if os.path.exists(self._index_file):
+                stat = os.stat(self._index_file)
+                with open(self._index_file, encoding='utf-8') as f:
+                    self._index = json.load(f)
+                self._index_stamp = self._stamp(stat)
+            self._journal_inode = None
+            self._journal_offset = 0
+            self._journal_entries = 0
+            if journal is not None:
+                self._replay_journal(journal)
+        finally:
+            if journal is not None:
+                journal.close()
+
+    def _replay_journal(self, journal: io.BufferedReader):
+        """Apply the journal entries written since the last replay; a line still being written is left for later."""
+        self._journal_inode = os.fstat(journal.fileno()).st_ino
+        journal.seek(self._journal_offset)
+        chunk = journal.read()
+        end = chunk.rfind(b'\n') + 1
+        for line in chunk[:end].splitlines():
+            record = json.loads(line)
+            self._index['series'][record['key']] = record['entry']
+            self._index['next_id'] = max(self._index['next_id'], record['next_id'])
+            self._journal_entries += 1
+        self._journal_offset += end
+
+    @staticmethod
+    def _stamp(stat: os.stat_result) -> Tuple[int, int, int]:
+        # The index is replaced, never rewritten in place, so a new inode means another writer saved it
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _reload_index(self):
+        """Pick up series another process added or changed since the index was last read."""
+        with self._lock:
+            try:
+                index_stamp = self._stamp(os.stat(self._index_file))
+            except FileNotFoundError:
+                index_stamp = None
+            try:
+                journal = open(self._journal_file, 'rb')
+            except FileNotFoundError:
+                journal = None
+            try:
+                journal_inode = os.fstat(journal.fileno()).st_ino if journal is not None else None
+                if index_stamp != self._index_stamp or journal_inode != self._journal_inode:
+                    self._load_index()
+                elif journal is not None:
+                    self._replay_journal(journal)
+            finally:
+                if journal is not None:
+                    journal.close()
+
+    @contextmanager
+    def _write_lock(self) -> Iterator[None]:
+        """Serialize writers across threads and, through a lock file, across processes sharing the store."""
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self._lock_file, 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _save_index(self, keys: List[str]):
+        """Append the changed entries to the journal, or fold everything into index.json once the journal is long."""
+        if self._journal_entries + len(keys) > INDEX_COMPACT_EVERY:
+            self._compact_index()
+            return
+        lines = [json.dumps({'key': key, 'entry': self._index['series'][key], 'next_id': self._index['next_id']},
+                            ensure_ascii=False) + '\n' for key in keys]
+        with open(self._journal_file, 'ab') as f:
+            f.write(''.join(lines).encode('utf-8'))
+            self._journal_inode = os.fstat(f.fileno()).st_ino
+            self._journal_offset = f.tell()
+        self._journal_entries += len(keys)
+
+    def _compact_index(self):
+        tmp_file = f'{self._index_file}.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f, ensure_ascii=False)
+        os.replace(tmp_file, self._index_file)
+        self._index_stamp = self._stamp(os.stat(self._index_file))
+        tmp_file = f'{self._journal_file}.tmp'
+        open(tmp_file, 'wb').close()
+        os.replace(tmp_file, self._journal_file)
+        self._journal_inode = os.stat(self._journal_file).st_ino
+        self._journal_offset = 0
+        self._journal_entries = 0
+
+    @staticmethod
+    def _key(keyword: str, geo: str) -> str:
+        return f'{geo}\t{keyword}'
+
+    def _files(self, series_id: str) -> Tuple[str, str, str]:
+        base = os.path.join(self._series_dir, series_id)
+        return f'{base}.dates.npy', f'{base}.values.npy', f'{base}.partial.npy'
+
+    def series_keys(self, geo: Optional[str] = None) -> List[Tuple[str, str]]:
+        """List the (keyword, geo) pairs held in the store, optionally for a single geo."""
+        self._reload_index()
+        return [(entry['keyword'], entry['geo']) for entry in self._index['series'].values()
+                if geo is None or entry['geo'] == geo]
+
+    def __contains__(self, item: Tuple[str, str]) -> bool:
+        keyword, geo = item
+        self._reload_index()
+        return self._key(keyword, geo) in self._index['series']
+
+    def last_date(self, keyword: str, geo: str) -> Optional[pd.Timestamp]:
+        """Return the last stored date of a series, or None if it is not stored."""
+        self._reload_index()
+        entry = self._index['series'].get(self._key(keyword, geo))
+        if entry is None or entry['length'] == 0:
+            return None
+        return pd.Timestamp(entry['last'], unit='s')
+
+    def covers(self, keyword: str, geo: str, start: str, end: str, slack_days: int = 7) -> bool:
+        """
+        Check whether a stored series spans a date range with final (not isPartial) data.
+
+        The slack allows for weekly and monthly series, whose first and last points do not fall on the range bounds.
+        """
+        self._reload_index()
+        entry = self._index['series'].get(self._key(keyword, geo))
+        if entry is None or entry['length'] == 0:
+            return False
+        slack = slack_days * 86400
+        if entry['first'] > self._to_seconds(start) + slack or entry['last'] < self._to_seconds(end) - slack:
+            return False
+        _, _, partial = self._read_arrays(entry)
+        return not partial[-1]
+
+    def _read_arrays(self, entry: Dict) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        dates_file, values_file, partial_file = self._files(entry['id'])
+        # Arrays grow in place, so a reader holding an older index only looks at the rows it knows of
+        dates = np.load(dates_file, mmap_mode='r')[:entry['length']]
+        values = np.load(values_file, mmap_mode='r')[:entry['length']]
+        partial = np.unpackbits(np.load(partial_file), count=entry['length']).astype(bool)
+        return dates, values, partial
+
+    def append(self, keyword: str, geo: str, data: pd.DataFrame):
+        """
+        Add observations to a series. Rows for dates already stored replace the stored ones.
+
+        Args:
+            keyword (str): Keyword of the series
+            geo (str): Geographic region of the series
+            data (pd.DataFrame): Frame indexed by date with a column for the keyword and optionally 'isPartial'
+        """
+        self.append_many([(keyword, data)], geo)
+
+    def append_many(self, series: Iterable[Tuple[str, pd.DataFrame]], geo: str):
+        """
+        Add observations to several series of one geo under one lock, saving the index once.
+
+        The index is re-read under the lock first, so series added by another process are merged, not lost.
+        """
+        series = [(keyword, data) for keyword, data in series if not data.empty and keyword in data.columns]
+        if not series:
+            return
+        with self._write_lock():
+            self._reload_index()
+            keys = [self._write_series(keyword, geo, data) for keyword, data in series]
+            keys = [key for key in keys if key is not None]
+            if keys:
+                self._save_index(keys)
+
+    def _write_series(self, keyword: str, geo: str, data: pd.DataFrame) -> Optional[str]:
+        """Merge observations into a series, rewriting only the stored rows from its first new date on."""
+        new_values = data[keyword].to_numpy(dtype=float)
+        missing = ~np.isfinite(new_values)
+        if missing.any():
+            # Values are stored as uint8, which has no missing value, so the dates are left out instead
+            print(f"Warning: leaving {int(missing.sum())} missing values of {keyword} ({geo}) out of the store.")
+            data = data[~missing]
+            new_values = new_values[~missing]
+            if data.empty:
+                return None
+        new_dates = pd.DatetimeIndex(data.index).values.astype('datetime64[s]').astype(np.int64)
+        new_values = np.clip(np.round(new_values), 0, 255).astype(np.uint8)
+        if 'isPartial' in data.columns:
+            new_partial = data['isPartial'].astype(str).str.lower().eq('true').to_numpy()
+        else:
+            new_partial = np.zeros(len(data), dtype=bool)
+
+        key = self._key(keyword, geo)
+        entry = self._index['series'].get(key)
+        start = 0
+        if entry is None:
+            entry = {'id': f"s{self._index['next_id']:07d}", 'keyword': keyword, 'geo': geo, 'length': 0}
+            self._index['next_id'] += 1
+        elif entry['length']:
+            old_dates, old_values, old_partial = self._read_arrays(entry)
+            # Stored rows before the first new date are kept as they are on disk
+            start = int(np.searchsorted(old_dates, new_dates.min(), side='left'))
+            # New rows come last so they win when np.unique keeps the first of the reversed arrays
+            new_dates = np.concatenate([old_dates[start:], new_dates])
+            new_values = np.concatenate([old_values[start:], new_values])
+            new_partial = np.concatenate([old_partial[start:], new_partial])
+
+        dates, first = np.unique(new_dates[::-1], return_index=True)
+        values = new_values[::-1][first]
+        partial = new_partial[::-1][first]
+
+        if start == 0 or not self._write_tail(entry, start, dates, values, partial, old_partial):
+            if start:
+                dates = np.concatenate([old_dates[:start], dates])
+                values = np.concatenate([old_values[:start], values])
+                partial = np.concatenate([old_partial[:start], partial])
+            for file, array in zip(self._files(entry['id']), (dates, values, np.packbits(partial))):
+                tmp_file = f'{file}.tmp.npy'
+                np.save(tmp_file, array)
+                os.replace(tmp_file, file)
+            start = 0
+        entry.update(length=start + int(len(dates)), first=int(dates[0]) if start == 0 else entry['first'],
+                     last=int(dates[-1]))
+        self._index['series'][key] = entry
+        return key
+
+    def _write_tail(self, entry: Dict, start: int, dates: np.ndarray, values: np.ndarray, partial: np.ndarray,
+                    old_partial: np.ndarray) -> bool:
+        """Overwrite a series' arrays from row start on, growing the files in place. Returns False if they must be rewritten."""
+        # isPartial is packed eight rows to a byte, so the rewrite starts at the byte holding row start
+        byte = start // 8
+        packed = np.packbits(np.concatenate([old_partial[byte * 8:start], partial]))
+        for file, array, offset in zip(self._files(entry['id']), (dates, values, packed), (start, start, byte)):
+            if not self._write_npy_tail(file, array, offset):
+                return False
+        return True
+
+    @staticmethod
+    def _write_npy_tail(file: str, array: np.ndarray, offset: int) -> bool:
+        with open(file, 'r+b') as f:
+            version = np.lib.format.read_magic(f)
+            if version != (1, 0):
+                return False
+            _, _, dtype = np.lib.format.read_array_header_1_0(f)
+            data_start = f.tell()
+            header = io.BytesIO()
+            np.lib.format.write_array_header_1_0(header, {'descr': np.lib.format.dtype_to_descr(array.dtype),
+                                                          'fortran_order': False, 'shape': (offset + len(array),)})
+            # np.save leaves room in the header for the length to grow; without it the file is rewritten
+            if dtype != array.dtype or header.tell() != data_start:
+                return False
+            # Rows go first and the header last, so the file never claims rows it does not hold yet
+            f.seek(data_start + offset * array.dtype.itemsize)
+            f.write(array.tobytes())
+            f.seek(0)
+            f.write(header.getvalue())
+        return True
+
+    def read(self, keyword: str, geo: str, start: Optional[str] = None, end: Optional[str] = None) -> pd.DataFrame:
+        """
+        Read a series, optionally limited to a date range, in the same shape as interest_over_time.
+
+        Args:
+            keyword (str): Keyword of the series
+            geo (str): Geographic region of the series
+            start (str): First date to include (default: start of the series)
+            end (str): Last date to include (default: end of the series)
+        """
+        self._reload_index()
+        entry = self._index['series'].get(self._key(keyword, geo))
+        if entry is None or entry['length'] == 0:
+            return pd.DataFrame(columns=[keyword, 'isPartial'], index=pd.DatetimeIndex([], name='date'))
+
+        dates, values, partial = self._read_arrays(entry)
+        lo = 0 if start is None else int(np.searchsorted(dates, self._to_seconds(start), side='left'))
+        hi = len(dates) if end is None else int(np.searchsorted(dates, self._to_seconds(end), side='right'))
+        index = pd.DatetimeIndex(np.asarray(dates[lo:hi]).astype('datetime64[s]'), name='date')
+        return pd.DataFrame({keyword: np.asarray(values[lo:hi]).astype(np.int64), 'isPartial': partial[lo:hi]},
+                            index=index)
+
+    def read_matrix(self, keywords: Optional[List[str]] = None, geo: str = 'US',
+                    start: Optional[str] = None, end: Optional[str] = None) -> pd.DataFrame:
+        """Read several series of one geo into a wide frame with a column per keyword (default: every stored keyword)."""
+        if keywords is None:
+            keywords = [keyword for keyword, _ in self.series_keys(geo)]
+        columns = [self.read(keyword, geo, start, end)[keyword] for keyword in keywords if (keyword, geo) in self]
+        if not columns:
+            return pd.DataFrame(index=pd.DatetimeIndex([], name='date'))
+        return pd.concat(columns, axis=1).sort_index()
+
+    @staticmethod
+    def _to_seconds(date: str) -> int:
+        return int(pd.Timestamp(date).to_datetime64().astype('datetime64[s]').astype(np.int64))
+
+def add_store_arguments(parser: argparse.ArgumentParser):
+    """Add the time series store option to a command line parser."""
+    parser.add_argument('--store', nargs='?', const=DEFAULT_STORE_DIR,
+                      help=f'Time series store directory to use instead of CSV files (default when given without a path: {DEFAULT_STORE_DIR})')
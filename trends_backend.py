@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Trends Backend - A deterministic local stand-in for the Google Trends API.
+TrendsClient talks to any backend with the pytrends interface (build_payload / interest_over_time / related_queries);
+FakeTrendsBackend implements it offline with synthetic series, configurable latency, HTTP 429 throttling
+and failure injection, so pipelines can be tested and benchmarked without hitting the live service.
+"""
+
+import time
+import zlib
+import random
+import threading
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from pytrends.exceptions import ResponseError, TooManyRequestsError
+
+RELATED_VOCABULARY = ('price', 'review', 'near me', 'vs', 'best', 'cheap', 'deals', 'specs', 'release date', 'sale',
+                      'used', 'case', 'charger', 'repair', 'manual', 'alternatives', 'how to', 'app', 'login', 'size')
+
+class FakeResponse:
+    """Minimal stand-in for the requests.Response attached to pytrends exceptions."""
+
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+
+class FakeTrendsBackend:
+    def __init__(self, seed: int = 0, latency: float = 0.0, throttle_rate: float = 0.0, failure_rate: float = 0.0,
+                 rate_limit: Optional[int] = None, rate_window: float = 60.0, fail_keywords: Iterable[str] = (),
+                 today: str = '2025-06-01', sleep: Callable[[float], None] = time.sleep,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Initialize the fake backend.
+
+        Args:
+            seed (int): Seed for throttling and failure injection; series depend only on keyword and geo
+            latency (float): Seconds each request takes
+            throttle_rate (float): Probability that a request is answered with HTTP 429
+            failure_rate (float): Probability that a request fails with HTTP 500
+            rate_limit (int): Requests allowed per rate_window before every further request gets HTTP 429
+            rate_window (float): Length of the rate limit window in seconds
+            fail_keywords (iterable): Keywords that make every payload containing them fail with HTTP 400
+            today (str): Date that relative timeframes such as 'today 12-m' end on
+        """
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.failure_rate = failure_rate
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.fail_keywords = set(fail_keywords)
+        self.today = pd.Timestamp(today)
+        self._random = random.Random(seed)
+        self._sleep = sleep
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._recent = deque()
+        self._local = threading.local()
+        self.requests = 0
+        self.throttled = 0
+        self.failed = 0
+        self.latency_total = 0.0
+
+    def build_payload(self, kw_list: List[str], cat: int = 0, timeframe: str = 'today 5-y', geo: str = '', gprop: str = ''):
+        """Remember the payload for the next request, like TrendReq.build_payload."""
+        if len(kw_list) > 5:
+            raise ValueError('Keyword list exceeds the maximum of 5 keywords')
+        self._local.payload = (list(kw_list), timeframe, geo)
+
+    def interest_over_time(self) -> pd.DataFrame:
+        """Return a synthetic interest over time frame for the current payload, like TrendReq.interest_over_time."""
+        keywords, timeframe, geo = self._local.payload
+        self._request(keywords)
+        dates = self._dates(timeframe)
+        if dates.empty:
+            return pd.DataFrame()
+
+        series = {keyword: self._series(keyword, geo, dates) for keyword in keywords}
+        peak = max(values.max() for values in series.values())
+        data = pd.DataFrame({keyword: np.round(values / peak * 100).astype(np.int64) if peak > 0 else values.astype(np.int64)
+                             for keyword, values in series.items()}, index=dates)
+        # Like Google, only the last point is partial, and only if its period has not ended yet
+        data['isPartial'] = False
+        if dates[-1] + dates.freq > self.today:
+            data.iloc[-1, data.columns.get_loc('isPartial')] = True
+        return data
+
+    def related_queries(self) -> Dict[str, Dict[str, Optional[pd.DataFrame]]]:
+        """Return synthetic top and rising related queries for every keyword of the current payload, like TrendReq.related_queries."""
+        keywords, _, geo = self._local.payload
+        self._request(keywords)
+        return {keyword: self._related(keyword, geo) for keyword in keywords}
+
+    @staticmethod
+    def _related(keyword: str, geo: str) -> Dict[str, Optional[pd.DataFrame]]:
+        """Generate deterministic related queries; they share a small vocabulary so that expansions overlap."""
+        seed = zlib.crc32(f'{geo}\t{keyword}'.encode('utf-8'))
+        rng = np.random.default_rng(seed)
+        head = keyword.split()[0] if keyword.split() else keyword
+        words = rng.choice(RELATED_VOCABULARY, size=8, replace=False)
+        # Like Google, the keyword itself usually leads its top queries
+        top = [keyword] + [f'{head} {word}' for word in words[:5]]
+        top_values = np.concatenate([[100], np.sort(rng.integers(5, 100, 5))[::-1]])
+        if seed % 7 == 0:
+            # Some keywords have too little search volume for rising queries
+            return {'top': pd.DataFrame({'query': top, 'value': top_values}), 'rising': None}
+        rising = [f'{keyword} {word}' for word in words[5:]]
+        return {'top': pd.DataFrame({'query': top, 'value': top_values}),
+                'rising': pd.DataFrame({'query': rising, 'value': np.sort(rng.integers(50, 5000, len(rising)))[::-1]})}
+
+    def _request(self, keywords: List[str]):
+        """Simulate the network round trip: latency, rate limiting and injected failures."""
+        with self._lock:
+            self.requests += 1
+            now = self._clock()
+            while self._recent and self._recent[0] <= now - self.rate_window:
+                self._recent.popleft()
+            over_limit = self.rate_limit is not None and len(self._recent) >= self.rate_limit
+            self._recent.append(now)
+            throttled = over_limit or self._random.random() < self.throttle_rate
+            failed = not throttled and self._random.random() < self.failure_rate
+
+        if self.latency > 0:
+            self._sleep(self.latency)
+            with self._lock:
+                self.latency_total += self.latency
+        if throttled:
+            with self._lock:
+                self.throttled += 1
+            raise TooManyRequestsError('The request failed: Google returned a response with code 429', FakeResponse(429))
+        if failed or self.fail_keywords.intersection(keywords):
+            with self._lock:
+                self.failed += 1
+            code = 500 if failed else 400
+            raise ResponseError(f'The request failed: Google returned a response with code {code}', FakeResponse(code))
+
+    def _dates(self, timeframe: str) -> pd.DatetimeIndex:
+        """Build the date index Google would return for a timeframe, including its granularity."""
+        start, end = self._timeframe_bounds(timeframe)
+        span = end - start
+        if span <= pd.Timedelta(days=7):
+            freq = 'h'
+        elif span <= pd.Timedelta(days=269):
+            freq = 'D'
+        elif span <= pd.Timedelta(days=5 * 365 + 2):
+            freq = 'W-SUN'
+        else:
+            freq = 'MS'
+        dates = pd.date_range(start, end, freq=freq)
+        dates.name = 'date'
+        return dates
+
+    def _timeframe_bounds(self, timeframe: str) -> Tuple[pd.Timestamp, pd.Timestamp]:
+        parts = timeframe.split()
+        if parts[0] in ('today', 'now'):
+            amount, unit = int(parts[1][:-2]), parts[1][-1]
+            end = self.today if parts[0] == 'today' else self.today + pd.Timedelta(hours=23)
+            offsets = {'y': pd.DateOffset(years=amount), 'm': pd.DateOffset(months=amount),
+                       'd': pd.Timedelta(days=amount), 'H': pd.Timedelta(hours=amount)}
+            return end - offsets[unit], end
+        start, end = (pd.Timestamp(part.replace('T', ' ') + (':00' if 'T' in part else '')) for part in parts)
+        return start, end
+
+    @staticmethod
+    def _series(keyword: str, geo: str, dates: pd.DatetimeIndex) -> np.ndarray:
+        """Generate a deterministic, realistic-looking popularity curve for a keyword and geo."""
+        seed = zlib.crc32(f'{geo}\t{keyword}'.encode('utf-8'))
+        rng = np.random.default_rng(seed)
+        level = 5 + seed % 95
+        days = (dates - pd.Timestamp('2020-01-01')).total_seconds().to_numpy() / 86400
+        trend = 1 + rng.uniform(-0.3, 0.3) * days / 1000
+        seasonality = 1 + rng.uniform(0, 0.4) * np.sin(2 * np.pi * days / 365.25 + rng.uniform(0, 2 * np.pi))
+        # Noise is keyed on the date so that overlapping windows see the same underlying values
+        noise = 1 + 0.1 * np.sin(seed % 1000 + np.floor(days) * 12.9898)
+        return np.clip(level * trend * seasonality * noise, 0, None)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Trends Cache - A persistent on-disk cache for Google Trends responses.
+Entries are keyed on (keywords, timeframe, geo, hl, tz) and expire after a TTL;
+the least recently used entries are evicted once the cache grows past its size limit.
+"""
+
+import os
+import time
+import glob
+import pickle
+import hashlib
+import argparse
+import threading
+from typing import Any, Optional, Sequence, Tuple
+
+DEFAULT_CACHE_DIR = '.trends_cache'
+DEFAULT_TTL_HOURS = 24.0
+DEFAULT_MAX_MB = 512.0
+EVICT_TO = 0.9
+
+class TrendsCache:
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, ttl_hours: float = DEFAULT_TTL_HOURS,
+                 max_mb: float = DEFAULT_MAX_MB, max_entries: Optional[int] = None):
+        """Initialize the cache directory, expiry time and size limits."""
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_hours * 3600 if ttl_hours and ttl_hours > 0 else None
+        self.max_bytes = int(max_mb * 1024 * 1024) if max_mb and max_mb > 0 else None
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # Running totals of the cache directory, so a put only scans it once they exceed a limit
+        self._total_bytes = None
+        self._total_entries = None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(kind: str, keywords: Sequence[str], timeframe: str, geo: str, hl: str, tz: int) -> Tuple:
+        """Build the cache key for a request. Keyword order is kept because it fixes the column order of the frame."""
+        return (kind, tuple(keywords), timeframe, geo, hl, int(tz))
+
+    def _path(self, key: Tuple) -> str:
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f'{digest}.pkl')
+
+    def get(self, key: Tuple) -> Optional[Any]:
+        """Return the cached value for a key, or None if it is missing or expired."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Discarding unreadable cache entry {path}: {str(e)}")
+            self._remove(path)
+            return None
+
+        if entry.get('key') != key:
+            return None
+        if self.ttl_seconds is not None and time.time() - entry['created'] > self.ttl_seconds:
+            self._remove(path)
+            return None
+
+        self._touch(path)
+        return entry['data']
+
+    def contains(self, key: Tuple) -> bool:
+        """Check whether a fresh entry exists for a key without loading its data."""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return False
+        return self.get(key) is not None
+
+    def put(self, key: Tuple, data: Any):
+        """Store a value under a key and evict old entries if the cache is over its limits."""
+        path = self._path(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'key': key, 'created': time.time(), 'data': data}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        size = os.path.getsize(tmp_path)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = None
+        os.replace(tmp_path, path)
+        self._touch(path)
+
+        with self._lock:
+            if self._total_bytes is None:
+                over_limits = True
+            else:
+                self._total_bytes += size - (replaced or 0)
+                self._total_entries += replaced is None
+                over_limits = self._over_limits(self._total_bytes, self._total_entries)
+        if over_limits:
+            self.evict()
+
+    def _over_limits(self, total_bytes: int, total_entries: int) -> bool:
+        return ((self.max_bytes is not None and total_bytes > self.max_bytes) or
+                (self.max_entries is not None and total_entries > self.max_entries))
+
+    def evict(self):
+        """
+        Drop expired entries, then the least recently used ones until the size limits are met.
+
+        put only calls this on its first write and whenever the running totals exceed a limit; until then
+        expired entries are left on disk and discarded when they are read.
+        """
+        with self._lock:
+            entries = []
+            for path in glob.glob(os.path.join(self.cache_dir, '*.pkl')):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, path))
+
+            # Entries not used within the TTL are certainly expired
+            if self.ttl_seconds is not None:
+                cutoff = time.time_ns() - int(self.ttl_seconds * 1e9)
+                for entry in [e for e in entries if e[0] < cutoff]:
+                    self._remove(entry[2])
+                    entries.remove(entry)
+
+            entries.sort()
+            total_bytes = sum(size for _, size, _ in entries)
+            # Evicting down to a low-water mark leaves headroom, so the next scan is many puts away
+            max_bytes = self.max_bytes * EVICT_TO if self.max_bytes is not None else None
+            max_entries = int(self.max_entries * EVICT_TO) if self.max_entries is not None else None
+            if not self._over_limits(total_bytes, len(entries)):
+                max_bytes, max_entries = self.max_bytes, self.max_entries
+            while entries and ((max_bytes is not None and total_bytes > max_bytes) or
+                               (max_entries is not None and len(entries) > max_entries)):
+                _, size, path = entries.pop(0)
+                self._remove(path)
+                total_bytes -= size
+            self._total_bytes = total_bytes
+            self._total_entries = len(entries)
+
+    def clear(self):
+        """Remove every entry from the cache."""
+        with self._lock:
+            for path in glob.glob(os.path.join(self.cache_dir, '*.pkl')):
+                self._remove(path)
+            self._total_bytes = 0
+            self._total_entries = 0
+
+    @staticmethod
+    def _touch(path: str):
+        # Set the modification time explicitly so eviction sees the entry as most recently used;
+        # the filesystem's own timestamps are too coarse to order back-to-back requests
+        now = time.time_ns()
+        try:
+            os.utime(path, ns=(now, now))
+        except OSError:
+            pass
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def add_cache_arguments(parser: argparse.ArgumentParser):
+    """Add the response cache options to a command line parser."""
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                      help=f'Directory for cached Google Trends responses (default: {DEFAULT_CACHE_DIR})')
+    parser.add_argument('--cache-ttl', type=float, default=DEFAULT_TTL_HOURS,
+                      help=f'Hours before a cached response expires, 0 to never expire (default: {DEFAULT_TTL_HOURS:g})')
+    parser.add_argument('--cache-max-mb', type=float, default=DEFAULT_MAX_MB,
+                      help=f'Maximum cache size in MB before least recently used entries are evicted (default: {DEFAULT_MAX_MB:g})')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write the response cache')
+    parser.add_argument('--refresh', action='store_true', help='Ignore cached responses but store the fresh ones')
+
+def cache_from_args(args: argparse.Namespace) -> Optional[TrendsCache]:
+    """Create the cache described by the command line options, or None if caching is disabled."""
+    if args.no_cache:
+        return None
+    return TrendsCache(args.cache_dir, ttl_hours=args.cache_ttl, max_mb=args.cache_max_mb)
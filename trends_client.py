@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Trends Client - A shared wrapper around the pytrends session used by every fetch path.
+Requests are served from the on-disk response cache when possible and paced by an adaptive rate limiter.
+"""
+
+import time
+from typing import Any, Callable, Dict, List, Optional
+import pandas as pd
+from pytrends.request import TrendReq
+
+from trends_cache import TrendsCache
+from rate_limiter import AdaptiveRateLimiter, ThrottledError, is_throttle_error
+from metrics import REGISTRY
+
+class TrendsClient:
+    def __init__(self, hl: str = 'en-US', tz: int = 360, cache: Optional[TrendsCache] = None, refresh: bool = False,
+                 limiter: Optional[AdaptiveRateLimiter] = None, max_retries: int = 4, proxies: Optional[List[str]] = None,
+                 backend: Optional[Any] = None):
+        """
+        Initialize the pytrends session, the optional response cache and the rate limiter.
+
+        A backend with the pytrends interface (build_payload / interest_over_time / related_queries), such as
+        trends_backend.FakeTrendsBackend, can be passed to use it instead of a live TrendReq session.
+        """
+        if backend is None:
+            backend = TrendReq(hl=hl, tz=tz, timeout=(10,25), retries=2, backoff_factor=0.1, proxies=list(proxies or []))
+        self.pytrends = backend
+        self.hl = hl
+        self.tz = tz
+        self.cache = cache
+        self.refresh = refresh
+        self.limiter = limiter if limiter is not None else AdaptiveRateLimiter()
+        self.max_retries = max_retries
+        self.network_requests = 0
+        self.cache_hits = 0
+
+    def interest_over_time(self, keywords: List[str], timeframe: str, geo: str) -> pd.DataFrame:
+        """Return interest over time for up to 5 keywords, using the cache when a fresh entry exists."""
+        key = TrendsCache.make_key('interest_over_time', keywords, timeframe, geo, self.hl, self.tz)
+        if self.cache is not None and not self.refresh:
+            data = self.cache.get(key)
+            if data is not None:
+                self.cache_hits += 1
+                REGISTRY.inc('trends_cache_hits_total')
+                return data.copy()
+            REGISTRY.inc('trends_cache_misses_total')
+
+        data = self._request(lambda: self._fetch_interest_over_time(keywords, timeframe, geo))
+        if self.cache is not None:
+            self.cache.put(key, data)
+        return data.copy()
+
+    def related_queries(self, keywords: List[str], timeframe: str, geo: str) -> Dict[str, Dict[str, Optional[pd.DataFrame]]]:
+        """
+        Return the top and rising related queries of keywords, using the cache when a fresh entry exists.
+
+        pytrends sends one request per keyword of a payload, so every keyword is requested and cached on its own
+        and takes its own rate limiter slot.
+        """
+        related = {}
+        for keyword in keywords:
+            related.update(self._keyword_related_queries(keyword, timeframe, geo))
+        return related
+
+    def _keyword_related_queries(self, keyword: str, timeframe: str, geo: str) -> Dict[str, Dict[str, Optional[pd.DataFrame]]]:
+        keywords = [keyword]
+        key = TrendsCache.make_key('related_queries', keywords, timeframe, geo, self.hl, self.tz)
+        data = None
+        if self.cache is not None and not self.refresh:
+            data = self.cache.get(key)
+            REGISTRY.inc('trends_cache_hits_total' if data is not None else 'trends_cache_misses_total')
+            if data is not None:
+                self.cache_hits += 1
+        if data is None:
+            data = self._request(lambda: self._fetch_related_queries(keywords, timeframe, geo))
+            if self.cache is not None:
+                self.cache.put(key, data)
+        return {sent: {kind: frame.copy() if frame is not None else None for kind, frame in queries.items()}
+                for sent, queries in data.items()}
+
+    def _fetch_related_queries(self, keywords: List[str], timeframe: str, geo: str) -> Dict[str, Dict[str, Optional[pd.DataFrame]]]:
+        with REGISTRY.timer('trends_call_seconds', call='build_payload'):
+            self.pytrends.build_payload(list(keywords), timeframe=timeframe, geo=geo)
+        with REGISTRY.timer('trends_call_seconds', call='related_queries'):
+            return self.pytrends.related_queries()
+
+    def _fetch_interest_over_time(self, keywords: List[str], timeframe: str, geo: str) -> pd.DataFrame:
+        with REGISTRY.timer('trends_call_seconds', call='build_payload'):
+            self.pytrends.build_payload(list(keywords), timeframe=timeframe, geo=geo)
+        with REGISTRY.timer('trends_call_seconds', call='interest_over_time'):
+            data = self.pytrends.interest_over_time()
+        # pytrends does not expose the raw response, so the decoded frame's size stands in for bytes received
+        REGISTRY.inc('trends_response_bytes_total', int(data.memory_usage(deep=True).sum()))
+        return data
+
+    def _request(self, fetch: Callable[[], Any]) -> Any:
+        """Run a network request under the rate limiter, retrying while Google throttles us."""
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            self.network_requests += 1
+            REGISTRY.inc('trends_requests_total')
+            if attempt > 0:
+                REGISTRY.inc('trends_retries_total')
+            start = time.perf_counter()
+            try:
+                result = fetch()
+            except Exception as e:
+                if not is_throttle_error(e):
+                    REGISTRY.observe('trends_request_seconds', time.perf_counter() - start, outcome='error')
+                    REGISTRY.inc('trends_errors_total')
+                    self.limiter.on_error()
+                    raise
+                REGISTRY.observe('trends_request_seconds', time.perf_counter() - start, outcome='throttled')
+                REGISTRY.inc('trends_throttles_total')
+                self.limiter.on_throttle()
+                print(f"Request throttled (attempt {attempt + 1}/{self.max_retries + 1}): {str(e)}")
+                last_error = e
+                continue
+            REGISTRY.observe('trends_request_seconds', time.perf_counter() - start, outcome='ok')
+            self.limiter.on_success()
+            return result
+        raise ThrottledError(f"Still throttled after {self.max_retries + 1} attempts") from last_error
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Trends Server - A local daemon that runs keyword jobs for many users behind one Google Trends session.
+Jobs are submitted over HTTP (TCP or a Unix socket), split into requests and worked off a single priority
+queue under one shared rate limiter, response cache and warm pytrends session, so concurrent users stop
+throttling each other. Job status and results are polled over the same API.
+
+API:
+    POST /jobs          {"kind": "yearly_median" | "averages" | "timeseries", "keywords": [...],
+                         "timeframe": "...", "geo": "US", "since": "2022-01-01", "priority": 10}
+    GET  /jobs          Summary of every job
+    GET  /jobs/<id>     Status, progress and, once finished, the result rows of a job
+    GET  /metrics       Request and aggregation metrics in the Prometheus text format
+"""
+
+import os
+import json
+import queue
+import socket
+import argparse
+import itertools
+import threading
+import socketserver
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import pandas as pd
+
+from trends_cache import TrendsCache, add_cache_arguments, cache_from_args
+from trends_client import TrendsClient
+from rate_limiter import AdaptiveRateLimiter, add_rate_limit_arguments, rate_limiter_from_args
+from keyword_analyzer import KeywordTrendAnalyzer
+from keyword_analyzer2 import MAX_REQUEUES, KeywordTrendAnalyzer2, pivot_yearly_results
+from request_planner import dedupe_keywords, plan_requests
+from metrics import REGISTRY
+
+JOB_KINDS = ('yearly_median', 'averages', 'timeseries')
+DEFAULT_PRIORITY = 10
+DEFAULT_TIMEFRAME = '2022-01-01 2025-06-01'
+MAX_FINISHED_JOBS = 1000
+
+class Job:
+    def __init__(self, job_id: str, kind: str, keywords: List[str], geo: str, timeframe: str, since: str, priority: int):
+        """Initialize a queued job."""
+        self.id = job_id
+        self.kind = kind
+        self.keywords = keywords
+        self.geo = geo
+        self.timeframe = timeframe
+        self.since = since
+        self.priority = priority
+        self.status = 'queued'
+        self.tasks: List[List[str]] = []
+        self.requeues: Dict[int, int] = {}
+        self.done_tasks = 0
+        self.rows: List[Dict] = []
+        self.dead_letters: List[Tuple[str, str]] = []
+        self.error: Optional[str] = None
+        self.created = datetime.now().isoformat(timespec='seconds')
+        self.finished: Optional[str] = None
+
+    def to_dict(self, include_result: bool = True) -> Dict:
+        """Describe the job for the API; results are only included once the job has finished."""
+        data = {'id': self.id, 'kind': self.kind, 'status': self.status, 'priority': self.priority,
+                'geo': self.geo, 'keywords': len(self.keywords),
+                'progress': {'done': self.done_tasks, 'total': len(self.tasks)},
+                'created': self.created, 'finished': self.finished}
+        if self.error:
+            data['error'] = self.error
+        if include_result and self.status == 'done':
+            data['result'] = self.rows
+            data['failed'] = [{'Keyword': keyword, 'Error': error} for keyword, error in self.dead_letters]
+        return data
+
+class JobServer:
+    def __init__(self, hl: str = 'en-US', tz: int = 360, cache: Optional[TrendsCache] = None,
+                 limiter: Optional[AdaptiveRateLimiter] = None, backend: Optional[Any] = None):
+        """
+        Initialize the shared session, cache and rate limiter that every job runs through.
+
+        Args:
+            hl (str): Language of the requests
+            tz (int): Timezone offset of the requests
+            cache (TrendsCache): Response cache shared by all jobs
+            limiter (AdaptiveRateLimiter): The single rate budget of the server
+            backend: Fetch backend with the pytrends interface (default: a live TrendReq session)
+        """
+        self.hl = hl
+        self.tz = tz
+        self.cache = cache
+        self.limiter = limiter if limiter is not None else AdaptiveRateLimiter()
+        # Build the session once; every client and analyzer below reuses its cookies and connections
+        self.client = TrendsClient(hl=hl, tz=tz, cache=cache, limiter=self.limiter, backend=backend)
+        self.backend = self.client.pytrends
+        self.jobs: Dict[str, Job] = {}
+        self._analyzers: Dict[Tuple[str, str], Any] = {}
+        self._tasks = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._job_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._work, name='trends-worker', daemon=True)
+
+    def start(self):
+        """Start working off the queue."""
+        self._worker.start()
+
+    def submit(self, spec: Dict) -> Job:
+        """Validate a job specification, split it into requests and queue them. Raises ValueError on bad input."""
+        kind = spec.get('kind', 'yearly_median')
+        if kind not in JOB_KINDS:
+            raise ValueError(f"kind must be one of {', '.join(JOB_KINDS)}")
+        keywords = spec.get('keywords')
+        if not isinstance(keywords, list) or not keywords:
+            raise ValueError("keywords must be a non-empty list")
+        priority = int(spec.get('priority', DEFAULT_PRIORITY))
+        geo = str(spec.get('geo', 'US'))
+        timeframe = str(spec.get('timeframe', DEFAULT_TIMEFRAME))
+        since = str(spec.get('since', '2022-01-01'))
+
+        with self._lock:
+            job_id = f'{next(self._job_ids):06d}'
+            job = Job(job_id, kind, dedupe_keywords(keywords), geo, timeframe, since, priority)
+            if kind == 'yearly_median':
+                job.tasks = plan_requests(job.keywords, timeframe, geo, cache=self.cache, hl=self.hl, tz=self.tz).payloads
+            else:
+                job.tasks = [[keyword] for keyword in job.keywords]
+            self.jobs[job_id] = job
+            self._prune()
+            # Lower priorities run first; within a priority, requests run in submission order
+            for index in range(len(job.tasks)):
+                self._tasks.put((priority, next(self._sequence), job_id, index))
+        print(f"Queued job {job_id}: {kind} for {len(job.keywords)} keywords ({len(job.tasks)} requests, priority {priority})")
+        return job
+
+    def job_list(self) -> List[Job]:
+        """Return every job still kept, oldest first."""
+        with self._lock:
+            return list(self.jobs.values())
+
+    def _prune(self):
+        """Forget the oldest finished jobs once too many are kept."""
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in ('done', 'failed')]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    def _work(self):
+        while True:
+            _, _, job_id, index = self._tasks.get()
+            with self._lock:
+                job = self.jobs.get(job_id)
+                if job is None or job.status == 'failed':
+                    continue
+                job.status = 'running'
+            try:
+                rows, dead_letters, retry_batches = self._run_task(job, job.tasks[index])
+            except Exception as e:
+                print(f"Error running job {job_id}: {str(e)}")
+                with self._lock:
+                    job.status = 'failed'
+                    job.error = str(e)
+                    job.finished = datetime.now().isoformat(timespec='seconds')
+                continue
+            with self._lock:
+                job.rows.extend(rows)
+                job.dead_letters.extend(dead_letters)
+                requeues = job.requeues.get(index, 0)
+                for batch in retry_batches:
+                    if requeues < MAX_REQUEUES:
+                        # Throttled or failed batches go to the back of their priority, like in orchestrator.py
+                        print(f"Requeueing batch of job {job_id}: {batch}")
+                        job.tasks.append(batch)
+                        job.requeues[len(job.tasks) - 1] = requeues + 1
+                        self._tasks.put((job.priority, next(self._sequence), job_id, len(job.tasks) - 1))
+                    else:
+                        job.dead_letters.extend((keyword, f"still throttled or failing after {MAX_REQUEUES} requeues")
+                                                for keyword in batch)
+                job.done_tasks += 1
+                if job.done_tasks == len(job.tasks):
+                    job.status = 'done'
+                    job.finished = datetime.now().isoformat(timespec='seconds')
+                    print(f"Finished job {job_id}")
+
+    def _analyzer(self, cls: Callable, geo: str) -> Any:
+        """Return the analyzer of a class for a geo, sharing the server's session, cache and limiter."""
+        key = (cls.__name__, geo)
+        if key not in self._analyzers:
+            self._analyzers[key] = cls(hl=self.hl, tz=self.tz, geo=geo, cache=self.cache, limiter=self.limiter,
+                                       backend=self.backend)
+        return self._analyzers[key]
+
+    def _run_task(self, job: Job, keywords: List[str]) -> Tuple[List[Dict], List[Tuple[str, str]], List[List[str]]]:
+        """Run one request of a job and return its result rows, the keywords that failed and the batches to retry."""
+        if job.kind == 'yearly_median':
+            analyzer = self._analyzer(KeywordTrendAnalyzer2, job.geo)
+            results = analyzer.analyze_keyword_batch(keywords, job.timeframe)
+            # The analyzers outlive their jobs, so their failures are taken over and cleared
+            dead_letters, analyzer.dead_letters = analyzer.dead_letters, []
+            retry_batches, analyzer.retry_batches = analyzer.retry_batches, []
+            rows = _records(pivot_yearly_results(results)) if results else []
+            # JSON object keys must be strings
+            return [{str(column): value for column, value in row.items()} for row in rows], dead_letters, retry_batches
+
+        if job.kind == 'averages':
+            analyzer = self._analyzer(KeywordTrendAnalyzer, job.geo)
+            return _records(analyzer.analyze_keywords(pd.DataFrame({'Keyword': keywords}))), [], []
+
+        keyword = keywords[0]
+        timeframe = f"{job.since} {datetime.today().strftime('%Y-%m-%d')}"
+        try:
+            data = self.client.interest_over_time([keyword], timeframe, job.geo)
+        except Exception as e:
+            return [], [(keyword, str(e))], []
+        if keyword not in data.columns:
+            return [], [(keyword, 'no data returned')], []
+        return [{'Keyword': keyword, 'date': date.isoformat(), 'value': int(value), 'isPartial': bool(partial)}
+                for date, value, partial in zip(data.index, data[keyword], data['isPartial'])], [], []
+
+def make_handler(server: JobServer) -> type:
+    """Build the request handler class bound to a job server."""
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status: int, body: Any, content_type: str = 'application/json'):
+            payload = body if isinstance(body, str) else json.dumps(body, default=_json_default, allow_nan=False)
+            data = payload.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            parts = self.path.strip('/').split('/')
+            if parts == ['jobs']:
+                self._send(200, [job.to_dict(include_result=False) for job in server.job_list()])
+            elif len(parts) == 2 and parts[0] == 'jobs':
+                job = server.jobs.get(parts[1])
+                if job is None:
+                    self._send(404, {'error': f'no job {parts[1]}'})
+                else:
+                    self._send(200, job.to_dict())
+            elif parts == ['metrics']:
+                self._send(200, REGISTRY.prometheus_text(), 'text/plain; version=0.0.4')
+            else:
+                self._send(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path.strip('/') != 'jobs':
+                self._send(404, {'error': 'not found'})
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                spec = json.loads(self.rfile.read(length) or b'{}')
+                job = server.submit(spec)
+            except (ValueError, TypeError) as e:
+                self._send(400, {'error': str(e)})
+                return
+            self._send(202, job.to_dict(include_result=False))
+
+        def address_string(self) -> str:
+            # Unix socket peers have no address
+            return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    return Handler
+
+def _records(data: pd.DataFrame) -> List[Dict]:
+    """Convert a result frame to rows with None for missing values, since JSON has no NaN."""
+    return data.astype(object).where(data.notna(), None).to_dict('records')
+
+def _json_default(value: Any) -> Any:
+    """Convert NumPy and pandas scalars in result rows to JSON types."""
+    if pd.isna(value):
+        return None
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+class UnixHTTPServer(ThreadingHTTPServer):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        socketserver.TCPServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+def serve(job_server: JobServer, host: str = '127.0.0.1', port: int = 8765, socket_path: Optional[str] = None):
+    """Serve the API on a TCP port, or on a Unix socket if a path is given, until interrupted."""
+    handler = make_handler(job_server)
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        httpd = UnixHTTPServer(socket_path, handler)
+        where = f'unix socket {socket_path}'
+    else:
+        httpd = ThreadingHTTPServer((host, port), handler)
+        where = f'http://{host}:{port}'
+    job_server.start()
+    print(f"Serving Google Trends jobs on {where}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down.")
+    finally:
+        httpd.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local job server that shares one Google Trends session and rate limit')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', '-p', type=int, default=8765, help='Port to listen on (default: 8765)')
+    parser.add_argument('--socket', help='Listen on this Unix socket path instead of a TCP port')
+    add_cache_arguments(parser)
+    add_rate_limit_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        job_server = JobServer(cache=cache_from_args(args), limiter=rate_limiter_from_args(args))
+    except Exception as e:
+        print(f"Error starting Google Trends session: {str(e)}")
+        return
+    serve(job_server, args.host, args.port, args.socket)
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,149 @@
 #!/usr/bin/env python3
 """
 Verify Calculations - Compare raw time series data with aggregated results
+Checks one keyword, or with --all every keyword of the combined results in one vectorized join.
 """
 
-import pandas as pd
+import sys
+import json
 import argparse
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+from timeseries_store import TimeseriesStore, add_store_arguments
+from aggregation import to_long, yearly_median
+
+STATUSES = ('ok', 'mismatch', 'missing_in_combined', 'missing_in_raw', 'no_raw_series')
+FAILING_STATUSES = ('mismatch', 'missing_in_combined', 'missing_in_raw')
+
+def load_raw(raw_file: str, store: Optional[TimeseriesStore] = None, geo: str = 'US',
+             keywords: Optional[List[str]] = None, start: Optional[str] = None, end: Optional[str] = None) -> pd.DataFrame:
+    """Read raw series as a wide frame indexed by date, from the store or a raw time series CSV, optionally limited to a date range."""
+    if store is not None:
+        return store.read_matrix(keywords, geo, start, end)
+    raw_data = pd.read_csv(raw_file, parse_dates=['date'], index_col='date').sort_index()
+    return raw_data.loc[start:end]
+
+def select_geo(combined_data: pd.DataFrame, geo: str) -> pd.DataFrame:
+    """Keep the rows of a geo if the combined results have a Geo column (worldwide rows have an empty Geo)."""
+    if 'Geo' not in combined_data.columns:
+        return combined_data
+    return combined_data[combined_data['Geo'].fillna('').astype(str) == geo]
+
+def compare_yearly(raw_data: pd.DataFrame, combined_data: pd.DataFrame,
+                   atol: float = 0.0, rtol: float = 0.0, geo: str = 'US') -> pd.DataFrame:
+    """
+    Join the yearly medians of raw series with combined results and classify every (keyword, year).
+
+    Statuses: 'ok', 'mismatch' (outside tolerance), 'missing_in_combined', 'missing_in_raw' and
+    'no_raw_series' (the keyword has no raw series at all). Only the years that are columns of the combined
+    results are compared, since raw series usually extend beyond the analyzed timeframe. Combined results of
+    several geos (with a 'Geo' column) are limited to the geo of the raw series and joined on it as well.
+
+    Args:
+        raw_data (pd.DataFrame): Raw series of one geo indexed by date with a column per keyword
+        combined_data (pd.DataFrame): Combined results with a 'Keyword' column, a column per year and optionally 'Geo'
+        atol (float): Absolute tolerance
+        rtol (float): Relative tolerance, as a fraction of the combined value
+        geo (str): Geographic region of the raw series
+    """
+    raw = to_long(yearly_median(raw_data)).rename(columns={'value': 'raw'})
+    keys = ['Keyword']
+    if 'Geo' in combined_data.columns:
+        combined_data = select_geo(combined_data, geo).assign(Geo=geo)
+        raw['Geo'] = geo
+        keys = ['Geo', 'Keyword']
+    year_columns = [column for column in combined_data.columns if str(column).isdigit()]
+    combined = combined_data.melt(id_vars=keys, value_vars=year_columns, var_name='year', value_name='combined')
+    combined['year'] = combined['year'].astype(int)
+    combined = combined.dropna(subset=['combined'])
+    raw['year'] = raw['year'].astype(int)
+    raw = raw[raw['year'].isin([int(year) for year in year_columns])]
+
+    joined = combined.merge(raw, on=keys + ['year'], how='outer', sort=True)
+    joined['diff'] = joined['combined'] - joined['raw']
+    within = np.isclose(joined['raw'], joined['combined'], atol=atol, rtol=rtol)
+    has_raw_series = joined['Keyword'].isin(raw_data.columns)
+    joined['status'] = np.select(
+        [joined['raw'].notna() & joined['combined'].notna() & within,
+         joined['raw'].notna() & joined['combined'].notna(),
+         joined['combined'].isna(),
+         ~has_raw_series],
+        ['ok', 'mismatch', 'missing_in_combined', 'no_raw_series'],
+        default='missing_in_raw')
+    return joined[keys + ['year', 'raw', 'combined', 'diff', 'status']]
 
-def verify_calculations(raw_file: str, combined_file: str, keyword: str):
-    """Verify calculations by comparing raw data with aggregated results."""
+def summarize(comparison: pd.DataFrame, require_all: bool = False) -> Dict:
+    """Summarize a comparison; it passes when every keyword-year is ok (or only lacks a raw series, unless required)."""
+    counts = comparison['status'].value_counts()
+    failing = comparison['status'].isin(FAILING_STATUSES + (('no_raw_series',) if require_all else ()))
+    compared = comparison['diff'].dropna().abs()
+    return {
+        'keywords': int(comparison['Keyword'].nunique()),
+        'keywords_verified': int(comparison.loc[comparison['status'] != 'no_raw_series', 'Keyword'].nunique()),
+        'values': int(len(comparison)),
+        **{status: int(counts.get(status, 0)) for status in STATUSES},
+        'failing_keywords': int(comparison.loc[failing, 'Keyword'].nunique()),
+        'max_abs_diff': float(compared.max()) if not compared.empty else 0.0,
+        'mean_abs_diff': float(compared.mean()) if not compared.empty else 0.0,
+        'passed': bool(not failing.any()),
+    }
+
+def verify_all(raw_file: str, combined_file: str, store: Optional[TimeseriesStore] = None, geo: str = 'US',
+               atol: float = 0.0, rtol: float = 0.0, require_all: bool = False,
+               start: Optional[str] = None, end: Optional[str] = None) -> Tuple[pd.DataFrame, Dict]:
+    """
+    Verify every keyword in the combined results at once. Returns the per keyword-year comparison and its summary.
+
+    Raw series are limited to the start and end dates of the analyzed timeframe, if given, so edge years are
+    aggregated over the same months as the combined results.
+    """
+    combined_data = pd.read_csv(combined_file)
+    keywords = select_geo(combined_data, geo)['Keyword'].dropna().unique().tolist()
+    raw_data = load_raw(raw_file, store, geo, keywords, start, end)
+    comparison = compare_yearly(raw_data, combined_data, atol, rtol, geo)
+    return comparison, summarize(comparison, require_all)
+
+def save_report(report: pd.DataFrame, output_file: str):
+    """Save a report as JSON records if the file name ends in .json, otherwise as CSV."""
+    if output_file.endswith('.json'):
+        report.to_json(output_file, orient='records', indent=2)
+    else:
+        report.to_csv(output_file, index=False)
+
+def verify_calculations(raw_file: str, combined_file: str, keyword: str,
+                        store: Optional[TimeseriesStore] = None, geo: str = 'US',
+                        start: Optional[str] = None, end: Optional[str] = None):
+    """Verify calculations by comparing raw data from a CSV file or the store with aggregated results."""
     # Read the files
-    raw_data = pd.read_csv(raw_file)
+    raw_data = load_raw(raw_file, store, geo, [keyword], start, end)
     combined_data = pd.read_csv(combined_file)
     
-    # Convert date to datetime
-    raw_data['date'] = pd.to_datetime(raw_data['date'])
-    
-    # Calculate yearly medians from raw data
-    raw_data['year'] = raw_data['date'].dt.year
-    yearly_medians = raw_data.groupby('year')[keyword].median().reset_index()
-    
     # Get the combined results for the keyword
-    keyword_results = combined_data[combined_data['Keyword'] == keyword].iloc[0]
+    keyword_results = select_geo(combined_data, geo)
+    keyword_results = keyword_results[keyword_results['Keyword'] == keyword]
+    if keyword_results.empty:
+        print(f"Keyword '{keyword}' not found in {combined_file}" + (f" for {geo}" if 'Geo' in combined_data.columns else ''))
+        return
+    if keyword not in raw_data.columns:
+        print(f"No raw time series for keyword '{keyword}'")
+        return
+    
+    # Calculate yearly medians from raw data the same way keyword_analyzer2.py does (median of monthly medians)
+    yearly_medians = yearly_median(raw_data[[keyword]]).reset_index()
     
     print(f"\nVerification for keyword: {keyword}")
     print("\nRaw Data Yearly Medians:")
     print(yearly_medians)
     
     print("\nCombined Results:")
-    for year in range(2021, 2026):
-        if str(year) in keyword_results:
-            print(f"{year}: {keyword_results[str(year)]}")
+    print(keyword_results.to_string(index=False))
     
     # Compare the values
+    comparison = compare_yearly(raw_data[[keyword]], keyword_results.iloc[:1], geo=geo)
     print("\nComparison:")
-    for _, row in yearly_medians.iterrows():
-        year = int(row['year'])  # Convert to int
-        raw_median = row[keyword]
-        combined_value = keyword_results[str(year)]
+    for year, raw_median, combined_value in zip(comparison['year'], comparison['raw'], comparison['combined']):
         print(f"{year}: Raw Median = {raw_median:.2f}, Combined = {combined_value:.2f}")
 
 def main():
@@ -45,11 +152,46 @@ def main():
                       help='Raw time series data file (default: raw_timeseries.csv)')
     parser.add_argument('--combined', '-c', default='combined_results.csv',
                       help='Combined results file (default: combined_results.csv)')
-    parser.add_argument('--keyword', '-k', required=True,
-                      help='Keyword to verify')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--keyword', '-k', help='Keyword to verify')
+    target.add_argument('--all', action='store_true', help='Verify every keyword in the combined results')
+    parser.add_argument('--geo', '-g', default='US', help='Geographic region of the raw series; combined results with a Geo column are verified '
+                           'for this region only (default: US)')
+    add_store_arguments(parser)
+    parser.add_argument('--start', help='First date of the analyzed timeframe; earlier raw data is ignored (default: start of each series)')
+    parser.add_argument('--end', help='Last date of the analyzed timeframe; later raw data is ignored (default: end of each series)')
+    parser.add_argument('--atol', type=float, default=0.0, help='Absolute tolerance for --all (default: 0)')
+    parser.add_argument('--rtol', type=float, default=0.0, help='Relative tolerance for --all, e.g. 0.01 for 1%% (default: 0)')
+    parser.add_argument('--report', help='Save the keyword-years that did not verify to a CSV file, or JSON if the name ends in .json')
+    parser.add_argument('--summary', help='Save the summary statistics to a JSON file')
+    parser.add_argument('--require-all', action='store_true',
+                      help='Fail when a keyword in the combined results has no raw series')
     args = parser.parse_args()
     
-    verify_calculations(args.raw, args.combined, args.keyword)
+    store = TimeseriesStore(args.store) if args.store else None
+    if not args.all:
+        verify_calculations(args.raw, args.combined, args.keyword, store=store, geo=args.geo,
+                            start=args.start, end=args.end)
+        return
+
+    try:
+        comparison, summary = verify_all(args.raw, args.combined, store=store, geo=args.geo,
+                                         atol=args.atol, rtol=args.rtol, require_all=args.require_all,
+                                         start=args.start, end=args.end)
+    except Exception as e:
+        print(f"Error verifying results: {str(e)}")
+        sys.exit(2)
+
+    print(json.dumps(summary, indent=2))
+    if args.report:
+        save_report(comparison[comparison['status'] != 'ok'], args.report)
+        print(f"Mismatch report saved to {args.report}")
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"Summary saved to {args.summary}")
+    # A non-zero exit status lets the verification gate automated runs
+    sys.exit(0 if summary['passed'] else 1)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main() 
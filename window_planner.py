@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Window Planner - Reconstruct long daily or hourly series from overlapping short windows.
+Google Trends only returns daily points for windows up to 269 days and hourly points for windows up to
+7 days, each normalized to its own peak. The range is split into overlapping windows that are fetched
+concurrently under one rate limiter, chained onto a common scale through their overlaps and renormalized to 0-100.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+import pandas as pd
+
+from trends_client import TrendsClient
+from incremental_refresh import MAX_DAILY_WINDOW_DAYS, overlap_ratio
+
+MAX_HOURLY_WINDOW = pd.Timedelta(days=7)
+DEFAULT_OVERLAP = {'daily': pd.Timedelta(days=30), 'hourly': pd.Timedelta(hours=24)}
+# Attempts per window before the stitched series is cut short at it
+MAX_WINDOW_ATTEMPTS = 3
+
+def plan_windows(start: str, end: str, resolution: str = 'daily',
+                 overlap: Optional[pd.Timedelta] = None) -> List[Tuple[pd.Timestamp, pd.Timestamp]]:
+    """
+    Split a date range into the fewest overlapping windows that each return data at the given resolution.
+
+    Args:
+        start (str): First date (or hour) of the range
+        end (str): Last date (or hour) of the range
+        resolution (str): 'daily' or 'hourly'
+        overlap (pd.Timedelta): Span shared by consecutive windows (default: 30 days, or 24 hours for hourly)
+    """
+    if resolution not in DEFAULT_OVERLAP:
+        raise ValueError(f"Unknown resolution: {resolution}")
+    length = pd.Timedelta(days=MAX_DAILY_WINDOW_DAYS) if resolution == 'daily' else MAX_HOURLY_WINDOW
+    overlap = overlap if overlap is not None else DEFAULT_OVERLAP[resolution]
+    if overlap >= length:
+        raise ValueError("The overlap must be shorter than a window")
+
+    start_date, end_date = pd.Timestamp(start), pd.Timestamp(end)
+    windows = []
+    window_start = start_date
+    while True:
+        window_end = min(window_start + length, end_date)
+        windows.append((window_start, window_end))
+        if window_end >= end_date:
+            return windows
+        window_start = window_end - overlap
+
+def window_timeframe(window: Tuple[pd.Timestamp, pd.Timestamp], resolution: str = 'daily') -> str:
+    """Format a window as a Google Trends timeframe; hourly windows need the hour in each bound."""
+    return f"{_format_bound(window[0], resolution)} {_format_bound(window[1], resolution)}"
+
+def _format_bound(bound: pd.Timestamp, resolution: str) -> str:
+    return bound.strftime('%Y-%m-%d' if resolution == 'daily' else '%Y-%m-%dT%H')
+
+def stitch_windows(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Chain window frames (in date order) onto the scale of the first one and renormalize the result to 0-100.
+
+    Every window is rescaled by the ratio of the summed interest of all keywords over the dates it shares with
+    the series stitched so far, which keeps the keywords comparable, and contributes only its dates after them.
+    A window that shares no interest with the series so far cannot be put on its scale, so the series is
+    returned up to that window and the gap is reported, as for a window that could not be fetched.
+    """
+    stitched = None
+    for data in frames:
+        if data.empty:
+            continue
+        columns = [column for column in data.columns if column != 'isPartial']
+        data = data.astype({column: float for column in columns})
+        if stitched is None:
+            stitched = data
+            continue
+        ratio = overlap_ratio(stitched[columns].sum(axis=1), data[columns].sum(axis=1))
+        if ratio is None:
+            print(f"Window starting {data.index[0]} shares no interest with the series so far; "
+                  f"returning the series up to {stitched.index[-1]}, the range after it is missing.")
+            break
+        data[columns] = data[columns] * ratio
+        # The overlap keeps the values already stitched, except for points that were still partial
+        stitched = stitched[~stitched['isPartial'].astype(bool) | (stitched.index < data.index[0])]
+        stitched = pd.concat([stitched, data[data.index > stitched.index[-1]]])
+
+    if stitched is None:
+        return pd.DataFrame()
+    columns = [column for column in stitched.columns if column != 'isPartial']
+    peak = stitched[columns].to_numpy().max()
+    if peak > 0:
+        stitched[columns] = (stitched[columns] / peak * 100).round(2)
+    stitched['isPartial'] = stitched['isPartial'].astype(bool)
+    return stitched
+
+def fetch_stitched(keywords: List[str], start: str, end: str, geo: str = 'US', resolution: str = 'daily',
+                   client_factory: Callable[[], TrendsClient] = TrendsClient, workers: int = 2,
+                   overlap: Optional[pd.Timedelta] = None) -> pd.DataFrame:
+    """
+    Fetch a long range at daily or hourly resolution for up to 5 keywords and stitch it into one series.
+
+    A window that fails is retried on its own (up to MAX_WINDOW_ATTEMPTS times). If it still fails, the windows
+    before it are stitched and returned and the gap is reported; later windows could not be put on their scale.
+
+    Args:
+        keywords (list): Up to 5 keywords, kept on one common scale
+        start (str): First date (or hour, as 'YYYY-MM-DDTHH') of the range
+        end (str): Last date (or hour) of the range
+        geo (str): Geographic region
+        resolution (str): 'daily' or 'hourly'
+        client_factory (callable): Creates the client of each worker; give them one shared rate limiter
+            so the workers stay within a single rate budget
+        workers (int): Number of windows fetched concurrently
+        overlap (pd.Timedelta): Span shared by consecutive windows
+    """
+    if len(keywords) > 5:
+        raise ValueError("At most 5 keywords can be stitched on one scale")
+    windows = plan_windows(start, end, resolution, overlap)
+    print(f"Fetching {len(windows)} {resolution} windows from {start} to {end} with {workers} workers")
+    clients = [client_factory() for _ in range(max(1, min(workers, len(windows))))]
+
+    failed = [len(windows)]
+    failed_lock = threading.Lock()
+
+    def fetch(position: int) -> Optional[pd.DataFrame]:
+        # Windows are assigned round-robin, so no client is used by two threads at once
+        client = clients[position % len(clients)]
+        timeframe = window_timeframe(windows[position], resolution)
+        for attempt in range(1, MAX_WINDOW_ATTEMPTS + 1):
+            if position > failed[0]:
+                # An earlier window failed, so this one could not be stitched anyway
+                return None
+            try:
+                return client.interest_over_time(keywords, timeframe, geo)
+            except Exception as e:
+                print(f"Error fetching window {timeframe} (attempt {attempt}/{MAX_WINDOW_ATTEMPTS}): {str(e)}")
+        with failed_lock:
+            failed[0] = min(failed[0], position)
+        return None
+
+    with ThreadPoolExecutor(max_workers=len(clients)) as executor:
+        futures = {}
+        for position in range(len(windows)):
+            futures[position] = executor.submit(_run_after, futures.get(position - len(clients)), fetch, position)
+        frames = [futures[position].result() for position in range(len(windows))]
+
+    if failed[0] < len(windows):
+        covered = windows[failed[0] - 1][1] if failed[0] else pd.Timestamp(start)
+        print(f"Window {window_timeframe(windows[failed[0]], resolution)} could not be fetched; "
+              f"returning the series up to {_format_bound(covered, resolution)}, the range from there to {end} is missing.")
+        frames = frames[:failed[0]]
+    return stitch_windows(frames)
+
+def _run_after(previous, fetch: Callable[[int], pd.DataFrame], position: int) -> pd.DataFrame:
+    """Wait for the previous window of the same client, then fetch this one."""
+    if previous is not None:
+        previous.result()
+    return fetch(position)